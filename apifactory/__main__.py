@@ -0,0 +1,4 @@
+"""Runs the apifactory command, python -m apifactory serve config.yaml"""
+from apifactory.serve import main
+
+main()
@@ -0,0 +1,158 @@
+"""Module containing admission control for the generated endpoints.
+Limits the amount of concurrent requests per endpoint class (read, write, bulk and export).
+Requests exceeding the limit wait in a bounded queue, requests that do not fit in the queue
+or wait longer than the deadline are shed with a http 503 error.
+"""
+import asyncio
+import math
+from collections import deque
+from typing import Dict, Optional
+
+from fastapi import Request, Response, status
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+from apifactory.routing import Handler, after_body, request_class
+
+
+class ConcurrencyLimiter:
+    # pylint: disable=C0301
+    """Limits the amount of concurrently running requests.
+
+    :param limit: Maximum amount of concurrently running requests.
+    :type limit: int
+    :param queue: Maximum amount of requests waiting for a slot, defaults to 0
+    :type queue: int, optional
+    :param timeout: Seconds a request waits for a slot before it is rejected, defaults to 1.0
+    :type timeout: float, optional
+
+
+    >>> limiter = ConcurrencyLimiter(10, queue=20, timeout=2)
+    >>> if await limiter.acquire():
+    ...     try:
+    ...         "handle request"
+    ...     finally:
+    ...         limiter.release()
+    """
+    # pylint: enable=C0301
+
+    def __init__(self, limit: int, queue: int = 0, timeout: float = 1.0) -> None:
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiters: deque = deque()
+
+    async def acquire(self) -> bool:
+        """Acquire a slot, waiting in the queue if all slots are taken.
+
+        :return: Whether a slot was acquired.
+        :rtype: bool
+        """
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return True
+        if len(self.waiters) >= self.queue:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            # release hands over its slot by setting the result of the waiter
+            return await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def release(self) -> None:
+        """Release a slot, handing it over to the first waiting request."""
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+
+class AdmissionControl:
+    # pylint: disable=C0301
+    """Admission control for the generated routes.
+    Every endpoint class has its own ConcurrencyLimiter.
+    Endpoint classes without configuration are not limited.
+
+    :param limits: Dictionary containing the limit, queue size, timeout and optionally the retry_after header value per endpoint class.
+    :type limits: Dict[str, dict]
+
+    Bulk requests are put and delete requests on multiple entries and posts containing a list.
+
+
+    >>> admission = AdmissionControl(
+    ...    {
+    ...        "read": {"limit": 50, "queue": 100, "timeout": 2},
+    ...        "bulk": {"limit": 2, "queue": 4, "timeout": 10, "retry_after": 30},
+    ...    }
+    ... )
+    """
+    # pylint: enable=C0301
+
+    def __init__(self, limits: Dict[str, dict]) -> None:
+        self.limiters: Dict[str, ConcurrencyLimiter] = {}
+        self.retry_after: Dict[str, int] = {}
+        for kind, config in limits.items():
+            self.limiters[kind] = ConcurrencyLimiter(
+                config["limit"],
+                queue=config.get("queue", 0),
+                timeout=config.get("timeout", 1.0),
+            )
+            self.retry_after[kind] = config.get(
+                "retry_after", max(math.ceil(config.get("timeout", 1.0)), 1)
+            )
+
+    def limiter(self, kind: Optional[str]) -> Optional[ConcurrencyLimiter]:
+        """Returns the limiter of an endpoint class.
+
+        :param kind: Name of the endpoint class.
+        :type kind: Optional[str]
+        :return: Limiter of the endpoint class, None if the class is not limited.
+        :rtype: Optional[ConcurrencyLimiter]
+        """
+        return self.limiters.get(kind)
+
+    def route_hook(self, route: APIRoute, handler: Handler) -> Handler:
+        """Route hook wrapping the handler of a route with admission control.
+        Streamed responses keep their slot until the body is sent.
+
+        :param route: Route to wrap.
+        :type route: APIRoute
+        :param handler: Request handler of the route.
+        :type handler: Handler
+        :return: Request handler shedding requests that cannot be admitted.
+        :rtype: Handler
+        """
+
+        async def admitted_handler(request: Request) -> Response:
+            kind = await request_class(route, request)
+            limiter = self.limiter(kind)
+            if not limiter:
+                return await handler(request)
+            if not await limiter.acquire():
+                return JSONResponse(
+                    {"detail": f"Too many concurrent {kind} requests"},
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={"Retry-After": str(self.retry_after[kind])},
+                )
+            streamed = False
+            try:
+                response = await handler(request)
+                streamed = after_body(response, lambda _: limiter.release())
+                return response
+            finally:
+                if not streamed:
+                    limiter.release()
+
+        return admitted_handler
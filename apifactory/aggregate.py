@@ -0,0 +1,228 @@
+"""Module containing the server side aggregation of tables.
+An aggregation groups the filtered entries of a table by some of its columns and computes
+count, sum, avg, min and max metrics per group in a single GROUP BY query,
+so clients needing totals do not have to page through every entry.
+"""
+import datetime
+import decimal
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import Column, Table, func
+from sqlalchemy.orm import Session
+
+from apifactory.utils import column_filters, param_invalid
+
+METRICS = {
+    "count": func.count,
+    "sum": func.sum,
+    "avg": func.avg,
+    "min": func.min,
+    "max": func.max,
+}
+NUMERIC_TYPES = (int, float, decimal.Decimal)
+ORDERED_TYPES = NUMERIC_TYPES + (
+    str,
+    datetime.date,
+    datetime.datetime,
+    datetime.time,
+    datetime.timedelta,
+)
+# metrics restricted to columns of some python types, count takes any column
+METRIC_TYPES = {
+    "sum": NUMERIC_TYPES,
+    "avg": NUMERIC_TYPES,
+    "min": ORDERED_TYPES,
+    "max": ORDERED_TYPES,
+}
+RESERVED = ("group_by", "metrics")
+
+
+def python_type(column: Column) -> Optional[type]:
+    """Python type of a reflected column, None for types without one."""
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def split(value: Optional[str]) -> List[str]:
+    """Items of a comma separated query parameter."""
+    if not value:
+        return []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def bad_request(detail: str) -> None:
+    """Raises http 400 error for invalid aggregations."""
+    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+
+class Aggregator:
+    # pylint: disable=C0301
+    """Aggregates the entries of tables with a GROUP BY query, optionally caching the results.
+
+    :param max_groups: Maximum amount of groups of an aggregation, larger results are rejected with http 413, defaults to 10000
+    :type max_groups: int, optional
+    :param cache_ttl: Seconds results are cached, by table, grouping, metrics and filters, defaults to 0, no caching
+    :type cache_ttl: float, optional
+    :param cache_size: Maximum amount of cached results, the least recently used are evicted first, defaults to 256
+    :type cache_size: int, optional
+
+
+    >>> aggregator = Aggregator(cache_ttl=60)
+    >>> aggregator.aggregate(db, model, "someothercoll", "count,max:primarykey", {})
+    [{"someothercoll": "posty", "count": 1, "max_primarykey": 0}]
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self, max_groups: int = 10000, cache_ttl: float = 0, cache_size: int = 256
+    ) -> None:
+        self.max_groups = max_groups
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.cache: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def group_columns(model: Table, group_by: Optional[str]) -> List[Column]:
+        """Columns of the group_by parameter, comma separated column names."""
+        columns = []
+        for name in split(group_by):
+            if name not in model.__table__.columns:
+                param_invalid(model, f"group_by {name}")
+            columns.append(getattr(model, name))
+        return columns
+
+    @staticmethod
+    def metric_columns(model: Table, metrics: Optional[str]) -> list:
+        # pylint: disable=C0301
+        """Labelled metric expressions of the metrics parameter.
+        Metrics are comma separated, count counts the entries, count:column the values of a column
+        and sum, avg, min and max take a column like sum:column. The metrics are labelled count or metric_column.
+
+        :param model: SQLalchemy model of the table.
+        :type model: Table
+        :param metrics: Value of the metrics parameter.
+        :type metrics: Optional[str]
+        :raises HTTPException: Raises http 400 error for unknown metrics and columns and for columns of a type the metric does not support.
+        :return: Labelled metric expressions.
+        :rtype: list
+        """
+        # pylint: enable=C0301
+        expressions = []
+        for metric in split(metrics) or ["count"]:
+            name, _, column_name = metric.partition(":")
+            if name not in METRICS:
+                bad_request(f"Unknown metric {name}, use {', '.join(METRICS)}")
+            if not column_name:
+                if name != "count":
+                    bad_request(f"Metric {name} requires a column, use {name}:column")
+                expressions.append(func.count().label("count"))
+                continue
+            if column_name not in model.__table__.columns:
+                param_invalid(model, f"metrics {column_name}")
+            column = getattr(model, column_name)
+            allowed = METRIC_TYPES.get(name)
+            column_type = python_type(column)
+            if allowed and (
+                column_type is None
+                or column_type is bool
+                or not issubclass(column_type, allowed)
+            ):
+                bad_request(f"Metric {name} is not supported for column {column_name}")
+            expressions.append(METRICS[name](column).label(f"{name}_{column_name}"))
+        return expressions
+
+    def cache_key(
+        self,
+        model: Table,
+        group_by: Optional[str],
+        metrics: Optional[str],
+        query_params: Mapping[str, str],
+    ) -> Tuple:
+        """Key of a cached result, the filters are sorted so their order does not matter."""
+        filters = sorted(
+            (param, value)
+            for param, value in query_params.items()
+            if param not in RESERVED
+        )
+        return (
+            model.__name__,
+            tuple(split(group_by)),
+            tuple(split(metrics)),
+            tuple(filters),
+        )
+
+    def cached(self, key: Tuple) -> Optional[List[Dict[str, Any]]]:
+        """Cached result of a key, None if it is not cached or expired."""
+        with self.lock:
+            item = self.cache.get(key)
+            if item is None:
+                return None
+            expires, result = item
+            if expires < time.monotonic():
+                del self.cache[key]
+                return None
+            self.cache.move_to_end(key)
+            return result
+
+    def store(self, key: Tuple, result: List[Dict[str, Any]]) -> None:
+        """Caches a result, evicting the least recently used results beyond cache_size."""
+        with self.lock:
+            self.cache[key] = (time.monotonic() + self.cache_ttl, result)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def aggregate(
+        self,
+        db: Session,
+        model: Table,
+        group_by: Optional[str],
+        metrics: Optional[str],
+        query_params: Mapping[str, str],
+    ) -> List[Dict[str, Any]]:
+        # pylint: disable=C0301
+        """Aggregates the filtered entries of a table with a single GROUP BY query.
+
+        :param db: Database session.
+        :type db: Session
+        :param model: SQLalchemy model of the table.
+        :type model: Table
+        :param group_by: Comma separated columns to group by, None for a single group of all entries.
+        :type group_by: Optional[str]
+        :param metrics: Comma separated metrics, see metric_columns, None for count.
+        :type metrics: Optional[str]
+        :param query_params: Query parameters of the request, column filters like the get all route.
+        :type query_params: Mapping[str, str]
+        :raises HTTPException: Raises http 400 error for invalid aggregations and http 413 error for more than max_groups groups.
+        :return: A row per group with the group columns and the metrics, ordered by the group columns.
+        :rtype: List[Dict[str, Any]]
+        """
+        # pylint: enable=C0301
+        columns = self.group_columns(model, group_by)
+        expressions = self.metric_columns(model, metrics)
+        conditions = column_filters(model, query_params, RESERVED)
+        key = self.cache_key(model, group_by, metrics, query_params)
+        if self.cache_ttl:
+            result = self.cached(key)
+            if result is not None:
+                return result
+        query = db.query(*columns, *expressions).filter(*conditions)
+        if columns:
+            query = query.group_by(*columns).order_by(*columns)
+        rows = query.limit(self.max_groups + 1).all()
+        if len(rows) > self.max_groups:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"An aggregation returns at most {self.max_groups} groups",
+            )
+        result = [dict(row._mapping) for row in rows]  # pylint: disable=W0212
+        if self.cache_ttl:
+            self.store(key, result)
+        return result
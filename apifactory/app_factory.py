@@ -3,6 +3,7 @@ Used for creating a fully fledged instance of a FastAPI app,
 that nearly automatically handles and secures your api.
 """
 
+from functools import partial
 from json import load as jsonload
 from yaml import load, Loader
 from fastapi import FastAPI
@@ -13,11 +14,41 @@ from slowapi.middleware import SlowAPIMiddleware
 from fastapi_pagination import add_pagination
 
 
+from apifactory.admission import AdmissionControl
+from apifactory.aggregate import Aggregator
+from apifactory.batch import Batch
+from apifactory.changes import ChangeFeeds
+from apifactory.compression import CompressionMiddleware
+from apifactory.executors import Executors
+from apifactory.expand import Expansion
+from apifactory.ingest import BulkIngest
+from apifactory.export import ArrowExport
+from apifactory.jobs import Jobs
+from apifactory.metrics import Metrics
+from apifactory.negotiation import ContentNegotiation
+from apifactory.openapi import OpenApiCache, models_fingerprint
+from apifactory.routing import materialize_lazy_routes
+from apifactory.profiling import Profiler, ProfilingMiddleware
+from apifactory.querystats import (
+    QueryBudgetExceeded,
+    QueryInstrumentation,
+    query_budget_handler,
+)
+from apifactory.ratelimit import RouteLimiter
 from apifactory.route_factory import Routers
 from apifactory.security import Security
 from apifactory.utils import add_routes
 from apifactory.database import Database
 from apifactory.schemas import Schemas
+from apifactory.slowqueries import SlowQueryLog
+from apifactory.subscriptions import Subscriptions
+from apifactory.timeouts import (
+    StatementCancelledError,
+    StatementTimeoutError,
+    StatementTimeouts,
+    statement_cancelled_handler,
+    statement_timeout_handler,
+)
 
 
 class ApiFactory:
@@ -61,24 +92,161 @@ class ApiFactory:
         **kwargs,
     ):
 
+        # optional arguments are passed only when set, custom database classes may not accept them
+        database_kwargs = {
+            name: kwargs[name]
+            for name in ("pools", "replica_urls", "replica_strategy", "read_your_writes")
+            if kwargs.get(name) is not None
+        }
         self.db = database(
             database_url,
             engine_kwargs=kwargs.get("engine_kwargs", None),
             views=config.get("views", None),
+            **database_kwargs,
         )
-        rate_limit = kwargs.get("ratelimit")
+        self.lazy = kwargs.get("lazy", False)
+        # deferred columns are left out of the response schemas and read with a route of their own
+        deferred = {
+            name: table_config["deferred_columns"]
+            for name, table_config in config.items()
+            if isinstance(table_config, dict) and table_config.get("deferred_columns")
+        }
+        schemas_kwargs = {"lazy": True} if self.lazy else {}
+        if deferred:
+            schemas_kwargs["deferred"] = deferred
+        self.schemas = schemas(self.db.models, **schemas_kwargs)
+        usermodel = getattr(self.db.models, usermodel_name)
+        userschema = getattr(self.schemas, usermodel_name)
+        self.security = security(usermodel, self.db.get_db, jwt_key)
+        # read_your_writes tells clients apart by the subject of their token
+        self.db.client_key = self.security.subject_or_address
 
+        rate_limit = kwargs.get("ratelimit")
+        ratelimit_key = kwargs.get("ratelimit_key", "ip")
+        key_funcs = {
+            "ip": get_remote_address,
+            "user": self.security.subject_or_address,
+        }
+        if ratelimit_key not in key_funcs:
+            raise ValueError(
+                f"ratelimit_key {ratelimit_key} is not one of {', '.join(key_funcs)}"
+            )
         self.limiter = Limiter(
-            key_func=get_remote_address,
+            key_func=key_funcs[ratelimit_key],
             default_limits=[rate_limit],
             enabled=bool(rate_limit),
         )
+        self.route_limiter = RouteLimiter(
+            key_funcs=key_funcs,
+            default_key=ratelimit_key,
+            storage_uri=kwargs.get("ratelimit_storage", "memory://"),
+        )
 
-        self.schemas = schemas(self.db.models)
-        usermodel = getattr(self.db.models, usermodel_name)
-        userschema = getattr(self.schemas, usermodel_name)
-        self.security = security(usermodel, self.db.get_db, jwt_key)
+        self.route_hooks = []
+        metrics = kwargs.get("metrics")
+        self.metrics_route = "/metrics"
+        if isinstance(metrics, dict):
+            self.metrics_route = metrics.get("route", self.metrics_route)
+        self.metrics = (
+            Metrics(self.db.sessionmakers, self.db.named_engines()) if metrics else None
+        )
+        if self.metrics:
+            # outermost hook, so requests shed by admission control are counted too
+            self.route_hooks.append(self.metrics.route_hook)
+        query_stats = kwargs.get("query_stats")
+        self.query_stats = (
+            QueryInstrumentation(
+                self.db.all_engines(),
+                config,
+                **(query_stats if isinstance(query_stats, dict) else {}),
+            )
+            if query_stats
+            else None
+        )
+        if self.query_stats:
+            self.route_hooks.append(self.query_stats.route_hook)
+        slow_queries = kwargs.get("slow_queries")
+        self.slow_queries = (
+            SlowQueryLog(
+                self.db.all_engines(),
+                **(slow_queries if isinstance(slow_queries, dict) else {}),
+            )
+            if slow_queries
+            else None
+        )
+        if self.slow_queries:
+            self.route_hooks.append(self.slow_queries.route_hook)
+        admission = kwargs.get("admission")
+        self.admission = AdmissionControl(admission) if admission else None
+        if self.admission:
+            self.route_hooks.append(self.admission.route_hook)
+        formats = kwargs.get("formats")
+        self.negotiation = ContentNegotiation(formats) if formats else None
+        if self.negotiation:
+            self.route_hooks.append(self.negotiation.route_hook)
+        export = kwargs.get("export")
+        self.exporter = (
+            ArrowExport(**(export if isinstance(export, dict) else {}))
+            if export
+            else None
+        )
+        aggregate = kwargs.get("aggregate")
+        self.aggregator = (
+            Aggregator(**(aggregate if isinstance(aggregate, dict) else {}))
+            if aggregate
+            else None
+        )
+        expand = kwargs.get("expand")
+        self.expansion = (
+            Expansion(self.schemas, **(expand if isinstance(expand, dict) else {}))
+            if expand
+            else None
+        )
+        bulk_ingest = kwargs.get("bulk_ingest")
+        self.ingest = (
+            BulkIngest(**(bulk_ingest if isinstance(bulk_ingest, dict) else {}))
+            if bulk_ingest
+            else None
+        )
+        jobs = kwargs.get("jobs")
+        # jobs write with the sessions of the bulk endpoint class
+        self.jobs = (
+            Jobs(
+                self.db.session_getters.get("bulk", self.db.get_db),
+                **(jobs if isinstance(jobs, dict) else {}),
+            )
+            if jobs
+            else None
+        )
+        compression = kwargs.get("compression")
+        self.compression = None
+        if compression:
+            self.compression = compression if isinstance(compression, dict) else {}
+        executors = kwargs.get("executors")
+        self.executors = Executors(executors) if executors else None
+        profiling = kwargs.get("profiling")
+        self.profiler = Profiler(**profiling) if profiling else None
+        self.timeouts = StatementTimeouts(
+            self.db.all_engines(),
+            default_timeout=kwargs.get("statement_timeout"),
+            cancel_on_disconnect=kwargs.get("cancel_on_disconnect", False),
+        )
 
+        subscriptions = kwargs.get("subscriptions")
+        self.subscriptions = (
+            Subscriptions(**(subscriptions if isinstance(subscriptions, dict) else {}))
+            if subscriptions
+            else None
+        )
+        changes = ChangeFeeds(
+            self.db.models,
+            config,
+            self.db.engine,
+            tombstone_table_name=kwargs.get("tombstone_table", "apifactory_tombstones"),
+        )
+        self.changes = changes if changes.feeds else None
+        self.openapi = kwargs.get("openapi") or {}
+        self.openapi_cache = None
         self.routers = routers(
             self.db.models,
             self.schemas,
@@ -86,6 +254,37 @@ class ApiFactory:
             self.db.get_db,
             self.security.get_current_user,
             userschema,
+            limiter=self.route_limiter,
+            route_hooks=self.route_hooks,
+            executors=self.executors,
+            get_db_for=self.db.session_getter,
+            timeouts=self.timeouts,
+            profiler=self.profiler,
+            negotiation=self.negotiation,
+            exporter=self.exporter,
+            aggregator=self.aggregator,
+            expansion=self.expansion,
+            ingest=self.ingest,
+            jobs=self.jobs,
+            changes=self.changes,
+            subscriptions=self.subscriptions,
+            lazy=self.lazy,
+        )
+        batch = kwargs.get("batch")
+        self.batch = (
+            Batch(
+                self.db.models,
+                self.schemas,
+                config,
+                self.routers.router_names,
+                self.db.models.view_names,
+                changes=self.changes,
+                subscriptions=self.subscriptions,
+                limiter=self.route_limiter,
+                **(batch if isinstance(batch, dict) else {}),
+            )
+            if batch
+            else None
         )
         self.config = config
 
@@ -104,14 +303,62 @@ class ApiFactory:
 
         """
 
-        app = FastAPI()
+        # the openapi document and the docs are served by the OpenApiCache
+        app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None)
 
         app.state.limiter = self.limiter
         app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+        app.add_exception_handler(StatementTimeoutError, statement_timeout_handler)
+        app.add_exception_handler(StatementCancelledError, statement_cancelled_handler)
+        app.add_exception_handler(QueryBudgetExceeded, query_budget_handler)
         app.add_middleware(SlowAPIMiddleware)
+        if self.profiler:
+            app.add_middleware(ProfilingMiddleware, profiler=self.profiler)
+        if self.compression is not None:
+            # outermost, so responses of every middleware and route are compressed
+            app.add_middleware(CompressionMiddleware, **self.compression)
+        if self.executors:
+            app.add_event_handler("shutdown", self.executors.shutdown)
+        if self.db.replicas:
+            app.add_event_handler("shutdown", self.db.replicas.stop)
+        if self.subscriptions:
+            app.add_event_handler("shutdown", self.subscriptions.close)
+        if self.jobs:
+            app.add_event_handler("startup", self.jobs.start)
+            app.add_event_handler("shutdown", self.jobs.shutdown)
         app = add_routes(self.routers, app)
+        if self.metrics:
+            app.add_api_route(
+                self.metrics_route, self.metrics.endpoint, include_in_schema=False
+            )
         app.include_router(self.security.login)
+        if self.slow_queries and self.slow_queries.admin_users:
+            app.include_router(self.slow_queries.router(self.security.get_current_user))
+        if self.jobs:
+            app.include_router(self.jobs.router(self.security.get_current_user))
+        if self.batch:
+            app.include_router(
+                self.batch.router(
+                    self.db.session_getter("bulk"),
+                    self.security.get_current_user,
+                    route_hooks=self.route_hooks,
+                    executors=self.executors,
+                )
+            )
         app = add_pagination(app)
+        openapi_kwargs = {}
+        if self.lazy:
+            # the document is complete once every table has its routes
+            openapi_kwargs = {
+                "fingerprint": partial(models_fingerprint, self.db.models, self.config),
+                "prepare": partial(materialize_lazy_routes, app),
+            }
+        self.openapi_cache = OpenApiCache(
+            app, directory=self.openapi.get("directory"), **openapi_kwargs
+        )
+        self.openapi_cache.install()
+        if self.openapi.get("precompute", False):
+            self.openapi_cache.build()
         return app
 
     @classmethod
@@ -0,0 +1,438 @@
+"""Module containing the batch endpoint of the app.
+A batch is an ordered list of get, post, put and delete operations on any table of the api,
+run on one session and committed in one transaction.
+Authentication and the global ratelimit are checked once for the whole batch,
+the dependencies in the *_kwargs of the routes of its operations once per dependency
+and the ratelimits of those routes by the amount of operations.
+"""
+from typing import Callable, Collection, Dict, List, Optional, Sequence, Tuple, Union
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.dependencies.models import Dependant
+from fastapi.dependencies.utils import (
+    get_parameterless_sub_dependant,
+    solve_dependencies,
+)
+from fastapi.exceptions import RequestValidationError
+from limits import parse_many
+from pydantic import BaseModel, Field, ValidationError, parse_obj_as
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, defer
+
+from apifactory.changes import ChangeFeeds
+from apifactory.executors import Executors
+from apifactory.ratelimit import RouteLimiter
+from apifactory.routing import RouteHook, hooked_route_class
+from apifactory.subscriptions import Subscriptions
+from apifactory.utils import (
+    column_filters,
+    exclude_columns,
+    model_with_optional_fields,
+    not_found,
+    primary_key_checker,
+)
+
+
+class Operation(BaseModel):
+    # pylint: disable=C0301
+    """A single operation of a batch.
+
+    :param method: get, post, put or delete.
+    :param table: Name of the table or view.
+    :param key: Primary key of the entry, without a key get returns the filtered entries and put and delete take a list of entries.
+    :param body: Entry or list of entries to post or put, or the primary keys to delete.
+    :param params: Column filters of a get without key.
+    """
+    # pylint: enable=C0301
+
+    method: str = Field(..., regex="^(get|post|put|delete)$")
+    table: str
+    key: Optional[Union[int, str]] = None
+    body: Optional[Union[List[dict], dict]] = None
+    params: Dict[str, str] = {}
+
+
+class Batch:
+    # pylint: disable=C0301
+    """Runs batches of operations on the tables of the api in a single transaction.
+    A failing operation rolls back the whole batch, the error names the position of the operation.
+
+    :param models: Models object containing all SQLalchemy models for the API.
+    :type models: Models
+    :param schemas: Schemas object containing all pydantic schemas for the API.
+    :type schemas: Schemas
+    :param configs: Dictionary containing the configuration of the tables.
+    :type configs: dict
+    :param table_names: Names of the tables and views operations are allowed on, like Routers.router_names.
+    :type table_names: Collection[str]
+    :param view_names: Names of the views, only get operations are allowed on views.
+    :type view_names: Collection[str]
+    :param route: Route of the batch endpoint, defaults to "/batch"
+    :type route: str, optional
+    :param max_operations: Maximum amount of operations of a batch, defaults to 100
+    :type max_operations: int, optional
+    :param max_rows: Maximum amount of entries returned by a get without key, defaults to 1000
+    :type max_rows: int, optional
+    :param changes: Change feeds recording tombstones of deleted entries, defaults to None
+    :type changes: Optional[ChangeFeeds], optional
+    :param subscriptions: Broker publishing the writes of committed batches to subscribers, defaults to None
+    :type subscriptions: Optional[Subscriptions], optional
+    :param limiter: Route limiter charging the operations against the ratelimits of the routes of their tables, defaults to None
+    :type limiter: Optional[RouteLimiter], optional
+
+
+    >>> batch = Batch(db.models, schemas, config, routers.router_names, db.models.view_names)
+    >>> client.post("/batch", json=[{"method": "get", "table": "test_table", "key": 1}])
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        models,
+        schemas,
+        configs: dict,
+        table_names: Collection[str],
+        view_names: Collection[str],
+        route: str = "/batch",
+        max_operations: int = 100,
+        max_rows: int = 1000,
+        changes: Optional[ChangeFeeds] = None,
+        subscriptions: Optional[Subscriptions] = None,
+        limiter: Optional[RouteLimiter] = None,
+    ) -> None:
+        self.models = models
+        self.schemas = schemas
+        self.configs = configs
+        self.table_names = table_names
+        self.view_names = view_names
+        self.route = route
+        self.max_operations = max_operations
+        self.max_rows = max_rows
+        self.changes = changes
+        self.subscriptions = subscriptions
+        self.limiter = limiter
+        self.optional_schemas: dict = {}
+
+    def optional_schema(self, table: str):
+        """Schema of a table with all fields optional, as used by post and put."""
+        if table not in self.optional_schemas:
+            self.optional_schemas[table] = model_with_optional_fields(
+                getattr(self.schemas, table)
+            )
+        return self.optional_schemas[table]
+
+    def entries(self, operation: Operation) -> List[dict]:
+        """Validates the body of a post or put into the column values of its entries."""
+        body = operation.body
+        if body is None:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"{operation.method} requires a body",
+            )
+        schema = self.optional_schema(operation.table)
+        entries = body if isinstance(body, list) else [body]
+        return [schema(**entry).dict() for entry in entries]
+
+    def excluded(self, operation: Operation, content: dict, excluded_key: str) -> dict:
+        """Removes the columns excluded in the configuration of the table from an entry."""
+        excluded_columns = self.configs.get(operation.table, {}).get(excluded_key)
+        if excluded_columns:
+            return exclude_columns(content, excluded_columns)
+        return content
+
+    def get(self, db: Session, operation: Operation):
+        """Returns the entry with the key of the operation, or the filtered entries."""
+        model = getattr(self.models, operation.table)
+        # deferred columns are left out like in get and get_id
+        schema = self.schemas.response_schema(operation.table)
+        deferred_columns = self.configs.get(operation.table, {}).get(
+            "deferred_columns", []
+        )
+        load_options = [defer(getattr(model, name)) for name in deferred_columns]
+        key_name, column = primary_key_checker(model)
+        query = db.query(model).options(*load_options)
+        if operation.key is not None:
+            entry = query.filter(column == operation.key).first()
+            if not entry:
+                not_found(model, key_name, operation.key)
+            return schema.from_orm(entry)
+        entries = (
+            query.filter(*column_filters(model, operation.params))
+            .order_by(column)
+            .limit(self.max_rows)
+        )
+        return [schema.from_orm(entry) for entry in entries]
+
+    def post(self, db: Session, operation: Operation, events: list):
+        """Inserts the entries of the operation, returning its body like post."""
+        model = getattr(self.models, operation.table)
+        key_name, _ = primary_key_checker(model)
+        for content in self.entries(operation):
+            content = self.excluded(operation, content, "excluded_columns_post")
+            db.add(model(**content))
+            events.append((operation.table, "insert", content.get(key_name), content))
+        return operation.body
+
+    def put(self, db: Session, operation: Operation, events: list) -> str:
+        """Updates the entry with the key of the operation.
+        Without key inserts or updates a list of entries.
+        """
+        model = getattr(self.models, operation.table)
+        key_name, column = primary_key_checker(model)
+        if operation.key is not None:
+            db_item = db.query(model).filter(column == operation.key)
+            if not db_item.first():
+                not_found(model, key_name, operation.key)
+            for content in self.entries(operation):
+                content = self.excluded(operation, content, "excluded_columns_put")
+                db_item.update(content)
+                events.append(
+                    (
+                        operation.table,
+                        "update",
+                        operation.key,
+                        {**content, key_name: operation.key},
+                    )
+                )
+            return "updated"
+        for content in self.entries(operation):
+            primary_key = content[key_name]
+            content = self.excluded(operation, content, "excluded_columns_put")
+            db_item = db.query(model).filter(column == primary_key)
+            if not db_item.first():
+                content[key_name] = primary_key
+                db.add(model(**content))
+                events.append((operation.table, "insert", primary_key, content))
+            else:
+                db_item.update(content)
+                events.append(
+                    (
+                        operation.table,
+                        "update",
+                        primary_key,
+                        {**content, key_name: primary_key},
+                    )
+                )
+        return "updated"
+
+    def delete(self, db: Session, operation: Operation, events: list) -> str:
+        """Deletes the entry with the key of the operation.
+        Without key deletes the entries whose keys are in the body.
+        """
+        model = getattr(self.models, operation.table)
+        key_name, column = primary_key_checker(model)
+        feed = self.changes.feed(operation.table) if self.changes else None
+        if operation.key is not None:
+            db_item = db.query(model).filter(column == operation.key)
+            if not db_item.first():
+                not_found(model, key_name, operation.key)
+            db_item.delete(synchronize_session=False)
+            if feed:
+                feed.record_deletes(db, [operation.key])
+            events.append((operation.table, "delete", operation.key, None))
+            return f"record with primary key: {operation.key} deleted"
+        body = operation.body if isinstance(operation.body, list) else [operation.body]
+        key_list = [entry.get(key_name) for entry in body if entry]
+        if feed or self.subscriptions:
+            # tombstones and events only for the keys that exist
+            key_list = [key for (key,) in db.query(column).filter(column.in_(key_list))]
+        db.query(model).filter(column.in_(key_list)).delete(synchronize_session=False)
+        if feed:
+            feed.record_deletes(db, key_list)
+        events.extend((operation.table, "delete", key, None) for key in key_list)
+        return "records deleted"
+
+    def run_operation(self, db: Session, operation: Operation, events: list):
+        """Runs a single operation, flushing its writes so their errors belong to it.
+        The events of its writes are added to events, to publish them after the commit.
+        """
+        if operation.table not in self.table_names:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"table {operation.table} does not exist",
+            )
+        if operation.method != "get" and operation.table in self.view_names:
+            raise HTTPException(
+                status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
+                detail=f"{operation.table} is a view, only get is allowed",
+            )
+        if operation.method == "get":
+            result = self.get(db, operation)
+        else:
+            result = getattr(self, operation.method)(db, operation, events)
+        db.flush()
+        return result
+
+    def run(self, db: Session, operations: Sequence[Operation]) -> list:
+        # pylint: disable=C0301
+        """Runs the operations of a batch in order and commits them in one transaction.
+        The writes of a committed batch are published to the subscribers of their tables.
+
+        :param db: Database session.
+        :type db: Session
+        :param operations: Operations of the batch.
+        :type operations: Sequence[Operation]
+        :raises HTTPException: Raises the http error of the first failing operation, with its position in the batch, after rolling back the batch.
+        :return: Results of the operations in order.
+        :rtype: list
+        """
+        # pylint: enable=C0301
+        if len(operations) > self.max_operations:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"A batch holds at most {self.max_operations} operations",
+            )
+        results = []
+        events: list = []
+        for position, operation in enumerate(operations):
+            try:
+                results.append(self.run_operation(db, operation, events))
+            except HTTPException as error:
+                db.rollback()
+                raise HTTPException(
+                    status_code=error.status_code,
+                    detail={"operation": position, "detail": error.detail},
+                ) from error
+            except ValidationError as error:
+                db.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail={"operation": position, "detail": error.errors()},
+                ) from error
+            except IntegrityError as error:
+                db.rollback()
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail={
+                        "operation": position,
+                        "detail": str(error.orig).splitlines()[0],
+                    },
+                ) from error
+        db.commit()
+        if self.subscriptions:
+            for event in events:
+                self.subscriptions.publish(*event)
+        return results
+
+    @staticmethod
+    def route_method(operation: Operation) -> str:
+        """Method of the generated route of an operation, get_id for a get with a key."""
+        if operation.method == "get" and operation.key is not None:
+            return "get_id"
+        return operation.method
+
+    def dependencies(self, operation: Operation) -> list:
+        """Dependencies in the *_kwargs of the route of an operation, like delete_kwargs."""
+        table_config = self.configs.get(operation.table, {})
+        kwargs_key = f"{self.route_method(operation)}_kwargs"
+        return table_config.get(kwargs_key, {}).get("dependencies", [])
+
+    def charge_limits(self, request: Request, operations: List[Operation]) -> None:
+        # pylint: disable=C0301
+        """Charges the operations of a batch against the ratelimits of the routes of their tables.
+        Each limit is charged once, by the amount of operations on its table and method, lists of entries by their rows.
+
+        :param request: Request of the batch.
+        :type request: Request
+        :param operations: Operations of the batch.
+        :type operations: List[Operation]
+        :raises HTTPException: Raises http 429 error when a limit is exceeded.
+        """
+        # pylint: enable=C0301
+        costs: Dict[Tuple[str, str], int] = {}
+        for operation in operations:
+            if operation.table not in self.table_names:
+                continue
+            cost = 1
+            if operation.method != "get" and isinstance(operation.body, list):
+                cost = max(len(operation.body), 1)
+            route = (operation.table, self.route_method(operation))
+            costs[route] = costs.get(route, 0) + cost
+        for (table, method), cost in costs.items():
+            limit = self.limiter.limit(self.configs.get(table, {}), method, table)
+            if limit:
+                limit_value, scope, key_func = limit
+                self.limiter.charge(
+                    request, parse_many(limit_value), scope, key_func, cost
+                )
+
+    async def check_dependencies(self, request: Request) -> None:
+        # pylint: disable=C0301
+        """Resolves the route dependencies of the operations of a batch before it runs, each dependency once.
+        The ratelimits of the routes are charged after the dependencies, like on the routes.
+
+        :param request: Request of the batch.
+        :type request: Request
+        :raises RequestValidationError: Raises http 422 error for dependencies with invalid parameters, the errors of the dependencies themselves are raised as is.
+        :raises HTTPException: Raises http 429 error when a ratelimit of a route is exceeded.
+        """
+        # pylint: enable=C0301
+        try:
+            operations = parse_obj_as(List[Operation], await request.json())
+        except (ValueError, ValidationError):
+            # an invalid body is rejected by the validation of the route
+            return
+        if len(operations) > self.max_operations:
+            # rejected by run, before any operation
+            return
+        dependencies: list = []
+        for operation in operations:
+            for depends in self.dependencies(operation):
+                if depends not in dependencies:
+                    dependencies.append(depends)
+        if dependencies:
+            await self.solve(request, dependencies)
+        if self.limiter:
+            self.charge_limits(request, operations)
+
+    async def solve(self, request: Request, dependencies: list) -> None:
+        """Resolves dependencies with the request of a batch."""
+        dependant = Dependant(
+            path=self.route,
+            dependencies=[
+                get_parameterless_sub_dependant(depends=depends, path=self.route)
+                for depends in dependencies
+            ],
+        )
+        _, errors, _, _, _ = await solve_dependencies(
+            request=request,
+            dependant=dependant,
+            dependency_overrides_provider=request.app,
+        )
+        if errors:
+            raise RequestValidationError(errors)
+
+    def router(
+        self,
+        get_db: Callable,
+        get_current_user: Callable,
+        route_hooks: Optional[Sequence[RouteHook]] = None,
+        executors: Optional[Executors] = None,
+    ) -> APIRouter:
+        # pylint: disable=C0301
+        """Creates the batch route.
+
+        :param get_db: Function to acquire a database session.
+        :type get_db: Callable
+        :param get_current_user: Function to acquire and verify the current user.
+        :type get_current_user: Callable
+        :param route_hooks: Functions wrapping the request handler of the route, defaults to None
+        :type route_hooks: Optional[Sequence[RouteHook]], optional
+        :param executors: Threadpools per endpoint class, batches run on the bulk threadpool, defaults to None
+        :type executors: Optional[Executors], optional
+        :return: Router containing the batch route.
+        :rtype: APIRouter
+        """
+        # pylint: enable=C0301
+        router = APIRouter(tags=["batch"], route_class=hooked_route_class(route_hooks))
+        post = executors.method(router.post) if executors else router.post
+
+        @post(self.route, dependencies=[Depends(self.check_dependencies)])
+        def batch(
+            operations: List[Operation],
+            db: Session = Depends(get_db),
+            current_user=Depends(get_current_user),  # pylint: disable=W0613
+        ):
+            return self.run(db, operations)
+
+        return router
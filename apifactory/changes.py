@@ -0,0 +1,244 @@
+"""Module containing the change feeds of tables.
+A change feed returns the entries of a table changed since a watermark,
+read with a range scan on a monotonically increasing column,
+like a rowversion or an updated_at column.
+Deletes are captured in a tombstone table written by the generated delete endpoints.
+"""
+import base64
+import datetime
+import decimal
+import json
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel, parse_obj_as
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    and_,
+    or_,
+    select,
+)
+from sqlalchemy.orm import Session
+
+from apifactory.utils import primary_key_checker
+
+
+def encode_value(value: Any) -> Any:
+    """Json compatible form of a watermark value."""
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+def decode_value(column: Column, value: Any) -> Any:
+    """Value of a column from its json compatible form, see encode_value."""
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is bytes:
+        return bytes.fromhex(value)
+    return parse_obj_as(python_type, value)
+
+
+def tombstone_table(name: str) -> Table:
+    """Definition of the tombstone table, a row per deleted entry numbered in order of deletion."""
+    return Table(
+        name,
+        MetaData(),
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("table_name", String(255), nullable=False),
+        Column("primary_key", String(255), nullable=False),
+        Column("deleted_at", DateTime, default=datetime.datetime.utcnow),
+        Index(f"ix_{name}_table_name_id", "table_name", "id"),
+    )
+
+
+class ChangeFeed:
+    # pylint: disable=C0301
+    """Reads the changes of a single table.
+
+    :param model: SQLalchemy model of the table.
+    :type model: Table
+    :param column: Name of the monotonically increasing column, updated on every change of an entry.
+    :type column: str
+    :param tombstones: Tombstone table recording the deletes of the table, defaults to None
+    :type tombstones: Optional[Table], optional
+    :param limit: Default and maximum amount of changed entries returned per request, defaults to 1000
+    :type limit: int, optional
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        model: Table,
+        column: str,
+        tombstones: Optional[Table] = None,
+        limit: int = 1000,
+    ) -> None:
+        if column not in model.__table__.columns:
+            raise ValueError(f"{model.__name__} has no column {column}")
+        self.model = model
+        self.table_name = model.__table__.name
+        self.column = getattr(model, column)
+        self.key_name, self.key_column = primary_key_checker(model)
+        self.tombstones = tombstones
+        self.limit = limit
+
+    def decode_token(self, token: Optional[str]) -> Tuple[Any, Any, int]:
+        """Watermark of the column, primary key and tombstone of a token, the start for no token."""
+        if not token:
+            return None, None, 0
+        try:
+            data = json.loads(base64.urlsafe_b64decode(token.encode()))
+            return (
+                decode_value(self.column, data["v"]),
+                decode_value(self.key_column, data["k"]),
+                int(data["d"]),
+            )
+        except (ValueError, KeyError, TypeError) as error:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid watermark token",
+            ) from error
+
+    @staticmethod
+    def encode_token(value: Any, key: Any, tombstone: int) -> str:
+        """Opaque token of a watermark."""
+        data = {"v": encode_value(value), "k": encode_value(key), "d": tombstone}
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    def changes(
+        self, db: Session, schema: BaseModel, token: Optional[str], limit: int
+    ) -> dict:
+        # pylint: disable=C0301
+        """Entries changed and keys deleted since the watermark of a token.
+        Entries are ordered by the column and the primary key, so entries sharing a value of the column are not skipped.
+
+        :param db: Database session.
+        :type db: Session
+        :param schema: Pydantic schema of the entries.
+        :type schema: BaseModel
+        :param token: Watermark token of the previous response, None to start from the beginning.
+        :type token: Optional[str]
+        :param limit: Maximum amount of entries and deleted keys.
+        :type limit: int
+        :return: Changed entries, deleted keys, the next watermark token and whether more changes are waiting.
+        :rtype: dict
+        """
+        # pylint: enable=C0301
+        value, key, tombstone = self.decode_token(token)
+        limit = min(limit, self.limit)
+        condition = self.column.isnot(None)
+        if value is not None:
+            # a range scan on the column, the primary key breaks ties
+            condition = and_(
+                self.column >= value,
+                or_(self.column > value, self.key_column > key),
+            )
+        entries = (
+            db.query(self.model)
+            .filter(condition)
+            .order_by(self.column, self.key_column)
+            .limit(limit + 1)
+            .all()
+        )
+        more = len(entries) > limit
+        entries = entries[:limit]
+        if entries:
+            last = entries[-1]
+            value = getattr(last, self.column.key)
+            key = getattr(last, self.key_column.key)
+        deleted = []
+        if self.tombstones is not None:
+            rows = db.execute(
+                select(self.tombstones.c.id, self.tombstones.c.primary_key)
+                .where(
+                    self.tombstones.c.table_name == self.table_name,
+                    self.tombstones.c.id > tombstone,
+                )
+                .order_by(self.tombstones.c.id)
+                .limit(limit + 1)
+            ).all()
+            more = more or len(rows) > limit
+            rows = rows[:limit]
+            if rows:
+                tombstone = rows[-1].id
+            deleted = [decode_value(self.key_column, row.primary_key) for row in rows]
+        return {
+            "items": [schema.from_orm(entry) for entry in entries],
+            "deleted": deleted,
+            "next": self.encode_token(value, key, tombstone),
+            "more": more,
+        }
+
+    def record_deletes(self, db: Session, keys: Iterable) -> None:
+        """Records tombstones of deleted keys in the transaction of the delete."""
+        if self.tombstones is None:
+            return
+        rows = [
+            {"table_name": self.table_name, "primary_key": str(key)} for key in keys
+        ]
+        if rows:
+            db.execute(self.tombstones.insert(), rows)
+
+
+class ChangeFeeds:
+    # pylint: disable=C0301
+    """Change feeds of the tables configuring changes.
+    The tombstone table is created in the database when a table records tombstones and it does not exist yet.
+
+    :param models: Models object containing all SQLalchemy models for the API.
+    :type models: Models
+    :param configs: Dictionary containing the configuration of the tables.
+    :type configs: dict
+    :param engine: Engine of the database, used to create the tombstone table.
+    :type engine: Engine
+    :param tombstone_table_name: Name of the tombstone table, defaults to "apifactory_tombstones"
+    :type tombstone_table_name: str, optional
+
+
+    >>> feeds = ChangeFeeds(db.models, {"test_table": {"changes": {"column": "updated_at", "tombstones": True}}}, db.engine)
+    >>> feeds.feed("test_table").changes(db, schema, token, 100)
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        models,
+        configs: dict,
+        engine,
+        tombstone_table_name: str = "apifactory_tombstones",
+    ) -> None:
+        self.feeds: Dict[str, ChangeFeed] = {}
+        self.tombstones: Optional[Table] = None
+        for table_name, config in configs.items():
+            changes = config.get("changes") if isinstance(config, dict) else None
+            if not changes or table_name not in models.table_names:
+                continue
+            changes = dict(changes)
+            tombstones = None
+            if changes.pop("tombstones", False):
+                if self.tombstones is None:
+                    self.tombstones = tombstone_table(tombstone_table_name)
+                    self.tombstones.create(engine, checkfirst=True)
+                tombstones = self.tombstones
+            self.feeds[table_name] = ChangeFeed(
+                getattr(models, table_name), tombstones=tombstones, **changes
+            )
+
+    def feed(self, table_name: str) -> Optional[ChangeFeed]:
+        """Change feed of a table, None for tables without changes."""
+        return self.feeds.get(table_name)
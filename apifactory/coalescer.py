@@ -0,0 +1,108 @@
+"""Module containing the write coalescer of single entry posts.
+Posts of single entries arriving within a few milliseconds of each other are inserted
+with one statement and committed in one transaction, instead of a transaction per entry.
+Entries of a batch that fails are retried one by one, so a failing entry only fails its own request.
+"""
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Tuple
+
+from sqlalchemy import Table
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+
+class WriteCoalescer:
+    # pylint: disable=C0301
+    """Coalesces the inserts of concurrent single entry posts of a table into batches.
+    The first request of a batch leads it: it waits up to max_delay seconds for other requests, or until max_rows entries arrived,
+    and inserts the batch with its own session. The other requests wait for the result of their entry.
+
+    :param model: SQLalchemy model of the table.
+    :type model: Table
+    :param max_delay: Seconds the first entry of a batch waits for more entries, defaults to 0.005
+    :type max_delay: float, optional
+    :param max_rows: Entries after which a batch is inserted without waiting any longer, defaults to 100
+    :type max_rows: int, optional
+
+
+    >>> coalescer = WriteCoalescer(model, max_delay=0.002, max_rows=500)
+    >>> coalescer.insert(db, {"primarykey": 1, "someothercoll": "value"})
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self, model: Table, max_delay: float = 0.005, max_rows: int = 100
+    ) -> None:
+        self.statement = model.__table__.insert()
+        self.max_delay = max_delay
+        self.max_rows = max_rows
+        self.condition = threading.Condition()
+        self.batch: List[Tuple[dict, Future]] = []
+
+    def insert(self, db: Session, content: dict) -> None:
+        """Inserts an entry as part of a batch, returning once the batch is committed.
+
+        :param db: Session of the request, used to insert the batch if the request leads it.
+        :type db: Session
+        :param content: Column values of the entry.
+        :type content: dict
+        :raises SQLAlchemyError: The error inserting this entry.
+        """
+        future: Future = Future()
+        with self.condition:
+            self.batch.append((content, future))
+            leader = len(self.batch) == 1
+            if len(self.batch) >= self.max_rows:
+                self.condition.notify()
+            if leader:
+                deadline = time.monotonic() + self.max_delay
+                while len(self.batch) < self.max_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch, self.batch = self.batch, []
+        if leader:
+            self.write(db, batch)
+        future.result()
+
+    def write(self, db: Session, batch: List[Tuple[dict, Future]]) -> None:
+        """Inserts a batch in one transaction, retrying its entries one by one if it fails.
+
+        :param db: Session to insert the batch with.
+        :type db: Session
+        :param batch: Entries with the futures of the requests waiting for them.
+        :type batch: List[Tuple[dict, Future]]
+        """
+        try:
+            try:
+                db.execute(self.statement, [content for content, _ in batch])
+                db.commit()
+            except SQLAlchemyError:
+                db.rollback()
+                self.write_each(db, batch)
+            else:
+                for _, future in batch:
+                    future.set_result(None)
+        except BaseException as error:
+            # requests waiting for the batch must never be left waiting
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            raise
+
+    def write_each(self, db: Session, batch: List[Tuple[dict, Future]]) -> None:
+        """Inserts the entries of a batch in a transaction per entry.
+        A failing entry fails only its own request.
+        """
+        for content, future in batch:
+            try:
+                db.execute(self.statement, [content])
+                db.commit()
+            except SQLAlchemyError as error:
+                db.rollback()
+                future.set_exception(error)
+            else:
+                future.set_result(None)
@@ -0,0 +1,243 @@
+"""Module containing the compression of responses.
+Responses are compressed with zstd, brotli or gzip, whichever the client accepts first,
+zstd and brotli only when zstandard and brotli are installed.
+Responses smaller than the minimum size are sent as they are.
+Streamed responses, like exports, are compressed chunk by chunk and flushed after every chunk.
+"""
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+from apifactory.utils import quality_values
+
+COMPRESSIBLE = (
+    "application/json",
+    "application/x-ndjson",
+    "application/msgpack",
+    "application/vnd.apache.arrow.stream",
+    "application/xml",
+    "application/javascript",
+    "text/",
+)
+# sent as they are, every event has to reach the client when it is sent
+UNCOMPRESSED = ("text/event-stream",)
+DEFAULT_LEVELS = {"gzip": 6, "br": 4, "zstd": 3}
+
+
+class Compressor:
+    """Incremental compressor of a single response.
+
+    :param encoding: zstd, br or gzip.
+    :type encoding: str
+    :param level: Compression level.
+    :type level: int
+    """
+
+    def __init__(self, encoding: str, level: int) -> None:
+        self.encoding = encoding
+        if encoding == "zstd":
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        elif encoding == "br":
+            self.compressor = brotli.Compressor(quality=level)
+        else:
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses data, keeping back output until flush or finish."""
+        if self.encoding == "br":
+            return self.compressor.process(data)
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        """Returns all output so far, so the client can decompress what was sent."""
+        if self.encoding == "zstd":
+            return self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        if self.encoding == "br":
+            return self.compressor.flush()
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        """Returns the remaining output and ends the compressed stream."""
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+def available_encodings() -> List[str]:
+    """Returns the encodings whose library is installed, in order of preference."""
+    available = {"zstd": bool(zstandard), "br": bool(brotli), "gzip": True}
+    return [encoding for encoding, installed in available.items() if installed]
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """Parses an Accept-Encoding header into encodings and their quality."""
+    return dict(quality_values(header))
+
+
+class CompressionMiddleware:
+    # pylint: disable=C0301
+    """ASGI middleware compressing responses with the best encoding the client accepts.
+    Responses that are already encoded, empty or of a type that does not compress are passed on directly.
+
+    :param app: ASGI application.
+    :param minimum_size: Responses smaller than this amount of bytes are not compressed, defaults to 1024
+    :type minimum_size: int, optional
+    :param encodings: Encodings in order of preference, encodings whose library is not installed are left out, defaults to ("zstd", "br", "gzip")
+    :type encodings: Sequence[str], optional
+    :param levels: Compression level per encoding, defaults to None
+    :type levels: Optional[Dict[str, int]], optional
+    :param flush: Whether streamed responses are flushed after every chunk, defaults to True
+    :type flush: bool, optional
+
+
+    >>> app.add_middleware(CompressionMiddleware, minimum_size=500, encodings=["br", "gzip"])
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        encodings: Sequence[str] = ("zstd", "br", "gzip"),
+        levels: Optional[Dict[str, int]] = None,
+        flush: bool = True,
+    ) -> None:
+        unknown = set(encodings) - set(DEFAULT_LEVELS)
+        if unknown:
+            raise ValueError(
+                f"Unknown encodings {sorted(unknown)}, use zstd, br or gzip"
+            )
+        self.app = app
+        self.minimum_size = minimum_size
+        available = available_encodings()
+        self.encodings = [encoding for encoding in encodings if encoding in available]
+        self.levels = DEFAULT_LEVELS | (levels or {})
+        self.flush = flush
+
+    def negotiate(self, scope) -> Optional[str]:
+        """Returns the encoding for the response of a request, None for no compression."""
+        header = b""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                header += b"," + value
+        accepted = accepted_encodings(header.decode("latin-1"))
+        wildcard = accepted.get("*", 0.0)
+        candidates = [
+            encoding
+            for encoding in self.encodings
+            if accepted.get(encoding, wildcard) > 0
+        ]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda encoding: accepted.get(encoding, wildcard))
+
+    async def __call__(self, scope, receive, send) -> None:
+        encoding = self.negotiate(scope) if scope["type"] == "http" else None
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+        responder = CompressedResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class CompressedResponder:
+    """Send function compressing the response of a single request.
+
+    :param middleware: Middleware holding the configuration.
+    :type middleware: CompressionMiddleware
+    :param encoding: Encoding to compress with.
+    :type encoding: str
+    :param send: Send function of the server.
+    :type send: Callable
+    """
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send) -> None:
+        self.middleware = middleware
+        self.encoding = encoding
+        self.app_send = send
+        self.start: Optional[dict] = None
+        self.buffer = b""
+        self.compressor: Optional[Compressor] = None
+        self.passthrough = False
+
+    def compressible(self) -> bool:
+        """Whether the response started by the app should be compressed."""
+        if self.start["status"] in (204, 304) or self.start["status"] < 200:
+            return False
+        headers = {
+            name.decode("latin-1").lower(): value.decode("latin-1")
+            for name, value in self.start.get("headers", [])
+        }
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "")
+        return content_type.startswith(COMPRESSIBLE) and not content_type.startswith(
+            UNCOMPRESSED
+        )
+
+    def compressed_start(self, content_length: Optional[int]) -> dict:
+        """Start message of the response with the headers of the compressed body."""
+        headers = []
+        vary = []
+        for name, value in self.start.get("headers", []):
+            if name.lower() == b"content-length":
+                continue
+            if name.lower() == b"vary":
+                vary.append(value)
+                continue
+            headers.append((name, value))
+        vary.append(b"Accept-Encoding")
+        headers.append((b"vary", b", ".join(vary)))
+        headers.append((b"content-encoding", self.encoding.encode()))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode()))
+        return {**self.start, "headers": headers}
+
+    async def send(self, message: dict) -> None:
+        """Send function passed to the app."""
+        if message["type"] == "http.response.start":
+            self.start = message
+            if not self.compressible():
+                # not held back until minimum_size, streams are passed on chunk by chunk
+                self.passthrough = True
+                await self.app_send(message)
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.app_send(message)
+            return
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            self.buffer += body
+            if more_body and len(self.buffer) < self.middleware.minimum_size:
+                return
+            body, self.buffer = self.buffer, b""
+            if len(body) < self.middleware.minimum_size:
+                self.passthrough = True
+                await self.app_send(self.start)
+                await self.app_send({**message, "body": body})
+                return
+            self.compressor = Compressor(
+                self.encoding, self.middleware.levels[self.encoding]
+            )
+            if not more_body:
+                data = self.compressor.compress(body) + self.compressor.finish()
+                await self.app_send(self.compressed_start(len(data)))
+                await self.app_send({**message, "body": data})
+                return
+            await self.app_send(self.compressed_start(None))
+        data = self.compressor.compress(body)
+        if not more_body:
+            data += self.compressor.finish()
+        elif self.middleware.flush:
+            data += self.compressor.flush()
+        await self.app_send({**message, "body": data})
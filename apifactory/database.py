@@ -11,9 +11,18 @@ the other columns will be added automatically
 this way you can fake a primary key without having one in the database.
 """
 
-from typing import Optional, Tuple
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+from fastapi import Request
+from slowapi.util import get_remote_address
 from sqlalchemy import (
     create_engine,
+    event,
+    exc,
     Column,
     Table,
     MetaData,
@@ -63,6 +72,138 @@ def add_to_metadata(
     return created_table, metadata
 
 
+class Replica:
+    # pylint: disable=C0301
+    """Engine and sessions of a single read replica.
+    Keeps track of the health of the replica and the amount of sessions in use.
+    The health is checked by a background thread, so choosing a replica does not wait on the database.
+
+    :param engine: Engine connecting to the replica.
+    :type engine: Engine
+    :param local_session: Sessionmaker bound to the engine.
+    :type local_session: Callable
+    :param check_interval: Seconds between health checks of the replica, defaults to 30
+    :type check_interval: float, optional
+    """
+    # pylint: enable=C0301
+
+    def __init__(self, engine, local_session: Callable, check_interval: float = 30):
+        self.engine = engine
+        self.local_session = local_session
+        self.check_interval = check_interval
+        self.healthy = False
+        self.checked_at: Optional[float] = None
+        self.in_use = 0
+        self.lock = threading.Lock()
+        self.monitor_thread: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+        event.listen(engine, "handle_error", self.connection_error)
+
+    def connection_error(self, context) -> None:
+        """Engine handle_error listener, marking the replica unhealthy when connections fail."""
+        if context.is_disconnect or context.connection is None:
+            self.healthy = False
+            self.checked_at = time.monotonic()
+
+    def check(self) -> bool:
+        """Health check of the replica.
+
+        :return: Whether the replica accepts queries.
+        :rtype: bool
+        """
+        try:
+            with self.engine.connect() as connection:
+                connection.exec_driver_sql("SELECT 1")
+            self.healthy = True
+        except exc.SQLAlchemyError:
+            self.healthy = False
+        self.checked_at = time.monotonic()
+        return self.healthy
+
+    def monitor(self) -> None:
+        """Checks the health of the replica every check_interval seconds until stopped."""
+        while not self.stopped.wait(self.check_interval):
+            self.check()
+
+    def available(self) -> bool:
+        # pylint: disable=C0301
+        """Whether the replica can be used, according to the last health check.
+        Only the first call of a process checks the health itself, it then starts the monitor thread.
+
+        :return: Whether the replica is healthy.
+        :rtype: bool
+        """
+        # pylint: enable=C0301
+        monitor_thread = self.monitor_thread
+        # threads do not survive the fork of a worker process
+        if monitor_thread is None or not monitor_thread.is_alive():
+            with self.lock:
+                if self.monitor_thread is monitor_thread and not self.stopped.is_set():
+                    if self.checked_at is None:
+                        self.check()
+                    self.monitor_thread = threading.Thread(
+                        target=self.monitor, daemon=True
+                    )
+                    self.monitor_thread.start()
+        return self.healthy
+
+    def stop(self) -> None:
+        """Stops the monitor thread."""
+        self.stopped.set()
+
+    @contextmanager
+    def session(self):
+        """Context manager yielding a session on the replica, counting it as in use."""
+        with self.lock:
+            self.in_use += 1
+        db = self.local_session()
+        try:
+            yield db
+        finally:
+            db.close()
+            with self.lock:
+                self.in_use -= 1
+
+
+class ReplicaSet:
+    # pylint: disable=C0301
+    """Chooses the read replica to use for a session.
+
+    :param replicas: Replicas to choose from.
+    :type replicas: List[Replica]
+    :param strategy: Either round_robin or least_connections, defaults to "round_robin"
+    :type strategy: str, optional
+    """
+    # pylint: enable=C0301
+
+    def __init__(self, replicas: List[Replica], strategy: str = "round_robin"):
+        if strategy not in ("round_robin", "least_connections"):
+            raise ValueError(
+                f"replica_strategy {strategy} is not round_robin or least_connections"
+            )
+        self.replicas = replicas
+        self.strategy = strategy
+        self.counter = itertools.count()
+
+    def choose(self) -> Optional[Replica]:
+        """Chooses a healthy replica.
+
+        :return: The chosen replica, None if no replica is healthy.
+        :rtype: Optional[Replica]
+        """
+        candidates = [replica for replica in self.replicas if replica.available()]
+        if not candidates:
+            return None
+        if self.strategy == "least_connections":
+            return min(candidates, key=lambda replica: replica.in_use)
+        return candidates[next(self.counter) % len(candidates)]
+
+    def stop(self) -> None:
+        """Stops the health checks of the replicas."""
+        for replica in self.replicas:
+            replica.stop()
+
+
 class Database:
     # pylint: disable=C0301
     """setup database connection, automatically detect
@@ -76,6 +217,16 @@ class Database:
     :type local_session_kwargs: Optional[dict], optional
     :param views: Dictionary containing view name (key) and list of primarykey name datatype pairs. Only views defined in this dictionary will be added to the api, defaults to None
     :type views: Optional[dict], optional
+    :param pools: Dictionary containing engine arguments per endpoint class (read, write, bulk, export). Every class in this dictionary gets its own engine and connection pool, defaults to None
+    :type pools: Optional[dict], optional
+    :param replica_urls: Connection strings of read replicas of the database, defaults to None
+    :type replica_urls: Optional[List[str]], optional
+    :param replica_strategy: How to choose a replica for a read, round_robin or least_connections, defaults to "round_robin"
+    :type replica_strategy: str, optional
+    :param replica_check_interval: Seconds between health checks of a replica, defaults to 30
+    :type replica_check_interval: float, optional
+    :param read_your_writes: Seconds a client reads from the primary database after it wrote, defaults to 0
+    :type read_your_writes: float, optional
 
     basic use only add a database connection string
 
@@ -117,6 +268,26 @@ class Database:
     ...    ]
     ... }
     >>> Database("connection_string", views=views)
+
+
+    To keep reads from waiting on connections held by slow bulk writes,
+    endpoint classes can be given their own connection pool.
+    The arguments per class are added to engine_kwargs.
+
+    >>> pools = {"read": {"pool_size": 20}, "bulk": {"pool_size": 2}}
+    >>> Database("connection_string", pools=pools)
+
+
+    Reads of the generated endpoints can be spread over read replicas.
+    Writes and the login query stay on the primary database.
+    After writing, a client keeps reading from the primary for read_your_writes seconds.
+    Clients are told apart by client_key, a function of the request defaulting to the client address.
+
+    >>> Database(
+    ...    "primary_connection_string",
+    ...    replica_urls=["replica_connection_string"],
+    ...    read_your_writes=5,
+    ... )
     """
 
     def __init__(
@@ -125,6 +296,11 @@ class Database:
         engine_kwargs: Optional[dict] = None,
         local_session_kwargs: Optional[dict] = None,
         views: Optional[dict] = None,
+        pools: Optional[dict] = None,
+        replica_urls: Optional[List[str]] = None,
+        replica_strategy: str = "round_robin",
+        replica_check_interval: float = 30,
+        read_your_writes: float = 0,
     ):
 
         if not engine_kwargs:
@@ -138,6 +314,35 @@ class Database:
             )
         self.views = views
         self.local_session = sessionmaker(bind=self.engine, **local_session_kwargs)
+        self.engines = {}
+        self.session_getters = {}
+        self.sessionmakers = {"primary": self.local_session}
+        for kind, pool_kwargs in (pools or {}).items():
+            engine = create_engine(database_url, **(engine_kwargs | pool_kwargs))
+            self.engines[kind] = engine
+            self.sessionmakers[kind] = sessionmaker(bind=engine, **local_session_kwargs)
+            self.session_getters[kind] = self.session_getter_factory(
+                self.sessionmakers[kind]
+            )
+        replica_kwargs = engine_kwargs | (pools or {}).get("read", {})
+        replicas = []
+        for number, replica_url in enumerate(replica_urls or []):
+            engine = create_engine(replica_url, **replica_kwargs)
+            self.sessionmakers[f"replica-{number}"] = sessionmaker(
+                bind=engine, **local_session_kwargs
+            )
+            replicas.append(
+                Replica(
+                    engine,
+                    self.sessionmakers[f"replica-{number}"],
+                    replica_check_interval,
+                )
+            )
+        self.replicas = ReplicaSet(replicas, replica_strategy) if replicas else None
+        self.read_your_writes = read_your_writes
+        self.client_key: Callable[[Request], str] = get_remote_address
+        self.last_writes: dict = {}
+        self.write_getters: dict = {}
         self.models = self.auto_create_models()
 
     def get_db(self):
@@ -153,6 +358,147 @@ class Database:
         finally:
             db.close()
 
+    @staticmethod
+    def session_getter_factory(local_session: Callable) -> Callable:
+        """Creates a helper generator like get_db for a different sessionmaker.
+
+        :param local_session: Sessionmaker to create the sessions with.
+        :type local_session: Callable
+        :return: Generator function yielding a session and closing it afterwards.
+        :rtype: Callable
+        """
+
+        def get_pooled_db():
+            db = local_session()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        return get_pooled_db
+
+    def session_getter(self, kind: str) -> Callable:
+        """Returns the helper generator for sessions of an endpoint class.
+        Endpoint classes without a pool of their own use get_db.
+        Reads use the replicas if there are any, writes then record the client for read_your_writes.
+
+        :param kind: Name of the endpoint class.
+        :type kind: str
+        :return: Generator function yielding a session.
+        :rtype: Callable
+        """
+        getter = self.session_getters.get(kind, self.get_db)
+        if not self.replicas:
+            return getter
+        if kind == "read":
+            return self.get_read_db
+        if not self.read_your_writes or kind == "export":
+            return getter
+        if kind not in self.write_getters:
+            self.write_getters[kind] = self.write_getter_factory(getter)
+        return self.write_getters[kind]
+
+    def pinned(self, request: Request) -> bool:
+        """Whether the client of the request wrote within the read_your_writes window.
+
+        :param request: Incoming request.
+        :type request: Request
+        :return: Whether reads of the client go to the primary database.
+        :rtype: bool
+        """
+        last_write = self.last_writes.get(self.client_key(request))
+        return last_write is not None and (
+            time.monotonic() - last_write < self.read_your_writes
+        )
+
+    def get_read_db(self, request: Request):
+        """helper generator for sessions of read endpoints.
+        Sessions are created on a healthy replica, falling back to the primary database.
+
+        :param request: Incoming request.
+        :type request: Request
+        :yield: returns a session for use inside an api endpoint.
+        :rtype:
+        """
+        replica = None
+        if not (self.read_your_writes and self.pinned(request)):
+            replica = self.replicas.choose()
+        if replica is None:
+            yield from self.session_getters.get("read", self.get_db)()
+            return
+        with replica.session() as db:
+            yield db
+
+    def write_getter_factory(self, get_db: Callable) -> Callable:
+        """Creates a helper generator recording the client of writes for read_your_writes.
+
+        :param get_db: Helper generator for the sessions of the writes.
+        :type get_db: Callable
+        :return: Generator function yielding a session.
+        :rtype: Callable
+        """
+
+        def get_write_db(request: Request):
+            client = self.client_key(request)
+            with contextmanager(get_db)() as db:
+                # recorded at the commit, the response may be sent before the session is closed
+                event.listen(
+                    db, "after_commit", lambda session: self.record_write(client)
+                )
+                yield db
+
+        return get_write_db
+
+    def record_write(self, client: str) -> None:
+        """Records a write of a client, pinning its reads to the primary database.
+
+        :param client: Key of the client, see client_key.
+        :type client: str
+        """
+        now = time.monotonic()
+        if len(self.last_writes) > 10000:
+            self.last_writes = {
+                key: last_write
+                for key, last_write in self.last_writes.items()
+                if now - last_write < self.read_your_writes
+            }
+        self.last_writes[client] = now
+
+    def all_engines(self) -> list:
+        """Returns the engine of the Database and the engines of the endpoint class pools and replicas.
+
+        :return: List of all engines created by the Database.
+        :rtype: list
+        """
+        return list(self.named_engines().values())
+
+    def named_engines(self) -> dict:
+        """Returns all engines created by the Database by name.
+        The engine of database_url is named primary, pools are named by their endpoint class
+        and replicas by their position in replica_urls.
+
+        :return: Dictionary containing the engines.
+        :rtype: dict
+        """
+        # sessionmaker keeps its arguments in kw, pylint does not see the attribute
+        return {
+            name: session.kw["bind"]  # pylint: disable=E1101
+            for name, session in self.sessionmakers.items()
+        }
+
+    def dispose_pools(self, close: bool = True) -> None:
+        # pylint: disable=C0301
+        """Replaces the connection pools of all engines with new, empty pools.
+        Forked worker processes dispose with close set to False,
+        so the connections of the parent process are dropped without closing them underneath the parent.
+
+        :param close: Whether to close the connections checked in to the old pools, defaults to True
+        :type close: bool, optional
+        """
+        # pylint: enable=C0301
+        for engine in self.all_engines():
+            engine.dispose(close=close)
+
     def auto_create_models(self) -> Models:
         """method for automatically detecting sql tables
         and converting them into SQL alchemy models
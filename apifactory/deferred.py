@@ -0,0 +1,153 @@
+"""Module containing the reading of deferred columns.
+Large columns, like VARBINARY(MAX) and NVARCHAR(MAX) columns,
+can be deferred in the configuration of a table: they are left out of the queries
+and responses of the get routes, and read with a route of their own.
+The value of a deferred column is read in chunks with a query per chunk,
+so it is never held in memory completely.
+"""
+import re
+from typing import Iterator, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import Table, func, select
+from sqlalchemy import types as sqltypes
+from sqlalchemy.orm import Session
+
+from apifactory.utils import primary_key_checker
+
+CHUNK_SIZE = 64 * 1024
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+    # pylint: disable=C0301
+    """First and last byte of a Range header, None to send the whole value.
+    Headers with several ranges or other units are ignored, as allowed for servers.
+
+    :param header: Value of the Range header.
+    :type header: Optional[str]
+    :param length: Length of the value in bytes.
+    :type length: int
+    :raises HTTPException: Raises http 416 error for ranges outside the value.
+    :return: First and last byte of the range, both inclusive.
+    :rtype: Optional[Tuple[int, int]]
+    """
+    # pylint: enable=C0301
+    match = RANGE.match((header or "").strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # a suffix range, the last bytes of the value
+        start, end = max(length - int(last), 0), length - 1
+    else:
+        start = int(first)
+        end = min(int(last), length - 1) if last else length - 1
+    if start >= length or start > end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{length}"},
+        )
+    return start, end
+
+
+class ColumnReader:
+    # pylint: disable=C0301
+    """Reads the value of a deferred column of an entry in chunks.
+    Binary values are read in byte ranges, text values in chunks of characters without range support.
+
+    :param model: SQLalchemy model of the table.
+    :type model: Table
+    :param column: Name of the deferred column.
+    :type column: str
+    :param chunk_size: Bytes or characters read per query, defaults to 65536
+    :type chunk_size: int, optional
+
+
+    >>> reader = ColumnReader(model, "document")
+    >>> length = reader.length(db, 1)
+    >>> b"".join(reader.chunks(db, 1, 0, length - 1))
+    """
+    # pylint: enable=C0301
+
+    def __init__(self, model: Table, column: str, chunk_size: int = CHUNK_SIZE) -> None:
+        if column not in model.__table__.columns:
+            raise ValueError(f"{model.__name__} has no column {column}")
+        self.model = model
+        self.column = getattr(model, column)
+        self.key_name, self.key_column = primary_key_checker(model)
+        self.binary = isinstance(
+            self.column.type, sqltypes._Binary  # pylint: disable=W0212
+        )
+        self.media_type = (
+            "application/octet-stream" if self.binary else "text/plain; charset=utf-8"
+        )
+        self.chunk_size = chunk_size
+
+    def functions(self, db: Session):
+        """Length and substring functions of the dialect of a session."""
+        if db.get_bind().dialect.name == "mssql":
+            return func.datalength, func.substring
+        return func.length, func.substr
+
+    def length(self, db: Session, key) -> Optional[int]:
+        # pylint: disable=C0301
+        """Length of the value of an entry, in bytes for binary columns and characters for text columns.
+
+        :param db: Database session.
+        :type db: Session
+        :param key: Primary key of the entry.
+        :raises HTTPException: Raises http 404 error if the entry does not exist.
+        :return: The length, None if the value is null.
+        :rtype: Optional[int]
+        """
+        # pylint: enable=C0301
+        length, _ = self.functions(db)
+        row = db.execute(
+            select(length(self.column)).where(self.key_column == key)
+        ).first()
+        if row is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"model: {self.model.__name__} does not have {self.key_name} {key}",
+            )
+        return row[0]
+
+    def chunks(
+        self, db: Session, key, start: int = 0, end: Optional[int] = None
+    ) -> Iterator[bytes]:
+        # pylint: disable=C0301
+        """Reads a value in chunks, a query per chunk.
+
+        :param db: Database session.
+        :type db: Session
+        :param key: Primary key of the entry.
+        :param start: Offset of the first byte or character, defaults to 0
+        :type start: int, optional
+        :param end: Offset of the last byte or character, inclusive, defaults to None, the end of the value
+        :type end: Optional[int], optional
+        :yield: The chunks of the value, text encoded as utf-8.
+        :rtype: Iterator[bytes]
+        """
+        # pylint: enable=C0301
+        _, substring = self.functions(db)
+        offset = start
+        while end is None or offset <= end:
+            size = (
+                self.chunk_size
+                if end is None
+                else min(self.chunk_size, end - offset + 1)
+            )
+            chunk = db.execute(
+                # substrings of sql start at 1
+                select(substring(self.column, offset + 1, size)).where(
+                    self.key_column == key
+                )
+            ).scalar()
+            if not chunk:
+                return
+            yield chunk if self.binary else chunk.encode("utf-8")
+            if len(chunk) < size:
+                return
+            offset += size
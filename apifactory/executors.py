@@ -0,0 +1,271 @@
+"""Module containing the executors running the generated endpoints.
+Every endpoint class (read, write, bulk and export) can run on its own bounded threadpool,
+so slow bulk writes cannot take the threads needed by cheap reads.
+The synchronous dependencies of an endpoint, like its database session, run on the same threadpool.
+"""
+import asyncio
+import contextlib
+import contextvars
+import copy
+import functools
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from fastapi import params
+from fastapi.dependencies.utils import (
+    is_async_gen_callable,
+    is_coroutine_callable,
+    is_gen_callable,
+)
+from starlette.concurrency import run_in_threadpool
+
+from apifactory.routing import ENDPOINT_CLASSES
+
+
+class OffloadedDependency:
+    # pylint: disable=C0301
+    """Dependency wrapping a function whose own dependencies run on the executor of an endpoint class.
+    Compares equal to the wrapped function, so dependency overrides of the function still apply.
+
+    :param call: Wrapped dependency function.
+    :type call: Callable
+    :param signature: Signature of the wrapped function with its dependencies replaced.
+    :type signature: inspect.Signature
+    :param run: Function running a function on the executor, see Executors.run.
+    :type run: Callable
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self, call: Callable, signature: inspect.Signature, run: Callable
+    ) -> None:
+        functools.update_wrapper(self, call)
+        self.call = call
+        self.__signature__ = signature
+        self.run = run
+
+    def __eq__(self, other) -> bool:
+        return self.call == other
+
+    def __hash__(self) -> int:
+        return hash(self.call)
+
+
+class OffloadedFunction(OffloadedDependency):
+    """Synchronous dependency running on the executor."""
+
+    async def __call__(self, **kwargs):
+        return await self.run(self.call, **kwargs)
+
+
+class OffloadedGenerator(OffloadedDependency):
+    """Synchronous generator dependency, entered and exited on the executor."""
+
+    async def __call__(self, **kwargs):
+        manager = contextlib.contextmanager(self.call)(**kwargs)
+        value = await self.run(manager.__enter__)
+        try:
+            yield value
+        except Exception as error:  # pylint: disable=W0703
+            if not await self.run(
+                manager.__exit__, type(error), error, error.__traceback__
+            ):
+                raise
+        else:
+            await self.run(manager.__exit__, None, None, None)
+
+
+class OffloadedCoroutine(OffloadedDependency):
+    """Asynchronous dependency, only its own dependencies run on the executor."""
+
+    async def __call__(self, **kwargs):
+        return await self.call(**kwargs)
+
+
+class OffloadedAsyncGenerator(OffloadedDependency):
+    """Asynchronous generator dependency, only its own dependencies run on the executor."""
+
+    async def __call__(self, **kwargs):
+        async with contextlib.asynccontextmanager(self.call)(**kwargs) as value:
+            yield value
+
+
+class Executors:
+    # pylint: disable=C0301
+    """Threadpools per endpoint class for running synchronous endpoints.
+    Endpoint classes without a configured size run on the default threadpool of starlette.
+
+    :param sizes: Dictionary containing the amount of threads per endpoint class.
+    :type sizes: Dict[str, int]
+
+
+    >>> executors = Executors({"read": 16, "write": 8, "bulk": 2})
+    >>> router_get = executors.method(router.get)
+    """
+    # pylint: enable=C0301
+
+    def __init__(self, sizes: Dict[str, int]) -> None:
+        self.executors = {
+            kind: ThreadPoolExecutor(
+                max_workers=size, thread_name_prefix=f"apifactory-{kind}"
+            )
+            for kind, size in sizes.items()
+        }
+        self.dependencies: dict = {}
+
+    def executor(self, kind: Optional[str]) -> Optional[ThreadPoolExecutor]:
+        """Returns the executor of an endpoint class.
+
+        :param kind: Name of the endpoint class.
+        :type kind: Optional[str]
+        :return: Executor of the class, None if the default threadpool is used.
+        :rtype: Optional[ThreadPoolExecutor]
+        """
+        return self.executors.get(kind)
+
+    async def run(self, kind: Optional[str], func: Callable, *args, **kwargs):
+        """Runs a function on the executor of an endpoint class.
+        The context of the caller is copied to the thread running the function.
+
+        :param kind: Name of the endpoint class.
+        :type kind: Optional[str]
+        :param func: Function to run.
+        :type func: Callable
+        :return: Result of the function.
+        """
+        executor = self.executor(kind)
+        if not executor:
+            return await run_in_threadpool(func, *args, **kwargs)
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(context.run, func, *args, **kwargs)
+        )
+
+    def signature(self, kind: str, func: Callable) -> inspect.Signature:
+        """Returns the signature of a function with its dependencies running on the executor.
+
+        :param kind: Name of the endpoint class.
+        :type kind: str
+        :param func: Endpoint or dependency function.
+        :type func: Callable
+        :return: Signature passed to FastAPI instead of the signature of the function.
+        :rtype: inspect.Signature
+        """
+        signature = inspect.signature(func)
+        return signature.replace(
+            parameters=[
+                parameter.replace(default=self.depends(kind, parameter.default))
+                for parameter in signature.parameters.values()
+            ]
+        )
+
+    def depends(self, kind: str, default):
+        """Replaces the dependency of a Depends (or Security) with one running on the executor.
+        Other values are returned unchanged.
+
+        :param kind: Name of the endpoint class.
+        :type kind: str
+        :param default: Default value of a parameter, or a route dependency.
+        :return: The default with its dependency replaced.
+        """
+        if not isinstance(default, params.Depends) or default.dependency is None:
+            return default
+        depends = copy.copy(default)
+        depends.dependency = self.dependency(kind, default.dependency)
+        return depends
+
+    def dependency(self, kind: str, call: Callable) -> Callable:
+        # pylint: disable=C0301
+        """Wraps a dependency so it runs on the executor of an endpoint class, with its own dependencies.
+        Asynchronous dependencies stay on the event loop, they are only wrapped if they have dependencies.
+
+        :param kind: Name of the endpoint class.
+        :type kind: str
+        :param call: Dependency function.
+        :type call: Callable
+        :return: Dependency running on the executor, call if the class runs on the default threadpool.
+        :rtype: Callable
+        """
+        # pylint: enable=C0301
+        if not self.executor(kind) or inspect.isclass(call):
+            return call
+        key = (kind, call)
+        if key not in self.dependencies:
+            signature = self.signature(kind, call)
+            run = functools.partial(self.run, kind)
+            if is_gen_callable(call):
+                wrapped = OffloadedGenerator(call, signature, run)
+            elif is_async_gen_callable(call):
+                wrapped = OffloadedAsyncGenerator(call, signature, run)
+            elif not is_coroutine_callable(call):
+                wrapped = OffloadedFunction(call, signature, run)
+            elif signature != inspect.signature(call):
+                wrapped = OffloadedCoroutine(call, signature, run)
+            else:
+                wrapped = call
+            self.dependencies[key] = wrapped
+        return self.dependencies[key]
+
+    def offload(self, func: Callable) -> Callable:
+        # pylint: disable=C0301
+        """Wraps a synchronous endpoint function in a coroutine running it on the executor of its class.
+        The parameters of the endpoint are kept, its dependencies are replaced by ones running on the same executor.
+        Asynchronous endpoint functions stay on the event loop, only their dependencies are replaced.
+
+        :param func: Endpoint function.
+        :type func: Callable
+        :return: Coroutine function running the endpoint.
+        :rtype: Callable
+        """
+        # pylint: enable=C0301
+        kind = ENDPOINT_CLASSES.get(func.__name__)
+        if not kind:
+            return func
+
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def offloaded_dependencies(*args, **kwargs):
+                return await func(*args, **kwargs)
+
+            offloaded_dependencies.__signature__ = self.signature(kind, func)
+            return offloaded_dependencies
+
+        @functools.wraps(func)
+        async def offloaded(*args, **kwargs):
+            run_kind = kind
+            if func.__name__ == "post" and isinstance(kwargs.get("request"), list):
+                run_kind = "bulk"
+            return await self.run(run_kind, func, *args, **kwargs)
+
+        offloaded.__signature__ = self.signature(kind, func)
+        return offloaded
+
+    def method(self, method: Callable) -> Callable:
+        """Wraps a router method so the endpoints it registers run on the executors.
+
+        :param method: FastAPI Router method, for example router.get.
+        :type method: Callable
+        :return: Router method with the same interface.
+        :rtype: Callable
+        """
+
+        def route_method(*args, **kwargs):
+            def register(func: Callable) -> Callable:
+                kind = ENDPOINT_CLASSES.get(func.__name__)
+                dependencies = kwargs.get("dependencies")
+                if kind and dependencies:
+                    kwargs["dependencies"] = [
+                        self.depends(kind, depends) for depends in dependencies
+                    ]
+                return method(*args, **kwargs)(self.offload(func))
+
+            return register
+
+        return route_method
+
+    def shutdown(self) -> None:
+        """Shuts down all executors, waiting for running endpoints to finish."""
+        for executor in self.executors.values():
+            executor.shutdown()
@@ -0,0 +1,244 @@
+"""Module containing the expansion of relationships of tables.
+Relationships discovered from the foreign keys of the database are expanded
+with ?expand=relationship, loading the related entries of a page with a query per relationship
+instead of a request per entry.
+Expanded entries are nested in schemas derived from the schemas of the tables.
+Their responses are rendered directly,
+the response models of the routes would drop the nested entries.
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi_pagination.api import create_page, resolve_params
+from fastapi_pagination.ext.sqlalchemy import paginate_query
+from pydantic import BaseModel, create_model
+from sqlalchemy import Table, func, inspect, select, tuple_
+from sqlalchemy.orm import Query, Session, selectinload
+
+from apifactory.negotiation import NegotiatedResponse
+
+Tree = Dict[str, "Tree"]
+
+
+def freeze(tree: Tree) -> Tuple:
+    """Hashable form of an expansion tree, used as key of the derived schemas."""
+    return tuple((name, freeze(subtree)) for name, subtree in sorted(tree.items()))
+
+
+class Expansion:
+    # pylint: disable=C0301
+    """Expands the relationships of the entries returned by the get routes.
+
+    :param schemas: Schemas object containing all pydantic schemas for the API.
+    :type schemas: Schemas
+    :param max_depth: Maximum amount of relationships in a path like orders.persons, defaults to 2
+    :type max_depth: int, optional
+    :param max_expand: Maximum amount of relationships expanded by a request, each one costs a query, defaults to 5
+    :type max_expand: int, optional
+    :param max_related: Maximum amount of related entries of a single entry, larger collections are rejected with http 413 before they are loaded, defaults to 100
+    :type max_related: int, optional
+
+
+    >>> expansion = Expansion(schemas, max_depth=1)
+    >>> tree = expansion.parse(model, "persons")
+    >>> expansion.check(db, model, tree, db.query(model).subquery())
+    >>> entries = db.query(model).options(*expansion.options(model, tree)).all()
+    >>> expansion.expand(model, tree, entries)
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self, schemas, max_depth: int = 2, max_expand: int = 5, max_related: int = 100
+    ) -> None:
+        self.schemas = schemas
+        self.max_depth = max_depth
+        self.max_expand = max_expand
+        self.max_related = max_related
+        self.derived: Dict[Tuple, BaseModel] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def relationship(model: Table, name: str):
+        """Relationship of a model by name, http 400 for unknown relationships."""
+        relationships = inspect(model).relationships
+        if name not in relationships:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"model: {model.__name__} has no relationship {name},"
+                f" use one of: {', '.join(sorted(relationships.keys()))}",
+            )
+        return relationships[name]
+
+    def parse(self, model: Table, expand: Optional[str]) -> Tree:
+        # pylint: disable=C0301
+        """Parses the expand parameter into a tree of relationships.
+
+        :param model: SQLalchemy model of the table.
+        :type model: Table
+        :param expand: Comma separated relationships, nested relationships separated by dots like orders.persons.
+        :type expand: Optional[str]
+        :raises HTTPException: Raises http 400 error for unknown relationships and expansions exceeding max_depth or max_expand.
+        :return: Relationship names mapped to the expansions of the related entries, empty without expand.
+        :rtype: Tree
+        """
+        # pylint: enable=C0301
+        tree: Tree = {}
+        count = 0
+        for path in (expand or "").split(","):
+            names = [name.strip() for name in path.split(".") if name.strip()]
+            if len(names) > self.max_depth:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Expand at most {self.max_depth} relationships deep",
+                )
+            current_model, node = model, tree
+            for name in names:
+                related = self.relationship(current_model, name).mapper.class_
+                if name not in node:
+                    count += 1
+                    node[name] = {}
+                current_model, node = related, node[name]
+        if count > self.max_expand:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Expand at most {self.max_expand} relationships",
+            )
+        return tree
+
+    def options(self, model: Table, tree: Tree, parent=None) -> list:
+        """Loader options loading every relationship of a tree with a select per relationship."""
+        options = []
+        for name, subtree in tree.items():
+            attribute = getattr(model, name)
+            option = (
+                parent.selectinload(attribute) if parent else selectinload(attribute)
+            )
+            options.append(option)
+            related = self.relationship(model, name).mapper.class_
+            options.extend(self.options(related, subtree, option))
+        return options
+
+    def schema(self, model: Table, tree: Tree) -> BaseModel:
+        """Schema of a table with the expanded relationships of a tree as nested fields.
+        Created once per tree.
+        """
+        key = (model.__table__.name, freeze(tree))
+        with self.lock:
+            if key in self.derived:
+                return self.derived[key]
+        schema = self.schemas.response_schema(model.__table__.name)
+        fields = {}
+        for name, subtree in tree.items():
+            relationship = self.relationship(model, name)
+            related = self.schema(relationship.mapper.class_, subtree)
+            if relationship.uselist:
+                fields[name] = (List[related], [])
+            else:
+                fields[name] = (Optional[related], None)
+        derived = create_model(
+            f"{schema.__name__}_{'_'.join(sorted(tree))}", __base__=schema, **fields
+        )
+        with self.lock:
+            return self.derived.setdefault(key, derived)
+
+    @staticmethod
+    def within(columns: list, rows, row_columns: list):
+        """Condition of columns matching the values of the same number of columns of a subquery."""
+        selected = select(*(rows.c[column.name] for column in row_columns))
+        if len(columns) == 1:
+            return columns[0].in_(selected)
+        return tuple_(*columns).in_(selected)
+
+    def check(self, db: Session, model: Table, tree: Tree, entries) -> None:
+        # pylint: disable=C0301
+        """Checks the amount of related entries of a tree before they are loaded.
+        The related entries are counted per entry with a grouped query per relationship,
+        nested relationships are counted for the related entries of all entries.
+
+        :param db: Database session.
+        :type db: Session
+        :param model: SQLalchemy model of the table.
+        :type model: Table
+        :param tree: Expansion tree returned by parse.
+        :type tree: Tree
+        :param entries: Subquery selecting the entries whose relationships are expanded.
+        :type entries: Subquery
+        :raises HTTPException: Raises http 413 error for entries with more than max_related related entries.
+        """
+        # pylint: enable=C0301
+        for name, subtree in tree.items():
+            relationship = self.relationship(model, name)
+            related_table = relationship.mapper.local_table
+            if relationship.secondary is not None:
+                # many to many, the entries are linked by the rows of the secondary table
+                local = [pair[0] for pair in relationship.synchronize_pairs]
+                remote = [pair[1] for pair in relationship.synchronize_pairs]
+            else:
+                local = [pair[0] for pair in relationship.local_remote_pairs]
+                remote = [pair[1] for pair in relationship.local_remote_pairs]
+            condition = self.within(remote, entries, local)
+            if relationship.uselist:
+                exceeded = db.execute(
+                    select(*remote)
+                    .where(condition)
+                    .group_by(*remote)
+                    .having(func.count() > self.max_related)
+                    .limit(1)
+                ).first()
+                if exceeded:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"Expanding {name} returns more than"
+                        f" {self.max_related} entries for an entry",
+                    )
+            if not subtree:
+                continue
+            if relationship.secondary is not None:
+                links = select(relationship.secondary).where(condition).subquery()
+                related = select(related_table).where(
+                    self.within(
+                        [pair[0] for pair in relationship.secondary_synchronize_pairs],
+                        links,
+                        [pair[1] for pair in relationship.secondary_synchronize_pairs],
+                    )
+                )
+            else:
+                related = select(related_table).where(condition)
+            self.check(db, relationship.mapper.class_, subtree, related.subquery())
+
+    def expand(self, model: Table, tree: Tree, entries: list) -> list:
+        # pylint: disable=C0301
+        """Converts entries loaded with the options of a tree to the schema of the tree.
+
+        :param model: SQLalchemy model of the table.
+        :type model: Table
+        :param tree: Expansion tree returned by parse.
+        :type tree: Tree
+        :param entries: Entries loaded with the options of the tree, after check.
+        :type entries: list
+        :return: The entries with their related entries nested.
+        :rtype: list
+        """
+        # pylint: enable=C0301
+        schema = self.schema(model, tree)
+        return [schema.from_orm(entry) for entry in entries]
+
+    @staticmethod
+    def response(content) -> NegotiatedResponse:
+        """Response of expanded content.
+        In the negotiated format when content negotiation is enabled.
+        """
+        return NegotiatedResponse(jsonable_encoder(content))
+
+    def paginate(self, query: Query, model: Table, tree: Tree) -> NegotiatedResponse:
+        """Page of a query like fastapi_pagination paginate.
+        The relationships of the tree are expanded.
+        """
+        params = resolve_params()
+        total = query.count()
+        self.check(query.session, model, tree, paginate_query(query, params).subquery())
+        entries = paginate_query(query.options(*self.options(model, tree)), params)
+        page = create_page(self.expand(model, tree, entries.all()), total, params)
+        return self.response(page)
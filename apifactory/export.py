@@ -0,0 +1,186 @@
+"""Module containing the columnar export of tables.
+Rows are read from a server side cursor in batches and converted to Apache Arrow record batches,
+with the arrow types mapped from the reflected SQLAlchemy column types.
+Exports are streamed as Arrow IPC or written to a Parquet file in bounded memory.
+Requires pyarrow, installed with the arrow extra.
+"""
+import io
+import tempfile
+from typing import Iterator, List
+
+from sqlalchemy import Table
+from sqlalchemy import types as sqltypes
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+CHUNK_SIZE = 1024 * 1024
+
+
+def arrow_type(column_type: sqltypes.TypeEngine):  # pylint: disable=R0911
+    """Arrow type of a SQLAlchemy column type, string for types without an arrow equivalent.
+
+    :param column_type: Type of a reflected column.
+    :type column_type: sqltypes.TypeEngine
+    :return: The arrow type.
+    :rtype: pyarrow.DataType
+    """
+    # subclasses before the classes they derive from, Float is a Numeric
+    if isinstance(column_type, sqltypes.Boolean):
+        return pyarrow.bool_()
+    if isinstance(column_type, sqltypes.SmallInteger):
+        return pyarrow.int16()
+    if isinstance(column_type, sqltypes.Integer):
+        return pyarrow.int64()
+    if isinstance(column_type, sqltypes.Float):
+        return pyarrow.float64()
+    if isinstance(column_type, sqltypes.Numeric):
+        if column_type.asdecimal and column_type.precision:
+            return pyarrow.decimal128(column_type.precision, column_type.scale or 0)
+        # the values are converted to float in batches, they are Decimals with asdecimal
+        return pyarrow.float64()
+    if isinstance(column_type, sqltypes.DateTime):
+        return pyarrow.timestamp("us")
+    if isinstance(column_type, sqltypes.Date):
+        return pyarrow.date32()
+    if isinstance(column_type, sqltypes.Time):
+        return pyarrow.time64("us")
+    if isinstance(column_type, sqltypes.Interval):
+        return pyarrow.duration("us")
+    if isinstance(column_type, sqltypes._Binary):  # pylint: disable=W0212
+        return pyarrow.binary()
+    return pyarrow.string()
+
+
+class ArrowExport:
+    # pylint: disable=C0301
+    """Converts the rows of a table to arrow record batches and writes them as Arrow IPC or Parquet.
+
+    :param batch_size: Rows fetched from the cursor per record batch, defaults to 10000
+    :type batch_size: int, optional
+    :param spool_size: Bytes of a Parquet file kept in memory before it is moved to a temporary file, defaults to 64 MiB
+    :type spool_size: int, optional
+    :param compression: Compression codec of Parquet files, defaults to "snappy"
+    :type compression: str, optional
+
+
+    >>> exporter = ArrowExport(batch_size=5000)
+    >>> response = client.get("/test_table/export?format=parquet")
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        batch_size: int = 10000,
+        spool_size: int = 64 * 1024 * 1024,
+        compression: str = "snappy",
+    ) -> None:
+        if pyarrow is None:
+            raise ImportError("Exports require pyarrow, install apifactory[arrow]")
+        self.batch_size = batch_size
+        self.spool_size = spool_size
+        self.compression = compression
+
+    @staticmethod
+    def schema(table: Table):
+        """Arrow schema of a table.
+
+        :param table: Reflected table.
+        :type table: Table
+        :return: Schema with a nullable field per column.
+        :rtype: pyarrow.Schema
+        """
+        return pyarrow.schema(
+            [
+                pyarrow.field(column.name, arrow_type(column.type), column.nullable)
+                for column in table.columns
+            ]
+        )
+
+    def batches(self, result, schema) -> Iterator:
+        """Converts the rows of a streamed result to record batches.
+
+        :param result: Result of a statement executed with stream_results.
+        :type result: Result
+        :param schema: Arrow schema of the selected columns.
+        :type schema: pyarrow.Schema
+        :yield: Record batches of at most batch_size rows.
+        :rtype: Iterator[pyarrow.RecordBatch]
+        """
+        for rows in result.partitions(self.batch_size):
+            columns = list(zip(*rows))
+            arrays: List = []
+            for position, field in enumerate(schema):
+                values = columns[position]
+                if pyarrow.types.is_string(field.type):
+                    values = [
+                        value if value is None else str(value) for value in values
+                    ]
+                elif pyarrow.types.is_floating(field.type):
+                    # numeric columns without a precision return Decimals
+                    values = [
+                        value if value is None else float(value) for value in values
+                    ]
+                arrays.append(pyarrow.array(values, type=field.type))
+            yield pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def arrow_stream(self, result, schema) -> Iterator[bytes]:
+        """Arrow IPC stream of a result, yielding the bytes of every record batch as it is read.
+
+        :param result: Result of a statement executed with stream_results.
+        :type result: Result
+        :param schema: Arrow schema of the selected columns.
+        :type schema: pyarrow.Schema
+        :yield: Bytes of the stream.
+        :rtype: Iterator[bytes]
+        """
+        sink = io.BytesIO()
+        with pyarrow.ipc.new_stream(sink, schema) as writer:
+            for batch in self.batches(result, schema):
+                writer.write_batch(batch)
+                # hand the written batch to the client and reuse the buffer
+                yield sink.getvalue()
+                sink.seek(0)
+                sink.truncate()
+        yield sink.getvalue()
+
+    def parquet_file(self, result, schema):
+        # pylint: disable=C0301
+        """Writes a result to a Parquet file, one row group per record batch.
+        The file is kept in memory up to spool_size bytes and moved to a temporary file beyond that.
+
+        :param result: Result of a statement executed with stream_results.
+        :type result: Result
+        :param schema: Arrow schema of the selected columns.
+        :type schema: pyarrow.Schema
+        :return: The file, positioned at its start, and its size.
+        :rtype: Tuple[SpooledTemporaryFile, int]
+        """
+        # pylint: enable=C0301
+        # returned open, chunks closes it once the response is sent
+        spooled = tempfile.SpooledTemporaryFile(  # pylint: disable=R1732
+            max_size=self.spool_size
+        )
+        with pyarrow.parquet.ParquetWriter(
+            spooled, schema, compression=self.compression
+        ) as writer:
+            for batch in self.batches(result, schema):
+                writer.write_batch(batch)
+        size = spooled.tell()
+        spooled.seek(0)
+        return spooled, size
+
+    @staticmethod
+    def chunks(spooled) -> Iterator[bytes]:
+        """Reads a file in chunks, closing it at the end."""
+        try:
+            while chunk := spooled.read(CHUNK_SIZE):
+                yield chunk
+        finally:
+            spooled.close()
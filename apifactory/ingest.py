@@ -0,0 +1,332 @@
+"""Module containing the streaming bulk ingest of tables.
+The request body is read as a stream of NDJSON or CSV rows, optionally gzip compressed.
+Rows are validated one at a time against the schema of the table and inserted in chunks,
+so memory stays flat regardless of the size of the upload.
+Rows are published to subscribers when their transaction commits. Uploads in a single transaction
+(commit_every 0) are not published, their rows are not kept until the commit.
+"""
+import asyncio
+import codecs
+import csv
+import json
+import zlib
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import Table
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from apifactory.utils import exclude_columns, primary_key_checker
+
+FORMATS = {
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/json-seq": "ndjson",
+    "text/csv": "csv",
+}
+
+Row = Tuple[int, Optional[dict], Optional[str]]
+
+
+def sync_chunks(
+    stream: AsyncIterator[bytes], loop: asyncio.AbstractEventLoop
+) -> Iterator[bytes]:
+    """Reads an asynchronous body stream from a worker thread, one chunk at a time.
+
+    :param stream: Body stream of the request.
+    :type stream: AsyncIterator[bytes]
+    :param loop: Event loop the request is handled on.
+    :type loop: asyncio.AbstractEventLoop
+    :yield: Chunks of the body.
+    :rtype: Iterator[bytes]
+    """
+
+    async def next_chunk() -> Optional[bytes]:
+        try:
+            return await stream.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    while True:
+        chunk = asyncio.run_coroutine_threadsafe(next_chunk(), loop).result()
+        if chunk is None:
+            return
+        yield chunk
+
+
+def body_lines(chunks: Iterator[bytes], compressed: bool = False) -> Iterator[str]:
+    """Decodes a chunked utf-8 body into lines, decompressing gzip bodies on the fly.
+
+    :param chunks: Chunks of the body.
+    :type chunks: Iterator[bytes]
+    :param compressed: Whether the body is gzip compressed, defaults to False
+    :type compressed: bool, optional
+    :yield: Lines of the body, including their line ending.
+    :rtype: Iterator[str]
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if compressed else None
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    for chunk in chunks:
+        if decompressor:
+            chunk = decompressor.decompress(chunk)
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line + "\n"
+    tail = decompressor.flush() if decompressor else b""
+    pending += decoder.decode(tail, final=True)
+    if pending:
+        yield pending
+
+
+def ndjson_rows(lines: Iterator[str]) -> Iterator[Row]:
+    """Parses NDJSON lines into rows, blank lines are skipped.
+
+    :yield: Line number, the row and an error message for lines that are not a json object.
+    :rtype: Iterator[Row]
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            yield number, None, f"invalid json: {error}"
+            continue
+        if not isinstance(row, dict):
+            yield number, None, "line is not a json object"
+            continue
+        yield number, row, None
+
+
+def csv_rows(lines: Iterator[str]) -> Iterator[Row]:
+    """Parses CSV lines with a header into rows, empty fields are null.
+
+    :yield: Line number, the row and an error message for lines that do not match the header.
+    :rtype: Iterator[Row]
+    """
+    reader = csv.DictReader(lines)
+    for row in reader:
+        if None in row:
+            yield reader.line_num, None, "more fields than columns in the header"
+            continue
+        yield reader.line_num, {
+            key: None if value == "" else value for key, value in row.items()
+        }, None
+
+
+def error_message(error: SQLAlchemyError) -> str:
+    """First line of the message of the database error behind a SQLAlchemy error."""
+    return str(getattr(error, "orig", None) or error).splitlines()[0]
+
+
+class BulkIngest:
+    # pylint: disable=C0301
+    """Inserts streamed rows in chunks, reporting the rows that could not be inserted.
+
+    :param chunk_size: Rows per insert statement, defaults to 1000
+    :type chunk_size: int, optional
+    :param commit_every: Chunks per transaction, 0 inserts the whole upload in a single transaction, defaults to 1
+    :type commit_every: int, optional
+    :param max_errors: Maximum amount of row errors reported, further errors are only counted, defaults to 100
+    :type max_errors: int, optional
+
+
+    >>> ingest = BulkIngest(chunk_size=5000, commit_every=10)
+    >>> client.post("/test_table/bulk", data=ndjson, headers={"Content-Type": "application/x-ndjson"})
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self, chunk_size: int = 1000, commit_every: int = 1, max_errors: int = 100
+    ) -> None:
+        self.chunk_size = chunk_size
+        self.commit_every = commit_every
+        self.max_errors = max_errors
+
+    @staticmethod
+    def row_format(content_type: str) -> Optional[str]:
+        """Format of the rows of a request by its Content-Type, None for unsupported types."""
+        return FORMATS.get(content_type.split(";")[0].strip().lower())
+
+    def ingest(
+        self,
+        db: Session,
+        model: Table,
+        schema: BaseModel,
+        rows: Iterator[Row],
+        excluded_columns: Optional[List] = None,
+        charge: Optional[Callable[[int], None]] = None,
+        publish: Optional[Callable] = None,
+    ) -> dict:
+        # pylint: disable=C0301
+        """Validates and inserts rows.
+        When a chunk fails to insert, the rows of the transaction are inserted one row per transaction,
+        so only the failing rows are left out. With commit_every 0 the upload is a single transaction
+        and a failing chunk rolls back the whole upload.
+        Every chunk is charged by its rows before it is inserted. When the charge is refused the rest of the upload
+        is left out, the rows inserted before are committed, or rolled back with commit_every 0.
+
+        :param db: Database session.
+        :type db: Session
+        :param model: SQLalchemy model of the table.
+        :type model: Table
+        :param schema: Pydantic schema to validate the rows with.
+        :type schema: BaseModel
+        :param rows: Parsed rows with their line numbers.
+        :type rows: Iterator[Row]
+        :param excluded_columns: Columns left out of the inserted rows, defaults to None
+        :type excluded_columns: Optional[List], optional
+        :param charge: Charges the rows of a chunk against a ratelimit, raising http 429 error when it is exceeded, defaults to None
+        :type charge: Optional[Callable[[int], None]], optional
+        :param publish: Publishes the rows of committed transactions to subscribers, called with the operation, key and entry, defaults to None
+        :type publish: Optional[Callable], optional
+        :raises HTTPException: Raises the http 429 error of charge, with the report of the rows inserted before as detail.
+        :return: Report with the amount of inserted and failed rows and the row errors.
+        :rtype: dict
+        """
+        # pylint: enable=C0301
+        report = {"inserted": 0, "failed": 0, "errors": []}
+        statement = model.__table__.insert()
+        key_name, _ = primary_key_checker(model)
+        chunk: List[Tuple[int, dict]] = []
+        # rows of the open transaction, kept to retry them when commit_every is set
+        uncommitted: List[Tuple[int, dict]] = []
+        pending = 0
+
+        def fail(line: int, errors) -> None:
+            report["failed"] += 1
+            if len(report["errors"]) < self.max_errors:
+                report["errors"].append({"line": line, "errors": errors})
+
+        def published(committed: List[Tuple[int, dict]]) -> None:
+            if publish:
+                for _, content in committed:
+                    publish("insert", content.get(key_name), content)
+
+        def retry(failed_rows: List[Tuple[int, dict]]) -> None:
+            for line, content in failed_rows:
+                try:
+                    db.execute(statement, [content])
+                    db.commit()
+                except SQLAlchemyError as error:
+                    db.rollback()
+                    fail(line, [{"msg": error_message(error)}])
+                else:
+                    report["inserted"] += 1
+                    published([(line, content)])
+
+        def roll_back(line: int, error: SQLAlchemyError) -> None:
+            db.rollback()
+            fail(line, [{"msg": f"{error_message(error)}, the upload was rolled back"}])
+            report["failed"] += pending + len(chunk) - 1
+            report["rolled_back"] = True
+
+        def commit() -> None:
+            nonlocal uncommitted, pending
+            try:
+                db.commit()
+            except SQLAlchemyError as error:
+                if not self.commit_every:
+                    roll_back(uncommitted[0][0] if uncommitted else 0, error)
+                    return
+                db.rollback()
+                retry(uncommitted)
+            else:
+                report["inserted"] += pending
+                published(uncommitted)
+            uncommitted, pending = [], 0
+
+        def refuse(error: HTTPException) -> None:
+            if self.commit_every:
+                if pending:
+                    commit()
+            else:
+                db.rollback()
+                report["rolled_back"] = True
+            raise HTTPException(
+                status_code=error.status_code,
+                detail={"detail": error.detail, **report},
+                headers=error.headers,
+            ) from error
+
+        def insert_chunk() -> bool:
+            nonlocal chunk, uncommitted, pending
+            if not chunk:
+                return True
+            if charge:
+                try:
+                    charge(len(chunk))
+                except HTTPException as error:
+                    refuse(error)
+            try:
+                db.execute(statement, [content for _, content in chunk])
+            except SQLAlchemyError as error:
+                if not self.commit_every:
+                    roll_back(chunk[0][0], error)
+                    return False
+                db.rollback()
+                retry(uncommitted + chunk)
+                chunk, uncommitted, pending = [], [], 0
+                return True
+            pending += len(chunk)
+            if self.commit_every:
+                uncommitted += chunk
+                if pending >= self.commit_every * self.chunk_size:
+                    commit()
+            chunk = []
+            return True
+
+        for line, row, error in rows:
+            if error:
+                fail(line, [{"msg": error}])
+                continue
+            try:
+                content = schema(**row).dict()
+            except ValidationError as validation_error:
+                fail(line, validation_error.errors())
+                continue
+            if excluded_columns:
+                content = exclude_columns(content, excluded_columns)
+            chunk.append((line, content))
+            if len(chunk) >= self.chunk_size and not insert_chunk():
+                return report
+        if insert_chunk() and pending:
+            commit()
+        return report
+
+    def ingest_body(
+        self,
+        db: Session,
+        model: Table,
+        schema: BaseModel,
+        chunks: Iterator[bytes],
+        row_format: str,
+        compressed: bool = False,
+        excluded_columns: Optional[List] = None,
+        charge: Optional[Callable[[int], None]] = None,
+        publish: Optional[Callable] = None,
+    ) -> dict:
+        # pylint: disable=C0301
+        """Parses a streamed body and ingests its rows, see ingest.
+
+        :raises HTTPException: Raises http 400 error for bodies that cannot be decompressed or decoded, and the http 429 error of charge.
+        :return: Report with the amount of inserted and failed rows and the row errors.
+        :rtype: dict
+        """
+        # pylint: enable=C0301
+        lines = body_lines(chunks, compressed)
+        rows = csv_rows(lines) if row_format == "csv" else ndjson_rows(lines)
+        try:
+            return self.ingest(
+                db, model, schema, rows, excluded_columns, charge, publish
+            )
+        except (zlib.error, UnicodeDecodeError, csv.Error) as error:
+            db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unreadable body: {error}",
+            ) from error
@@ -0,0 +1,459 @@
+"""Module containing the asynchronous bulk jobs of tables.
+Bulk writes submitted as a job are answered directly with http 202 and the id of the job.
+The rows are written in the background by a bounded pool of workers, chunk by chunk,
+while the state and progress of the job are kept in a local sqlite store that survives restarts.
+Running jobs are kept alive by a heartbeat of the process running them,
+jobs whose heartbeat stopped are failed by any process sharing the store.
+The rows of every committed chunk are published to the subscribers of the table.
+"""
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy import Table
+from sqlalchemy.orm import Session
+
+from apifactory.utils import exclude_columns, primary_key_checker, upsert_entry
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# writes a chunk of rows, returning the events (operation, key, entry) of the written rows
+Work = Callable[[Session, List[dict]], List[tuple]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    state TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    worker INTEGER,
+    heartbeat TEXT,
+    payload TEXT,
+    created TEXT NOT NULL,
+    updated TEXT NOT NULL
+)
+"""
+FIELDS = "id, owner, table_name, operation, state, total, done, error, created, updated"
+
+
+def now(offset: float = 0) -> str:
+    """Current time in utc, moved by offset seconds, as an iso formatted string."""
+    return (datetime.datetime.utcnow() + datetime.timedelta(seconds=offset)).isoformat()
+
+
+def insert_rows(
+    db: Session,
+    rows: List[dict],
+    model: Table,
+    schema: BaseModel,
+    excluded_columns: Optional[List] = None,
+) -> List[tuple]:
+    """Inserts rows with a single insert statement, like a post of a list of entries."""
+    primary_key_col, _ = primary_key_checker(model)
+    contents = []
+    for row in rows:
+        content = schema(**row).dict()
+        if excluded_columns:
+            content = exclude_columns(content, excluded_columns)
+        contents.append(content)
+    db.execute(model.__table__.insert(), contents)
+    return [("insert", content.get(primary_key_col), content) for content in contents]
+
+
+def upsert_rows(
+    db: Session,
+    rows: List[dict],
+    model: Table,
+    schema: BaseModel,
+    excluded_columns: Optional[List] = None,
+) -> List[tuple]:
+    """Updates rows by primary key and inserts the missing ones, like a put of a list of entries."""
+    primary_key_col, _ = primary_key_checker(model)
+    events = []
+    for row in rows:
+        content = schema(**row).dict()
+        primary_key = content[primary_key_col]
+        if excluded_columns:
+            content = exclude_columns(content, excluded_columns)
+        operation = upsert_entry(db, model, primary_key, content)
+        events.append(
+            (operation, primary_key, {**content, primary_key_col: primary_key})
+        )
+    return events
+
+
+OPERATIONS = {"insert": insert_rows, "upsert": upsert_rows}
+
+
+class JobStore:
+    """Keeps the state, progress and rows of jobs in a sqlite database.
+    Every call uses a connection of its own,
+    so the store can be shared by threads and forked workers.
+
+    :param path: Path of the sqlite database file.
+    :type path: str
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with self.connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(SCHEMA)
+            columns = [
+                row["name"] for row in connection.execute("PRAGMA table_info(jobs)")
+            ]
+            if "heartbeat" not in columns:
+                # stores created before jobs had a heartbeat
+                connection.execute("ALTER TABLE jobs ADD COLUMN heartbeat TEXT")
+
+    @contextlib.contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """Connection to the store, committed when the block ends without error."""
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def create(self, owner: str, table: str, operation: str, rows: List[dict]) -> dict:
+        """Stores a new queued job with its rows.
+
+        :return: The job, see get.
+        :rtype: dict
+        """
+        job_id = uuid.uuid4().hex
+        created = now()
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, owner, table_name, operation, state, total, payload, "
+                "created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    owner,
+                    table,
+                    operation,
+                    QUEUED,
+                    len(rows),
+                    json.dumps(rows),
+                    created,
+                    created,
+                ),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Returns a job without its rows, None for unknown jobs."""
+        with self.connect() as connection:
+            row = connection.execute(
+                f"SELECT {FIELDS} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["table"] = job.pop("table_name")
+        return job
+
+    def claim(self, job_id: str) -> Optional[Tuple[str, str, List[dict]]]:
+        # pylint: disable=C0301
+        """Marks a queued job as running in this process, with a first heartbeat.
+        A job is claimed once, also when several processes try to run it.
+
+        :return: Table, operation and rows of the job, None if the job was not queued.
+        :rtype: Optional[Tuple[str, str, List[dict]]]
+        """
+        # pylint: enable=C0301
+        with self.connect() as connection:
+            claimed = connection.execute(
+                "UPDATE jobs SET state = ?, worker = ?, heartbeat = ?, updated = ? "
+                "WHERE id = ? AND state = ?",
+                (RUNNING, os.getpid(), now(), now(), job_id, QUEUED),
+            ).rowcount
+            if not claimed:
+                return None
+            row = connection.execute(
+                "SELECT table_name, operation, payload FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        return row["table_name"], row["operation"], json.loads(row["payload"])
+
+    def progress(self, job_id: str, done: int) -> None:
+        """Records the amount of rows written by a running job."""
+        with self.connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET done = ?, updated = ? WHERE id = ?",
+                (done, now(), job_id),
+            )
+
+    def finish(self, job_id: str, state: str, error: Optional[str] = None) -> None:
+        """Records the final state of a job and drops its rows."""
+        with self.connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET state = ?, error = ?, payload = NULL, updated = ? WHERE id = ?",
+                (state, error, now(), job_id),
+            )
+
+    def queued(self, table: str, operation: str) -> List[str]:
+        """Ids of the queued jobs of a table and operation, oldest first."""
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT id FROM jobs WHERE state = ? AND table_name = ? AND operation = ? "
+                "ORDER BY created",
+                (QUEUED, table, operation),
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def beat(self, job_ids: List[str]) -> None:
+        """Records a heartbeat for the running jobs of this process."""
+        if not job_ids:
+            return
+        with self.connect() as connection:
+            connection.executemany(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND state = ?",
+                [(now(), job_id, RUNNING) for job_id in job_ids],
+            )
+
+    def recover(self, stale: float) -> None:
+        # pylint: disable=C0301
+        """Fails the running jobs of processes that stopped, for example by a restart.
+        Jobs are judged by their heartbeat instead of the process id, which a restarted container may reuse.
+
+        :param stale: Seconds without heartbeat after which a running job is failed.
+        :type stale: float
+        """
+        # pylint: enable=C0301
+        with self.connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET state = ?, error = ?, payload = NULL, updated = ? "
+                "WHERE state = ? AND (heartbeat IS NULL OR heartbeat < ?)",
+                (FAILED, "interrupted by a restart", now(), RUNNING, now(-stale)),
+            )
+
+    def purge(self, retention: float) -> None:
+        """Deletes finished jobs that were last updated more than retention seconds ago."""
+        before = (
+            datetime.datetime.utcnow() - datetime.timedelta(seconds=retention)
+        ).isoformat()
+        with self.connect() as connection:
+            connection.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?) AND updated < ?",
+                (SUCCEEDED, FAILED, before),
+            )
+
+
+class Jobs:
+    # pylint: disable=C0301
+    """Runs bulk writes of the generated endpoints as background jobs on a bounded pool of workers.
+    Rows are written and committed chunk_size rows at a time, recording the progress after every chunk.
+    Queued jobs left by a previous run are resumed when the app starts,
+    jobs that were running when the app stopped are marked as failed with the rows written so far,
+    once their heartbeat is older than three heartbeat intervals.
+
+    :param get_db: Function to acquire a database session, a generator like Database.get_db.
+    :type get_db: Callable
+    :param store: Path of the sqlite file storing the jobs, defaults to "apifactory_jobs.db"
+    :type store: str, optional
+    :param workers: Amount of jobs running at the same time, defaults to 2
+    :type workers: int, optional
+    :param chunk_size: Rows written per transaction, defaults to 500
+    :type chunk_size: int, optional
+    :param retention: Seconds finished jobs are kept in the store, defaults to 86400
+    :type retention: float, optional
+    :param route: Route of the job status endpoint, defaults to "/jobs"
+    :type route: str, optional
+    :param heartbeat: Seconds between the heartbeats of running jobs and the checks for jobs whose heartbeat stopped, defaults to 10
+    :type heartbeat: float, optional
+
+
+    >>> jobs = Jobs(db.get_db, store="/var/lib/api/jobs.db", workers=4)
+    >>> client.post("/test_table/jobs", json=rows).json()["id"]
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        get_db: Callable,
+        store: str = "apifactory_jobs.db",
+        workers: int = 2,
+        chunk_size: int = 500,
+        retention: float = 86400,
+        route: str = "/jobs",
+        heartbeat: float = 10,
+    ) -> None:
+        self.get_db = get_db
+        self.heartbeat = heartbeat
+        self.store = JobStore(store)
+        self.store.recover(3 * heartbeat)
+        # threads are started on the first job, so the pool can be created before forking
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="apifactory-jobs"
+        )
+        self.chunk_size = chunk_size
+        self.retention = retention
+        self.route = route
+        self.works: Dict[Tuple[str, str], Work] = {}
+        self.publishers: Dict[str, Callable] = {}
+        self.running: set = set()
+        self.started = False
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def register(
+        self,
+        table: str,
+        operation: str,
+        work: Work,
+        publish: Optional[Callable] = None,
+    ) -> None:
+        # pylint: disable=C0301
+        """Registers the function writing the rows of the jobs of a table and operation.
+
+        :param table: Name of the table.
+        :type table: str
+        :param operation: Name of the operation, insert or upsert.
+        :type operation: str
+        :param work: Function writing a chunk of rows in a session.
+        :type work: Work
+        :param publish: Publishes the events of committed chunks to subscribers, called with the operation, key and entry, defaults to None
+        :type publish: Optional[Callable], optional
+        """
+        # pylint: enable=C0301
+        with self.lock:
+            self.works[(table, operation)] = work
+            if publish:
+                self.publishers[table] = publish
+            started = self.started
+        if started:
+            # tables created lazily register after the app started
+            self.resume(table, operation)
+
+    def resume(self, table: str, operation: str) -> None:
+        """Queues the stored jobs of a table and operation on the workers."""
+        for job_id in self.store.queued(table, operation):
+            self.executor.submit(self.run, job_id)
+
+    def start(self) -> None:
+        """Resumes the queued jobs of all registered tables and starts the heartbeat.
+        Run when the app starts.
+        """
+        with self.lock:
+            self.started = True
+            keys = list(self.works)
+        for table, operation in keys:
+            self.resume(table, operation)
+        threading.Thread(
+            target=self.beat, name="apifactory-jobs-heartbeat", daemon=True
+        ).start()
+
+    def beat(self) -> None:
+        """Target of the heartbeat thread.
+        Keeps the running jobs of this process alive and fails the jobs whose heartbeat stopped.
+        """
+        while not self.stopped.wait(self.heartbeat):
+            with self.lock:
+                running = list(self.running)
+            self.store.beat(running)
+            self.store.recover(3 * self.heartbeat)
+
+    def submit(self, owner: str, table: str, operation: str, rows: List[dict]) -> dict:
+        """Stores a job and queues it on the workers.
+
+        :param owner: User submitting the job, only the owner can view it.
+        :type owner: str
+        :param table: Name of the table.
+        :type table: str
+        :param operation: Name of the operation, insert or upsert.
+        :type operation: str
+        :param rows: Json compatible rows to write.
+        :type rows: List[dict]
+        :return: The queued job.
+        :rtype: dict
+        """
+        self.store.purge(self.retention)
+        job = self.store.create(owner, table, operation, rows)
+        self.executor.submit(self.run, job["id"])
+        return job
+
+    def run(self, job_id: str) -> None:
+        """Writes the rows of a job chunk by chunk, recording its progress and final state."""
+        claimed = self.store.claim(job_id)
+        if claimed is None:
+            return
+        table, operation, rows = claimed
+        work = self.works.get((table, operation))
+        if work is None:
+            self.store.finish(job_id, FAILED, f"no {operation} jobs for table {table}")
+            return
+        publish = self.publishers.get(table)
+        with self.lock:
+            self.running.add(job_id)
+        sessions = self.get_db()
+        db = next(sessions)
+        try:
+            for start in range(0, len(rows), self.chunk_size):
+                chunk = rows[start : start + self.chunk_size]
+                events = work(db, chunk)
+                db.commit()
+                self.store.progress(job_id, start + len(chunk))
+                if publish:
+                    for event in events:
+                        publish(*event)
+        except Exception as error:  # pylint: disable=W0703
+            db.rollback()
+            message = str(getattr(error, "orig", None) or error).splitlines()[0]
+            self.store.finish(job_id, FAILED, message)
+        else:
+            self.store.finish(job_id, SUCCEEDED)
+        finally:
+            sessions.close()
+            with self.lock:
+                self.running.discard(job_id)
+
+    def location(self, job_id: str) -> str:
+        """Path of the status endpoint of a job."""
+        return f"{self.route}/{job_id}"
+
+    def router(self, get_current_user: Callable) -> APIRouter:
+        """Creates the route returning the state and progress of a job to its owner.
+
+        :param get_current_user: Function to acquire and verify the current user.
+        :type get_current_user: Callable
+        :return: Router containing the job status route.
+        :rtype: APIRouter
+        """
+        router = APIRouter(tags=["jobs"])
+
+        @router.get(f"{self.route}/{{job_id}}")
+        def job_status(job_id: str, current_user=Depends(get_current_user)):
+            job = self.store.get(job_id)
+            if job is None or job["owner"] != current_user.email:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"job {job_id} does not exist",
+                )
+            return job
+
+        return router
+
+    def shutdown(self) -> None:
+        """Stops the workers, waiting for running jobs, and the heartbeat.
+        Queued jobs resume on the next start.
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.stopped.set()
@@ -0,0 +1,335 @@
+"""Module containing the metrics of the generated routes and the database pools.
+Metrics are exposed in the prometheus text format on the metrics route.
+Every thread records into a shard of its own, so recording a metric takes no locks;
+shards are only merged when the metrics are collected.
+"""
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+from apifactory.routing import Handler, after_body
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+POOL_WAIT_KEY = "apifactory_pool_wait"
+
+
+def escape(value) -> str:
+    """Escapes a label value for the prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    """Formats label names and values as {name="value",...}."""
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    # pylint: disable=C0301
+    """Base class of the metrics, keeping a shard of values per thread.
+
+    :param name: Name of the metric.
+    :type name: str
+    :param description: Help text of the metric.
+    :type description: str
+    :param labels: Names of the labels of the metric, defaults to ()
+    :type labels: Sequence[str], optional
+    """
+    # pylint: enable=C0301
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.local = threading.local()
+        self.shards: List[dict] = []
+        self.shards_lock = threading.Lock()
+
+    def shard(self) -> dict:
+        """Returns the shard of the current thread."""
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = {}
+            with self.shards_lock:
+                self.shards.append(shard)
+            return shard
+
+    def merged(self) -> Dict[Tuple, float]:
+        """Sums the values of all shards per label combination."""
+        totals: Dict[Tuple, float] = {}
+        with self.shards_lock:
+            shards = list(self.shards)
+        for shard in shards:
+            for labels, value in list(shard.items()):
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def samples(self) -> Iterable[str]:
+        """Lines of the text format containing the values of the metric."""
+        for labels, value in sorted(self.merged().items()):
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+    def exposition(self) -> str:
+        """The metric in the prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.metric_type}",
+            *self.samples(),
+        ]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+
+    metric_type = "counter"
+
+    def inc(self, labels: Tuple = (), value: float = 1) -> None:
+        """Increases the counter of the label values by value."""
+        shard = self.shard()
+        shard[labels] = shard.get(labels, 0) + value
+
+
+class Gauge(Counter):
+    """Value that can go up and down, for example the amount of requests in flight."""
+
+    metric_type = "gauge"
+
+    def dec(self, labels: Tuple = (), value: float = 1) -> None:
+        """Decreases the gauge of the label values by value."""
+        self.inc(labels, -value)
+
+
+class Histogram(Metric):
+    # pylint: disable=C0301
+    """Histogram counting observations in cumulative buckets.
+
+    :param name: Name of the metric.
+    :type name: str
+    :param description: Help text of the metric.
+    :type description: str
+    :param labels: Names of the labels of the metric, defaults to ()
+    :type labels: Sequence[str], optional
+    :param buckets: Upper bounds of the buckets, defaults to LATENCY_BUCKETS
+    :type buckets: Sequence[float], optional
+    """
+    # pylint: enable=C0301
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: Tuple = ()) -> None:
+        """Records an observation for the label values."""
+        shard = self.shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # bucket counts followed by the sum and count of the observations
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        for number, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[number] += 1
+                break
+        counts[-2] += value
+        counts[-1] += 1
+
+    def merged(self) -> Dict[Tuple, list]:
+        totals: Dict[Tuple, list] = {}
+        with self.shards_lock:
+            shards = list(self.shards)
+        for shard in shards:
+            for labels, counts in list(shard.items()):
+                total = totals.setdefault(labels, [0] * len(counts))
+                for number, count in enumerate(list(counts)):
+                    total[number] += count
+        return totals
+
+    def samples(self) -> Iterable[str]:
+        for labels, counts in sorted(self.merged().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = format_labels(self.labels, labels, f'le="{bound}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            inf_labels = format_labels(self.labels, labels, 'le="+Inf"')
+            yield f"{self.name}_bucket{inf_labels} {counts[-1]}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {counts[-2]}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {counts[-1]}"
+
+
+class Metrics:
+    # pylint: disable=C0301
+    """Metrics of the generated routes and the connection pools of the database.
+
+    :param sessionmakers: Sessionmakers by name of the pool, used to measure the wait for a connection, defaults to None
+    :type sessionmakers: Optional[dict], optional
+    :param engines: Engines by name of the pool, used to report the utilization of the pools, defaults to None
+    :type engines: Optional[dict], optional
+
+
+    >>> db = Database(database_url)
+    >>> metrics = Metrics(db.sessionmakers, db.named_engines())
+    >>> routers = Routers(..., route_hooks=[metrics.route_hook])
+    >>> app.add_api_route("/metrics", metrics.endpoint)
+    """
+    # pylint: enable=C0301
+
+    def __init__(self, sessionmakers: dict = None, engines: dict = None) -> None:
+        route_labels = ("method", "route", "table")
+        self.requests = Counter(
+            "apifactory_requests_total",
+            "Requests handled per route and status code.",
+            (*route_labels, "status"),
+        )
+        self.latency = Histogram(
+            "apifactory_request_duration_seconds",
+            "Time spent handling requests per route.",
+            route_labels,
+        )
+        self.in_flight = Gauge(
+            "apifactory_requests_in_flight",
+            "Requests currently being handled per route.",
+            route_labels,
+        )
+        self.response_size = Histogram(
+            "apifactory_response_size_bytes",
+            "Size of the response bodies per route.",
+            route_labels,
+            buckets=SIZE_BUCKETS,
+        )
+        self.pool_wait = Histogram(
+            "apifactory_pool_wait_seconds",
+            "Time a session waited for a connection from the pool.",
+            ("pool",),
+        )
+        self.engines = engines or {}
+        for name, local_session in (sessionmakers or {}).items():
+            self.install(name, local_session)
+
+    def install(self, name: str, local_session) -> None:
+        """Installs the listeners measuring the wait for connections on a sessionmaker.
+
+        :param name: Name of the pool to report.
+        :type name: str
+        :param local_session: Sessionmaker creating the sessions of the pool.
+        :type local_session: sessionmaker
+        """
+
+        def transaction_created(session, transaction):
+            if transaction.parent is None:
+                session.info[POOL_WAIT_KEY] = time.perf_counter()
+
+        def transaction_began(session, _transaction, _connection):
+            started = session.info.pop(POOL_WAIT_KEY, None)
+            if started is not None:
+                self.pool_wait.observe(time.perf_counter() - started, (name,))
+
+        event.listen(local_session, "after_transaction_create", transaction_created)
+        event.listen(local_session, "after_begin", transaction_began)
+
+    def route_hook(self, route: APIRoute, handler: Handler) -> Handler:
+        """Route hook recording the metrics of the requests of a route.
+
+        :param route: Route to measure.
+        :type route: APIRoute
+        :param handler: Request handler of the route.
+        :type handler: Handler
+        :return: Request handler recording metrics.
+        :rtype: Handler
+        """
+        table = route.tags[0] if route.tags else ""
+        path = route.path_format
+
+        async def measured_handler(request: Request) -> Response:
+            labels = (request.method, path, table)
+            self.in_flight.inc(labels)
+            started = time.perf_counter()
+            status = 500
+            size = None
+
+            def finish(sent: Optional[int] = None) -> None:
+                self.latency.observe(time.perf_counter() - started, labels)
+                if sent is not None:
+                    self.response_size.observe(sent, labels)
+                self.requests.inc((*labels, status))
+                self.in_flight.dec(labels)
+
+            streamed = False
+            try:
+                response = await handler(request)
+                status = response.status_code
+                size = response.headers.get("content-length")
+                # streamed responses are measured when their body is sent
+                streamed = after_body(response, finish)
+                return response
+            except Exception as error:
+                status = getattr(error, "status_code", 500)
+                raise
+            finally:
+                if not streamed:
+                    finish(int(size) if size is not None else None)
+
+        return measured_handler
+
+    def pool_samples(self) -> str:
+        """Gauges of the utilization of the connection pools, read when collecting."""
+        gauges = {
+            "apifactory_pool_size": ("Configured size of the pool.", "size"),
+            "apifactory_pool_checked_out": (
+                "Connections currently checked out of the pool.",
+                "checkedout",
+            ),
+            "apifactory_pool_overflow": (
+                "Connections currently opened beyond the size of the pool.",
+                "overflow",
+            ),
+        }
+        lines = []
+        for metric_name, (description, method) in gauges.items():
+            lines.extend(
+                [f"# HELP {metric_name} {description}", f"# TYPE {metric_name} gauge"]
+            )
+            for name, engine in self.engines.items():
+                # only queue pools report their size and overflow
+                value = getattr(engine.pool, method, None)
+                if value:
+                    lines.append(f'{metric_name}{{pool="{escape(name)}"}} {value()}')
+        return "\n".join(lines)
+
+    def exposition(self) -> str:
+        """All metrics in the prometheus text format."""
+        metrics = (
+            self.requests,
+            self.latency,
+            self.in_flight,
+            self.response_size,
+            self.pool_wait,
+        )
+        parts = [metric.exposition() for metric in metrics]
+        parts.append(self.pool_samples())
+        return "\n".join(parts) + "\n"
+
+    async def endpoint(self) -> PlainTextResponse:
+        """Endpoint serving the metrics."""
+        return PlainTextResponse(
+            self.exposition(), media_type="text/plain; version=0.0.4"
+        )
@@ -0,0 +1,190 @@
+"""Module containing the content negotiation of the generated endpoints.
+Clients choose the format of a response with the Accept header: json, or the compact binary formats
+MessagePack and Arrow IPC when msgpack and pyarrow are installed.
+"""
+import contextvars
+import io
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import Request, Response, status
+from fastapi.responses import JSONResponse
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.routing import APIRoute
+
+from apifactory.routing import Handler
+from apifactory.utils import quality_values
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
+current_format: contextvars.ContextVar = contextvars.ContextVar(
+    "apifactory_format", default=None
+)
+
+
+def parse_accept(header: str) -> List[Tuple[str, float]]:
+    """Parses an Accept header into media types and their quality, best first.
+
+    :param header: Value of the Accept header.
+    :type header: str
+    :return: Media types with their quality, media types of equal quality keep their order.
+    :rtype: List[Tuple[str, float]]
+    """
+    return sorted(quality_values(header), key=lambda accept: -accept[1])
+
+
+def tabular_rows(content) -> Optional[Tuple[list, dict]]:
+    """Rows and metadata of json content that fits a table, None for other content.
+    Pages of get all become their items, with the paging fields as metadata.
+    """
+    if isinstance(content, dict) and isinstance(content.get("items"), list):
+        metadata = {key: value for key, value in content.items() if key != "items"}
+        content = content["items"]
+    else:
+        metadata = {}
+    if isinstance(content, dict):
+        content = [content]
+    if isinstance(content, list) and all(isinstance(row, dict) for row in content):
+        return content, metadata
+    return None
+
+
+def encode_msgpack(content) -> bytes:
+    """Encodes json content as MessagePack."""
+    return msgpack.packb(content, use_bin_type=True)
+
+
+def encode_arrow(content) -> Optional[bytes]:
+    """Encodes the rows of json content as an Arrow IPC stream, None for other content."""
+    tabular = tabular_rows(content)
+    if tabular is None:
+        return None
+    rows, metadata = tabular
+    table = pyarrow.Table.from_pylist(rows)
+    if metadata:
+        table = table.replace_schema_metadata(
+            {key: str(value) for key, value in metadata.items()}
+        )
+    sink = io.BytesIO()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+# format name: media types, encoder and whether the library of the encoder is installed
+FORMATS: Dict[str, Tuple[Tuple[str, ...], Callable, bool]] = {
+    "msgpack": ((MSGPACK, "application/x-msgpack"), encode_msgpack, bool(msgpack)),
+    "arrow": ((ARROW,), encode_arrow, bool(pyarrow)),
+}
+
+
+class NegotiatedResponse(JSONResponse):
+    """Response rendering its content in the format negotiated for the current request.
+    Content the negotiated format cannot represent is rendered as json.
+    """
+
+    def render(self, content) -> bytes:
+        negotiated = current_format.get()
+        if negotiated is not None:
+            media_type, encoder = negotiated
+            body = encoder(content)
+            if body is not None:
+                self.media_type = media_type
+                return body
+        return super().render(content)
+
+
+class ContentNegotiation:
+    # pylint: disable=C0301
+    """Negotiates the format of the responses of the generated endpoints.
+    Formats whose library is not installed are left out.
+    Requests accepting none of the formats are rejected with a http 406 error.
+
+    :param formats: Formats offered next to json, msgpack and arrow, defaults to None
+    :type formats: Optional[Sequence[str]], optional
+
+
+    >>> negotiation = ContentNegotiation(["msgpack", "arrow"])
+    >>> response = client.get("/test_table/", headers={"Accept": "application/msgpack"})
+    """
+    # pylint: enable=C0301
+
+    response_class = NegotiatedResponse
+
+    def __init__(self, formats: Optional[Sequence[str]] = None) -> None:
+        unknown = set(formats or ()) - set(FORMATS)
+        if unknown:
+            raise ValueError(f"Unknown formats {sorted(unknown)}, use msgpack or arrow")
+        self.media_types: Dict[str, Optional[Tuple[str, Callable]]] = {JSON: None}
+        for name in formats or ():
+            media_types, encoder, available = FORMATS[name]
+            if available:
+                for media_type in media_types:
+                    self.media_types[media_type] = (media_types[0], encoder)
+
+    def choose(self, accept: str) -> Tuple[bool, Optional[Tuple[str, Callable]]]:
+        """Chooses the format of a response.
+
+        :param accept: Value of the Accept header.
+        :type accept: str
+        :return: Whether a format is acceptable and the media type and encoder, None for json.
+        :rtype: Tuple[bool, Optional[Tuple[str, Callable]]]
+        """
+        if not accept:
+            return True, None
+        for media_type, quality in parse_accept(accept):
+            if quality <= 0:
+                continue
+            if media_type in self.media_types:
+                return True, self.media_types[media_type]
+            if media_type in ("*/*", "application/*"):
+                return True, None
+        return False, None
+
+    def route_hook(self, route: APIRoute, handler: Handler) -> Handler:
+        # pylint: disable=C0301
+        """Route hook rendering the response of a route in the negotiated format.
+        Routes with a response class of their own, like the streaming export route, are left as they are.
+
+        :param route: Route to wrap.
+        :type route: APIRoute
+        :param handler: Request handler of the route.
+        :type handler: Handler
+        :return: Request handler negotiating the format of its response, the handler itself for routes not using NegotiatedResponse.
+        :rtype: Handler
+        """
+        # pylint: enable=C0301
+        response_class = route.response_class
+        if isinstance(response_class, DefaultPlaceholder):
+            response_class = response_class.value
+        if not issubclass(response_class, NegotiatedResponse):
+            return handler
+
+        async def negotiated_handler(request: Request) -> Response:
+            acceptable, negotiated = self.choose(request.headers.get("accept", ""))
+            if not acceptable:
+                return JSONResponse(
+                    {"detail": f"Acceptable formats are {', '.join(self.media_types)}"},
+                    status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                )
+            token = current_format.set(negotiated)
+            try:
+                response = await handler(request)
+            finally:
+                current_format.reset(token)
+            response.headers.add_vary_header("Accept")
+            return response
+
+        return negotiated_handler
@@ -0,0 +1,325 @@
+"""Module containing the cached openapi document of the app.
+Building the openapi document walks every route and schema of the app,
+which takes seconds for large databases.
+The document is built once, or loaded from disk by the fingerprint of the routes and schemas,
+and served as pre serialized and compressed bytes with an ETag.
+Partial documents per tag (table) let the docs load a single table.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Callable, Dict, Optional
+from urllib.parse import quote
+
+import fastapi
+from fastapi import FastAPI, HTTPException, Request, Response, status
+from fastapi.openapi.docs import get_redoc_html, get_swagger_ui_html
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+REF_PREFIX = "#/components/schemas/"
+
+
+class CachedDocument:
+    """Serialized openapi document with its compressed body and ETag.
+
+    :param document: The openapi document.
+    :type document: dict
+    """
+
+    def __init__(self, document: dict) -> None:
+        self.document = document
+        self.body = json.dumps(document, separators=(",", ":")).encode()
+        self.gzip_body = gzip.compress(self.body, compresslevel=9)
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+
+    def response(self, request: Request) -> Response:
+        """Response serving the document, compressed if the client accepts gzip.
+
+        :param request: Request for the document.
+        :type request: Request
+        :return: Response with the document, or not modified if the client has it.
+        :rtype: Response
+        """
+        headers = {
+            "ETag": self.etag,
+            "Vary": "Accept-Encoding",
+            "Cache-Control": "no-cache",
+        }
+        if request.headers.get("if-none-match") == self.etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        body = self.body
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            body = self.gzip_body
+            headers["Content-Encoding"] = "gzip"
+        return Response(body, media_type="application/json", headers=headers)
+
+
+def model_signature(model, seen: set) -> list:
+    """Describes the fields of a pydantic model and the models it contains."""
+    if model in seen:
+        return [model.__name__]
+    seen.add(model)
+    signature = [model.__name__]
+    for name, field in model.__fields__.items():
+        signature.append((name, repr(field.outer_type_), field.required))
+        if isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+            signature.append(model_signature(field.type_, seen))
+    return signature
+
+
+def schema_fingerprint(app: FastAPI) -> str:
+    # pylint: disable=C0301
+    """Fingerprint of the routes and schemas of an app, changing whenever its openapi document would change.
+    Only reads the fields of the pydantic models, so it is cheap compared to building the document.
+
+    :param app: FastAPI app.
+    :type app: FastAPI
+    :return: Hex digest of the routes and schemas.
+    :rtype: str
+    """
+    # pylint: enable=C0301
+    seen: set = set()
+    routes = []
+    for route in app.routes:
+        if not isinstance(route, APIRoute) or not route.include_in_schema:
+            continue
+        description = [route.path, sorted(route.methods), route.name, route.tags]
+        for field in (route.body_field, route.response_field):
+            if field is not None and isinstance(field.type_, type):
+                if issubclass(field.type_, BaseModel):
+                    description.append(model_signature(field.type_, seen))
+                description.append(repr(field.outer_type_))
+        description.append([param.name for param in route.dependant.query_params])
+        routes.append(description)
+    fingerprint = [fastapi.__version__, app.title, app.version, routes]
+    return hashlib.sha256(json.dumps(fingerprint, default=str).encode()).hexdigest()
+
+
+def models_fingerprint(models, configs: dict) -> str:
+    # pylint: disable=C0301
+    """Fingerprint of the reflected tables and the configuration, for apps creating their routes lazily.
+    The routes of a lazy app only exist once requested, so they cannot be fingerprinted before building the document.
+
+    :param models: Models object containing all SQLalchemy models for the API.
+    :type models: Models
+    :param configs: Dictionary containing the configuration for the routers.
+    :type configs: dict
+    :return: Hex digest of the tables and configuration.
+    :rtype: str
+    """
+    # pylint: enable=C0301
+    tables = []
+    for name in sorted(models.table_names):
+        table = getattr(models, name).__table__
+        columns = [
+            (column.name, str(column.type), column.primary_key, column.nullable)
+            for column in table.columns
+        ]
+        tables.append([name, name in models.view_names, columns])
+    fingerprint = [fastapi.__version__, tables, configs]
+    return hashlib.sha256(json.dumps(fingerprint, default=str).encode()).hexdigest()
+
+
+def referenced_schemas(value, schemas: dict, found: set) -> set:
+    """Collects the names of the component schemas referenced by a part of the document."""
+    if isinstance(value, dict):
+        ref = value.get("$ref")
+        if isinstance(ref, str) and ref.startswith(REF_PREFIX):
+            name = ref[len(REF_PREFIX) :]
+            if name not in found:
+                found.add(name)
+                referenced_schemas(schemas.get(name, {}), schemas, found)
+        for item in value.values():
+            referenced_schemas(item, schemas, found)
+    elif isinstance(value, list):
+        for item in value:
+            referenced_schemas(item, schemas, found)
+    return found
+
+
+def tag_document(document: dict, tag: str) -> Optional[dict]:
+    # pylint: disable=C0301
+    """Partial openapi document with the operations of a single tag.
+
+    :param document: The complete openapi document.
+    :type document: dict
+    :param tag: Tag of the operations to keep.
+    :type tag: str
+    :return: Document with the operations of the tag and the schemas they reference, None for unknown tags.
+    :rtype: Optional[dict]
+    """
+    # pylint: enable=C0301
+    paths = {}
+    for path, operations in document.get("paths", {}).items():
+        tagged = {
+            method: operation
+            for method, operation in operations.items()
+            if tag in operation.get("tags", ())
+        }
+        if tagged:
+            paths[path] = tagged
+    if not paths:
+        return None
+    components = dict(document.get("components", {}))
+    schemas = components.get("schemas", {})
+    names = referenced_schemas(paths, schemas, set())
+    components["schemas"] = {
+        name: schemas[name] for name in sorted(names) if name in schemas
+    }
+    return {**document, "paths": paths, "components": components}
+
+
+class OpenApiCache:
+    # pylint: disable=C0301
+    """Builds the openapi document of an app once and serves it from memory.
+
+    :param app: FastAPI app to document.
+    :type app: FastAPI
+    :param directory: Directory to store and load documents by fingerprint, defaults to None
+    :type directory: Optional[str], optional
+    :param fingerprint: Function returning the fingerprint of the app, defaults to schema_fingerprint
+    :type fingerprint: Optional[Callable[[], str]], optional
+    :param prepare: Function called before building the document, for example to create lazy routes, defaults to None
+    :type prepare: Optional[Callable[[], None]], optional
+
+
+    >>> app = FastAPI(openapi_url=None, docs_url=None, redoc_url=None)
+    >>> cache = OpenApiCache(app, directory="openapi")
+    >>> cache.install()
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        app: FastAPI,
+        directory: Optional[str] = None,
+        fingerprint: Optional[Callable[[], str]] = None,
+        prepare: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.app = app
+        self.directory = directory
+        self.fingerprint = fingerprint or (lambda: schema_fingerprint(app))
+        self.prepare = prepare
+        self.cached: Optional[CachedDocument] = None
+        self.tags: Dict[str, Optional[CachedDocument]] = {}
+        self.lock = threading.Lock()
+
+    def path(self, fingerprint: str) -> str:
+        """Path of the stored document of a fingerprint."""
+        return os.path.join(self.directory, f"openapi-{fingerprint}.json")
+
+    def load(self, fingerprint: str) -> Optional[dict]:
+        """Loads the stored document of a fingerprint, None if it is not stored."""
+        try:
+            with open(self.path(fingerprint), encoding="utf8") as document_file:
+                return json.load(document_file)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, fingerprint: str, document: CachedDocument) -> None:
+        """Stores a document, written to a temporary file first.
+        Readers never see partial documents.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as document_file:
+            document_file.write(document.body)
+        os.replace(temporary, self.path(fingerprint))
+
+    def build(self) -> CachedDocument:
+        """Returns the cached document, building or loading it on first use.
+
+        :return: The cached openapi document.
+        :rtype: CachedDocument
+        """
+        if self.cached:
+            return self.cached
+        with self.lock:
+            if self.cached:
+                return self.cached
+            fingerprint = self.fingerprint() if self.directory else None
+            document = self.load(fingerprint) if fingerprint else None
+            if document is None:
+                if self.prepare:
+                    self.prepare()
+                document = FastAPI.openapi(self.app)
+                cached = CachedDocument(document)
+                if fingerprint:
+                    self.store(fingerprint, cached)
+            else:
+                cached = CachedDocument(document)
+            self.app.openapi_schema = document
+            self.cached = cached
+        return self.cached
+
+    def openapi(self) -> dict:
+        """Replacement of app.openapi returning the cached document."""
+        return self.build().document
+
+    def tag(self, tag: str) -> Optional[CachedDocument]:
+        """Returns the cached partial document of a tag, None for unknown tags."""
+        if tag not in self.tags:
+            partial = tag_document(self.build().document, tag)
+            if partial is None:
+                return None
+            self.tags[tag] = CachedDocument(partial)
+        return self.tags[tag]
+
+    def tag_url(self, partial_url: str, tag: str) -> str:
+        """Url of the partial document of a known tag, http 404 error for unknown tags."""
+        if self.tag(tag) is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Unknown tag"
+            )
+        return partial_url.format(tag=quote(tag, safe=""))
+
+    def install(
+        self,
+        openapi_url: str = "/openapi.json",
+        docs_url: str = "/docs",
+        redoc_url: str = "/redoc",
+    ) -> None:
+        # pylint: disable=C0301
+        """Adds the routes serving the document, the partial documents and the docs to the app.
+        The app should be created without openapi_url, docs_url and redoc_url.
+        The routes are sync, so building the document runs in the threadpool instead of the event loop.
+
+        :param openapi_url: Path of the document, defaults to "/openapi.json"
+        :type openapi_url: str, optional
+        :param docs_url: Path of the swagger docs, ?tag=<table> shows a single table, defaults to "/docs"
+        :type docs_url: str, optional
+        :param redoc_url: Path of the redoc docs, defaults to "/redoc"
+        :type redoc_url: str, optional
+        """
+        # pylint: enable=C0301
+        self.app.openapi = self.openapi
+        partial_url = openapi_url.rsplit(".json", 1)[0] + "/{tag}.json"
+        title = self.app.title
+
+        def openapi_document(request: Request) -> Response:
+            return self.build().response(request)
+
+        def openapi_tag(request: Request, tag: str) -> Response:
+            document = self.tag(tag)
+            if document is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown tag {tag}"
+                )
+            return document.response(request)
+
+        def swagger_docs(tag: Optional[str] = None):
+            url = self.tag_url(partial_url, tag) if tag else openapi_url
+            return get_swagger_ui_html(openapi_url=url, title=f"{title} - Swagger UI")
+
+        def redoc_docs(tag: Optional[str] = None):
+            url = self.tag_url(partial_url, tag) if tag else openapi_url
+            return get_redoc_html(openapi_url=url, title=f"{title} - ReDoc")
+
+        self.app.add_api_route(openapi_url, openapi_document, include_in_schema=False)
+        self.app.add_api_route(partial_url, openapi_tag, include_in_schema=False)
+        self.app.add_api_route(docs_url, swagger_docs, include_in_schema=False)
+        self.app.add_api_route(redoc_url, redoc_docs, include_in_schema=False)
@@ -0,0 +1,358 @@
+"""Module containing on demand profiling of single requests.
+Requests are profiled when they carry a signed profiling header or are sampled (1 in N requests).
+A sampling profiler records the call stacks of the event loop
+and of the threads running the endpoint.
+Profiles are returned in place of the response or saved to a bounded directory,
+as speedscope files or collapsed stacks.
+"""
+import asyncio
+import contextvars
+import functools
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+PROFILE_HEADER = "x-apifactory-profile"
+FORMATS = {"speedscope": "speedscope.json", "collapsed": "collapsed.txt"}
+
+Frame = Tuple[str, str, int]
+
+current_profile: contextvars.ContextVar = contextvars.ContextVar(
+    "apifactory_profile", default=None
+)
+
+
+class SampledProfile:
+    """Samples the call stacks of the threads working on a single request.
+
+    :param name: Name of the profile, for example the method and path of the request.
+    :type name: str
+    :param interval: Seconds between samples, defaults to 0.001
+    :type interval: float, optional
+    """
+
+    def __init__(self, name: str, interval: float = 0.001) -> None:
+        self.name = name
+        self.interval = interval
+        self.threads: Counter = Counter()
+        self.samples: Counter = Counter()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(
+            target=self.run, name="apifactory-profiler", daemon=True
+        )
+        self.duration = 0.0
+
+    @contextmanager
+    def thread(self):
+        """Samples the current thread while the context is active."""
+        ident = threading.get_ident()
+        self.threads[ident] += 1
+        try:
+            yield
+        finally:
+            self.threads[ident] -= 1
+            if not self.threads[ident]:
+                del self.threads[ident]
+
+    @staticmethod
+    def stack(frame) -> Tuple[Frame, ...]:
+        """Returns the call stack of a frame, outermost call first."""
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def run(self) -> None:
+        """Target of the sampler thread."""
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()  # pylint: disable=W0212
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.samples[self.stack(frame)] += 1
+
+    def start(self) -> None:
+        """Starts sampling."""
+        self.duration = time.perf_counter()
+        self.sampler.start()
+
+    def stop(self) -> None:
+        """Stops sampling."""
+        self.stopped.set()
+        self.sampler.join()
+        self.duration = time.perf_counter() - self.duration
+
+    def collapsed(self) -> str:
+        """The samples as collapsed stacks, one line per stack followed by its amount of samples."""
+        lines = [
+            ";".join(f"{name} ({filename}:{line})" for name, filename, line in stack)
+            + f" {count}"
+            for stack, count in self.samples.most_common()
+        ]
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self) -> str:
+        """The samples in the speedscope file format."""
+        frames: dict = {}
+        samples = []
+        weights = []
+        for stack, count in self.samples.most_common():
+            samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+            weights.append(count * self.interval)
+        profile = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "apifactory",
+            "shared": {
+                "frames": [
+                    {"name": name, "file": filename, "line": line}
+                    for name, filename, line in frames
+                ]
+            },
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": self.name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+        }
+        return json.dumps(profile)
+
+    def render(self, profile_format: str) -> str:
+        """Renders the profile as speedscope or collapsed stacks."""
+        if profile_format == "collapsed":
+            return self.collapsed()
+        return self.speedscope()
+
+
+class Profiler:
+    # pylint: disable=C0301
+    """Decides which requests to profile and stores their profiles.
+    Requests carrying a valid, unexpired signature in the X-Apifactory-Profile header return their profile instead of the response.
+    Sampled requests are answered normally and their profile is saved to the directory.
+
+    :param secret: Key used to sign the profiling header, defaults to None
+    :type secret: Optional[str], optional
+    :param sample: Profile 1 in sample requests, defaults to None
+    :type sample: Optional[int], optional
+    :param directory: Directory to save sampled profiles to, defaults to None
+    :type directory: Optional[str], optional
+    :param max_profiles: Maximum amount of profiles kept in the directory, defaults to 50
+    :type max_profiles: int, optional
+    :param format: speedscope or collapsed, defaults to "speedscope"
+    :type format: str, optional
+    :param interval: Seconds between samples, defaults to 0.001
+    :type interval: float, optional
+    :param max_age: Seconds the signatures created by signature are valid, defaults to 300
+    :type max_age: float, optional
+
+
+    >>> profiler = Profiler(secret="key")
+    >>> headers = {"X-Apifactory-Profile": profiler.signature("GET", "/test_table/1")}
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        secret: Optional[str] = None,
+        sample: Optional[int] = None,
+        directory: Optional[str] = None,
+        max_profiles: int = 50,
+        format: str = "speedscope",  # pylint: disable=W0622
+        interval: float = 0.001,
+        max_age: float = 300,
+    ) -> None:
+        if format not in FORMATS:
+            raise ValueError(
+                f"Unknown profile format {format}, use speedscope or collapsed"
+            )
+        if sample and not directory:
+            raise ValueError("Sampled profiles require a directory to save them to")
+        self.secret = secret.encode() if secret else None
+        self.sample = sample
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.format = format
+        self.interval = interval
+        self.max_age = max_age
+        self.requests = itertools.count(1)
+
+    def signature(self, method: str, path: str, expires: Optional[int] = None) -> str:
+        # pylint: disable=C0301
+        """Signature of the profiling header for a request.
+
+        :param method: Http method of the request.
+        :type method: str
+        :param path: Path of the request.
+        :type path: str
+        :param expires: Unix time the signature expires at, defaults to None, max_age seconds from now
+        :type expires: Optional[int], optional
+        :return: The expiry and the hex digest of the method, path and expiry, separated by a colon, to send in the X-Apifactory-Profile header.
+        :rtype: str
+        """
+        # pylint: enable=C0301
+        if expires is None:
+            expires = int(time.time() + self.max_age)
+        message = f"{method.upper()} {path} {expires}".encode()
+        digest = hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+        return f"{expires}:{digest}"
+
+    def verify(self, method: str, path: str, value: str) -> bool:
+        """Whether the value of a profiling header is a valid signature that has not expired."""
+        expires, _, _ = value.partition(":")
+        if not expires.isdigit() or int(expires) < time.time():
+            return False
+        return hmac.compare_digest(value, self.signature(method, path, int(expires)))
+
+    def trigger(self, scope: dict) -> Optional[str]:
+        """Returns inline for signed requests, sampled for sampled requests and None otherwise."""
+        if self.secret:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER.encode() and self.verify(
+                    scope["method"], scope["path"], value.decode("latin-1")
+                ):
+                    return "inline"
+        if self.sample and next(self.requests) % self.sample == 0:
+            return "sampled"
+        return None
+
+    def save(self, profile: SampledProfile) -> str:
+        """Saves a profile to the directory, removing the oldest profiles beyond max_profiles.
+
+        :param profile: Profile to save.
+        :type profile: SampledProfile
+        :return: Path of the saved profile.
+        :rtype: str
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        extension = FORMATS[self.format]
+        path = os.path.join(self.directory, f"profile-{time.time_ns()}.{extension}")
+        with open(path, "w", encoding="utf8") as profile_file:
+            profile_file.write(profile.render(self.format))
+        profiles = sorted(
+            entry.path
+            for entry in os.scandir(self.directory)
+            if entry.name.startswith("profile-")
+        )
+        for old_profile in profiles[: -self.max_profiles]:
+            os.remove(old_profile)
+        return path
+
+    def wrap(self, func: Callable) -> Callable:
+        # pylint: disable=C0301
+        """Wraps a synchronous endpoint function so the thread running it is sampled for profiled requests.
+
+        :param func: Endpoint function.
+        :type func: Callable
+        :return: Endpoint function with the same signature.
+        :rtype: Callable
+        """
+        # pylint: enable=C0301
+        if asyncio.iscoroutinefunction(func):
+            return func
+
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            profile = current_profile.get()
+            if profile is None:
+                return func(*args, **kwargs)
+            with profile.thread():
+                return func(*args, **kwargs)
+
+        return profiled
+
+    def method(self, method: Callable) -> Callable:
+        """Wraps a router method so the endpoints it registers can be profiled.
+
+        :param method: FastAPI Router method, for example router.get.
+        :type method: Callable
+        :return: Router method with the same interface.
+        :rtype: Callable
+        """
+
+        def route_method(*args, **kwargs):
+            decorator = method(*args, **kwargs)
+
+            def register(func: Callable) -> Callable:
+                return decorator(self.wrap(func))
+
+            return register
+
+        return route_method
+
+
+class ProfilingMiddleware:
+    # pylint: disable=C0301
+    """ASGI middleware profiling the requests selected by the profiler.
+    Requests that are not profiled are passed on directly.
+
+    :param app: ASGI application.
+    :param profiler: Profiler deciding which requests to profile.
+    :type profiler: Profiler
+
+
+    >>> app.add_middleware(ProfilingMiddleware, profiler=Profiler(secret="key"))
+    """
+    # pylint: enable=C0301
+
+    def __init__(self, app, profiler: Profiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send) -> None:
+        mode = self.profiler.trigger(scope) if scope["type"] == "http" else None
+        if not mode:
+            await self.app(scope, receive, send)
+            return
+        profile = SampledProfile(
+            f"{scope['method']} {scope['path']}", self.profiler.interval
+        )
+        token = current_profile.set(profile)
+
+        async def discard(message):  # pylint: disable=W0613
+            # the response of the request is replaced by its profile
+            return
+
+        app_send = discard if mode == "inline" else send
+        profile.start()
+        try:
+            with profile.thread():
+                await self.app(scope, receive, app_send)
+        finally:
+            profile.stop()
+            current_profile.reset(token)
+        if mode == "sampled":
+            await run_in_threadpool(self.profiler.save, profile)
+            return
+        content_type = (
+            "text/plain" if self.profiler.format == "collapsed" else "application/json"
+        )
+        body = profile.render(self.profiler.format).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", content_type.encode()),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
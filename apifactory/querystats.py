@@ -0,0 +1,230 @@
+"""Module containing the instrumentation of the SQL statements issued per request.
+Counts the statements and the time spent in the database for every request of a generated route,
+reports them in a Server-Timing header and enforces a query budget per table and method.
+"""
+# the signatures of the listeners and exception handlers are given by sqlalchemy and starlette
+# pylint: disable=W0613
+import contextvars
+import json
+import logging
+import time
+from collections import Counter
+from typing import Iterable, Optional
+
+from fastapi import Request, Response, status
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from apifactory.routing import CONFIG_METHODS, Handler
+from apifactory.utils import config_for_method
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_START_KEY = "apifactory_statement_start"
+
+
+class QueryBudgetExceeded(Exception):
+    """Exception raised when a request issues more statements than its query budget."""
+
+
+class QueryStats:
+    """Statements issued by a single request.
+
+    :param budget: Maximum amount of statements of the request, None for no budget.
+    :type budget: Optional[int]
+    :param fail: Whether exceeding the budget fails the request, defaults to False
+    :type fail: bool, optional
+    """
+
+    def __init__(self, budget: Optional[int] = None, fail: bool = False) -> None:
+        self.budget = budget
+        self.fail = fail
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter = Counter()
+
+    @property
+    def over_budget(self) -> bool:
+        """Whether the request issued more statements than its budget."""
+        return self.budget is not None and self.count > self.budget
+
+    def most_repeated(self):
+        """Returns the most repeated statement and how often it was issued."""
+        if not self.statements:
+            return None, 0
+        return self.statements.most_common(1)[0]
+
+
+current_stats: contextvars.ContextVar = contextvars.ContextVar(
+    "apifactory_query_stats", default=None
+)
+
+
+def statement_start(conn, cursor, statement, parameters, context, executemany):
+    """Engine before_cursor_execute listener, counting the statement of the request."""
+    stats = current_stats.get()
+    if stats is None:
+        return
+    stats.count += 1
+    stats.statements[statement] += 1
+    if stats.fail and stats.over_budget:
+        cursor.close()
+        raise QueryBudgetExceeded(
+            f"Request exceeded its query budget of {stats.budget} statements"
+        )
+    conn.info[STATEMENT_START_KEY] = time.perf_counter()
+
+
+def statement_end(conn, cursor, statement, parameters, context, executemany):
+    """Engine after_cursor_execute listener, adding the time spent on the statement."""
+    started = conn.info.pop(STATEMENT_START_KEY, None)
+    stats = current_stats.get()
+    if stats is not None and started is not None:
+        stats.duration += time.perf_counter() - started
+
+
+class QueryInstrumentation:
+    # pylint: disable=C0301
+    """Records the statements issued per request of the generated routes.
+    The query budget is read from the router configuration of a table with the query_budget key,
+    either a single amount of statements or a dictionary with budgets per method.
+
+    :param engines: Engines to install the statement listeners on.
+    :type engines: Iterable[Engine]
+    :param configs: Dictionary containing the configuration for the routers.
+    :type configs: dict
+    :param budget: Query budget for tables without a budget of their own, defaults to None
+    :type budget: Optional[int], optional
+    :param action: warn to log requests exceeding their budget, error to fail them, defaults to "warn"
+    :type action: str, optional
+    :param slow_request: Requests taking longer than this amount of seconds are logged, defaults to None
+    :type slow_request: Optional[float], optional
+    :param repeated: Requests issuing the same statement this many times are logged as a possible N+1, defaults to 10
+    :type repeated: Optional[int], optional
+
+
+    >>> instrumentation = QueryInstrumentation(db.all_engines(), config, budget=20, action="error")
+    >>> routers = Routers(..., route_hooks=[instrumentation.route_hook])
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        engines: Iterable[Engine],
+        configs: dict,
+        budget: Optional[int] = None,
+        action: str = "warn",
+        slow_request: Optional[float] = None,
+        repeated: Optional[int] = 10,
+    ) -> None:
+        if action not in ("warn", "error"):
+            raise ValueError(f"Unknown query budget action {action}, use warn or error")
+        self.configs = configs
+        self.budget = budget
+        self.fail = action == "error"
+        self.slow_request = slow_request
+        self.repeated = repeated
+        for engine in engines:
+            self.install(engine)
+
+    @staticmethod
+    def install(engine: Engine) -> None:
+        """Installs the statement listeners on an engine.
+
+        :param engine: Engine to install the listeners on.
+        :type engine: Engine
+        """
+        listeners = (
+            ("before_cursor_execute", statement_start),
+            ("after_cursor_execute", statement_end),
+        )
+        for name, listener in listeners:
+            if not event.contains(engine, name, listener):
+                event.listen(engine, name, listener)
+
+    def route_budget(self, route: APIRoute) -> Optional[int]:
+        """Returns the query budget of a route."""
+        table = route.tags[0] if route.tags else None
+        method = CONFIG_METHODS.get(route.name)
+        if table is None or method is None:
+            return self.budget
+        return config_for_method(
+            self.configs.get(table, {}), "query_budget", method, self.budget
+        )
+
+    def report(self, request: Request, route: APIRoute, stats: QueryStats, **fields):
+        """Logs requests that are slow, exceed their budget or repeat a statement."""
+        statement, repeats = stats.most_repeated()
+        problems = []
+        if stats.over_budget:
+            problems.append("query budget exceeded")
+        if self.repeated and repeats >= self.repeated:
+            problems.append("repeated statement")
+        if self.slow_request is not None and fields["duration"] >= self.slow_request:
+            problems.append("slow request")
+        if not problems:
+            return
+        record = {
+            "method": request.method,
+            "route": route.path_format,
+            "table": route.tags[0] if route.tags else None,
+            **fields,
+            "queries": stats.count,
+            "db_time": round(stats.duration, 6),
+            "budget": stats.budget,
+            "repeated_statement": statement if repeats > 1 else None,
+            "repeats": repeats,
+            "problems": problems,
+        }
+        logger.warning(json.dumps(record), extra={"apifactory": record})
+
+    def route_hook(self, route: APIRoute, handler: Handler) -> Handler:
+        """Route hook recording the statements of the requests of a route.
+
+        :param route: Route to instrument.
+        :type route: APIRoute
+        :param handler: Request handler of the route.
+        :type handler: Handler
+        :return: Request handler recording the statements of the request.
+        :rtype: Handler
+        """
+        budget = self.route_budget(route)
+
+        async def instrumented_handler(request: Request) -> Response:
+            stats = QueryStats(budget, self.fail)
+            # threadpools copy the context, so the statements of the endpoint
+            # and its dependencies are added to this object
+            token = current_stats.set(stats)
+            started = time.perf_counter()
+            status_code = 500
+            try:
+                response = await handler(request)
+                status_code = response.status_code
+                response.headers.append(
+                    "Server-Timing",
+                    f'db;dur={stats.duration * 1000:.3f};desc="{stats.count} queries"',
+                )
+                return response
+            except Exception as error:
+                status_code = getattr(error, "status_code", 500)
+                raise
+            finally:
+                current_stats.reset(token)
+                self.report(
+                    request,
+                    route,
+                    stats,
+                    status=status_code,
+                    duration=round(time.perf_counter() - started, 6),
+                )
+
+        return instrumented_handler
+
+
+async def query_budget_handler(request: Request, exc: Exception) -> JSONResponse:
+    """Exception handler returning a http 500 error for requests exceeding their budget."""
+    return JSONResponse(
+        {"detail": str(exc)}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
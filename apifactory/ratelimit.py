@@ -0,0 +1,177 @@
+"""Module containing the per route rate limiter.
+The global ratelimit of ApiFactory is handled by slowapi and applies one limit to every route.
+RouteLimiter adds limits configured per table and per method in the router configuration,
+charging bulk requests by the amount of rows they contain.
+"""
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from fastapi import Depends, HTTPException, Request, status
+from limits import parse_many
+from limits.storage import storage_from_string
+from limits.strategies import MovingWindowRateLimiter
+from slowapi.util import get_remote_address
+
+
+class RouteLimiter:
+    # pylint: disable=C0301
+    """Rate limiter for the routes generated by Routers.
+    Limits are read from the router configuration of a table with the ratelimit key.
+    Either a single limit for all methods of the table or a dictionary of limits per method.
+
+    :param key_funcs: Dictionary containing the functions that derive the rate limit key from a request, defaults to keying by remote address only
+    :type key_funcs: Optional[Dict[str, Callable]], optional
+    :param default_key: Name of the key function to use if a table does not specify a ratelimit_key, defaults to "ip"
+    :type default_key: str, optional
+    :param storage_uri: Storage uri supported by the limits package, defaults to "memory://"
+    :type storage_uri: str, optional
+
+    Methods that can be configured are get, get_id, post, put and delete.
+    The default entry applies to all methods of the table that have no limit of their own.
+    Bulk requests (post with a list, put and delete of multiple entries) are charged by the amount of rows.
+
+
+    >>> config = {
+    ...    "test_table": {
+    ...        "ratelimit": {"default": "100/minute", "post": "1000/hour"},
+    ...        "ratelimit_key": "user",
+    ...    }
+    ... }
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        key_funcs: Optional[Dict[str, Callable]] = None,
+        default_key: str = "ip",
+        storage_uri: str = "memory://",
+    ) -> None:
+        if not key_funcs:
+            key_funcs = {"ip": get_remote_address}
+        self.key_funcs = key_funcs
+        self.default_key = default_key
+        self.strategy = MovingWindowRateLimiter(storage_from_string(storage_uri))
+
+    def limit(
+        self, modelconfig: dict, method: str, scope: str
+    ) -> Optional[Tuple[str, str, Callable]]:
+        # pylint: disable=C0301
+        """Looks up the configured limit for a single method of a table.
+
+        :param modelconfig: Configuration for the endpoints of the table.
+        :type modelconfig: dict
+        :param method: Name of the method (get, get_id, post, put, delete) to look up in the configuration.
+        :type method: str
+        :param scope: Name of the table, used to separate the limits of different tables.
+        :type scope: str
+        :raises ValueError: Raises ValueError for an unknown ratelimit_key.
+        :return: The limit string, the scope of the limit and the key function, None if no limit is configured.
+        :rtype: Optional[Tuple[str, str, Callable]]
+        """
+        # pylint: enable=C0301
+        ratelimit: Union[str, dict, None] = modelconfig.get("ratelimit")
+        if isinstance(ratelimit, dict):
+            if method in ratelimit:
+                limit_value = ratelimit[method]
+                scope = f"{scope}:{method}"
+            else:
+                limit_value = ratelimit.get("default")
+        else:
+            limit_value = ratelimit
+        if not limit_value:
+            return None
+        key = modelconfig.get("ratelimit_key", self.default_key)
+        if key not in self.key_funcs:
+            raise ValueError(
+                f"ratelimit_key {key} is not one of {', '.join(self.key_funcs)}"
+            )
+        return limit_value, scope, self.key_funcs[key]
+
+    def route_dependencies(
+        self, modelconfig: dict, method: str, scope: str, weighted: bool = False
+    ) -> List:
+        # pylint: disable=C0301
+        """Creates the route dependencies enforcing the configured limit for a single method of a table.
+
+        :param modelconfig: Configuration for the endpoints of the table.
+        :type modelconfig: dict
+        :param method: Name of the method (get, get_id, post, put, delete) to look up in the configuration.
+        :type method: str
+        :param scope: Name of the table, used to separate the limits of different tables.
+        :type scope: str
+        :param weighted: Whether requests are charged by the amount of rows in the request body, defaults to False
+        :type weighted: bool, optional
+        :return: List with the rate limit dependency or an empty list if no limit is configured.
+        :rtype: List
+        """
+        # pylint: enable=C0301
+        limit = self.limit(modelconfig, method, scope)
+        if not limit:
+            return []
+        return [Depends(self.dependency(*limit, weighted))]
+
+    def charge(
+        self,
+        request: Request,
+        items: list,
+        scope: str,
+        key_func: Callable,
+        cost: int = 1,
+    ) -> None:
+        # pylint: disable=C0301
+        """Charges a request against a limit.
+
+        :param request: The request to charge.
+        :type request: Request
+        :param items: Limits parsed from a limit string with limits.parse_many.
+        :type items: list
+        :param scope: Scope of the limit, requests in different scopes do not share their budget.
+        :type scope: str
+        :param key_func: Function deriving the rate limit key from the request.
+        :type key_func: Callable
+        :param cost: Amount of hits to charge, defaults to 1
+        :type cost: int, optional
+        :raises HTTPException: Raises http 429 error when the limit is exceeded.
+        """
+        # pylint: enable=C0301
+        key = key_func(request)
+        for item in items:
+            if not self.strategy.hit(item, scope, key, cost=cost):
+                reset, _ = self.strategy.get_window_stats(item, scope, key)
+                retry_after = max(int(reset - time.time()), 1)
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail=f"Rate limit exceeded: {item}",
+                    headers={"Retry-After": str(retry_after)},
+                )
+
+    def dependency(
+        self, limit_value: str, scope: str, key_func: Callable, weighted: bool = False
+    ) -> Callable:
+        # pylint: disable=C0301
+        """Creates a dependency that raises a http 429 error when the limit is exceeded.
+
+        :param limit_value: Limit string, multiple limits can be seperated by ; for example 10/minute;100/day.
+        :type limit_value: str
+        :param scope: Scope of the limit, requests in different scopes do not share their budget.
+        :type scope: str
+        :param key_func: Function deriving the rate limit key from the request.
+        :type key_func: Callable
+        :param weighted: Whether requests are charged by the amount of rows in the request body, defaults to False
+        :type weighted: bool, optional
+        :return: Dependency function to add to a route.
+        :rtype: Callable
+        """
+        # pylint: enable=C0301
+        items = parse_many(limit_value)
+
+        async def rate_limit(request: Request):
+            cost = 1
+            if weighted:
+                # the body is parsed and cached by FastAPI before dependencies are solved
+                body = await request.json()
+                if isinstance(body, list):
+                    cost = max(len(body), 1)
+            self.charge(request, items, scope, key_func, cost)
+
+        return rate_limit
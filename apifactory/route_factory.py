@@ -2,27 +2,103 @@
 """
 # pylint: disable=E1101
 # pylint: disable=W0613
-from typing import Callable
+import functools
+import threading
+from typing import Callable, Optional, Sequence, Union
 
 from sqlalchemy import Table
 from pydantic import BaseModel
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, Request
+from fastapi.dependencies.models import Dependant
+from fastapi.dependencies.utils import get_sub_dependant, solve_dependencies
+from fastapi.exceptions import RequestValidationError
 
 from apifactory.router_methods import (
+    aggregate_creator,
+    bulk_ingest_creator,
+    changes_creator,
+    column_creator,
+    export_creator,
     get_id_creator,
     getall_creator,
+    job_creator,
     put_creator_many,
     put_creator,
     post_creator,
+    subscribe_creator,
     delete_creator,
     delete_creator_id,
 )
+from apifactory.aggregate import Aggregator
+from apifactory.changes import ChangeFeeds
+from apifactory.coalescer import WriteCoalescer
+from apifactory.deferred import ColumnReader
+from apifactory.executors import Executors
+from apifactory.expand import Expansion
+from apifactory.export import ArrowExport
+from apifactory.ingest import BulkIngest
+from apifactory.jobs import Jobs
+from apifactory.negotiation import ContentNegotiation
+from apifactory.profiling import Profiler
+from apifactory.ratelimit import RouteLimiter
+from apifactory.subscriptions import Subscriptions
+from apifactory.routing import RouteHook, body_start, hooked_route_class
+from apifactory.timeouts import StatementTimeouts
 from apifactory.utils import (
     model_with_optional_fields,
+    with_dependencies,
 )
 
 
+def post_session_getter(
+    get_write_db: Callable, get_bulk_db: Callable, executors: Optional[Executors] = None
+) -> Callable:
+    # pylint: disable=C0301
+    """Session helper of the post endpoint, using the sessions of the bulk class for posts of lists of entries.
+    Only the session helper of the class of the post is resolved, so the other class never opens a session.
+
+    :param get_write_db: Function to acquire a session of the write endpoint class.
+    :type get_write_db: Callable
+    :param get_bulk_db: Function to acquire a session of the bulk endpoint class.
+    :type get_bulk_db: Callable
+    :param executors: Threadpools per endpoint class the session helpers run on, defaults to None
+    :type executors: Optional[Executors], optional
+    :return: Function to acquire the session of the endpoint class of a post.
+    :rtype: Callable
+    """
+    # pylint: enable=C0301
+    if get_write_db is get_bulk_db:
+        return get_write_db
+    if executors:
+        get_write_db = executors.dependency("write", get_write_db)
+        get_bulk_db = executors.dependency("bulk", get_bulk_db)
+    dependants = {
+        start: Dependant(
+            dependencies=[
+                get_sub_dependant(
+                    depends=Depends(getter), dependency=getter, path="", name="db"
+                )
+            ]
+        )
+        for start, getter in ((b"[", get_bulk_db), (None, get_write_db))
+    }
+
+    async def get_post_db(request: Request):
+        # the body was read by FastAPI before the dependencies were solved
+        start = await body_start(request)
+        values, errors, _, _, _ = await solve_dependencies(
+            request=request,
+            dependant=dependants.get(start, dependants[None]),
+            dependency_overrides_provider=request.app,
+        )
+        if errors:
+            raise RequestValidationError(errors)
+        return values["db"]
+
+    return get_post_db
+
+
 class Routers:
     # pylint: disable=C0301
     """Creates and stores all routers created for the API.
@@ -40,6 +116,10 @@ class Routers:
     :type get_current_user: [Callable]
     :param user_schema: Pydantic schema describing user information.
     :type user_schema: BaseModel
+    :param lazy: Create the router of a table on its first use with materialize, defaults to False
+    :type lazy: bool, optional
+    :param router_kwargs: Further keyword arguments passed to router_creator, for example a limiter or route_hooks.
+    :type router_kwargs: dict
 
 
     Routers requires input from various other classes in apifactory.
@@ -79,17 +159,42 @@ class Routers:
     # pylint: enable=C0301
 
     def __init__(
-        self, models, schemas, configs, get_db, get_current_user, user_schema
+        self,
+        models,
+        schemas,
+        configs,
+        get_db,
+        get_current_user,
+        user_schema,
+        lazy: bool = False,
+        **router_kwargs,
     ) -> None:
 
         self.router_names: set = set()
+        self.lazy = lazy
+        self.pending: dict = {}
+        self.lock = threading.Lock()
         self.routers = self.create_routers(
-            models, schemas, configs, get_db, get_current_user, user_schema
+            models,
+            schemas,
+            configs,
+            get_db,
+            get_current_user,
+            user_schema,
+            **router_kwargs,
         )
 
     def create_routers(
-        self, models, schemas, configs, get_db, get_current_user, user_schema
+        self,
+        models,
+        schemas,
+        configs,
+        get_db,
+        get_current_user,
+        user_schema,
+        **router_kwargs,
     ):
+        # pylint: disable=C0301
         """method for building
 
         :param models: Models object containing all SQLalchemy models for the API.
@@ -104,29 +209,73 @@ class Routers:
         :type get_current_user: [Callable]
         :param user_schema: Pydantic schema describing user information.
         :type user_schema: BaseModel
+
+        Further keyword arguments (limiter, route_hooks, executors, get_db_for, timeouts, profiler, negotiation, exporter, aggregator, expansion, ingest, jobs, changes, subscriptions) are passed to router_creator.
         """
+        # pylint: enable=C0301
         for model_name in models.table_names:
             config = configs.get(model_name, {})
             config["route"] = f"/{model_name}"
-            schema = getattr(schemas, model_name)
             model = getattr(models, model_name)
             is_view = model_name in models.view_names
-            created_router = self.router_creator(
-                model, schema, config, get_db, get_current_user, user_schema, is_view
+            create_router = functools.partial(
+                self.router_creator,
+                model,
+                # pydantic schemas are created on first use in lazy mode
+                functools.partial(getattr, schemas, model_name),
+                config,
+                get_db,
+                get_current_user,
+                user_schema,
+                is_view,
+                response_schema=functools.partial(schemas.response_schema, model_name),
+                **router_kwargs,
             )
-            setattr(self, model_name, created_router)
             self.router_names.add(model_name)
+            if self.lazy:
+                self.pending[model_name] = create_router
+            else:
+                setattr(self, model_name, create_router())
         return self
 
+    def materialize(self, model_name: str) -> APIRouter:
+        """Returns the router of a table, creating it if it was not created yet.
+        Safe to call from multiple threads, the router is created once.
+
+        :param model_name: Name of the table or view.
+        :type model_name: str
+        :return: Router of the table.
+        :rtype: APIRouter
+        """
+        with self.lock:
+            if model_name in self.pending:
+                setattr(self, model_name, self.pending.pop(model_name)())
+        return getattr(self, model_name)
+
     @staticmethod
     def router_creator(
         model: Table,
-        schema: BaseModel,
+        schema: Union[BaseModel, Callable[[], BaseModel]],
         modelconfig: dict,
         get_db: Callable,
         get_current_user: Callable,
         user_schema: BaseModel,
         is_view: bool,
+        limiter: Optional[RouteLimiter] = None,
+        route_hooks: Optional[Sequence[RouteHook]] = None,
+        executors: Optional[Executors] = None,
+        get_db_for: Optional[Callable[[str], Callable]] = None,
+        timeouts: Optional[StatementTimeouts] = None,
+        profiler: Optional[Profiler] = None,
+        negotiation: Optional[ContentNegotiation] = None,
+        exporter: Optional[ArrowExport] = None,
+        aggregator: Optional[Aggregator] = None,
+        expansion: Optional[Expansion] = None,
+        ingest: Optional[BulkIngest] = None,
+        jobs: Optional[Jobs] = None,
+        changes: Optional[ChangeFeeds] = None,
+        subscriptions: Optional[Subscriptions] = None,
+        response_schema: Optional[Union[BaseModel, Callable[[], BaseModel]]] = None,
     ) -> APIRouter:
         # pylint: disable=C0301
         """Method for creating a single router instance for a specific table or view in the database.
@@ -134,8 +283,8 @@ class Routers:
 
         :param model: SQLalchemy model for the table containing endpoint data.
         :type model: Table
-        :param schema: Pydantic schema describing input/output for the endpoints..
-        :type schema: BaseModel
+        :param schema: Pydantic schema describing input/output for the endpoints, or a function returning it.
+        :type schema: Union[BaseModel, Callable[[], BaseModel]]
         :param modelconfig: Configuration for the endpoints.
         :type modelconfig: dict
         :param get_db: Function to acquire a database session.
@@ -146,87 +295,295 @@ class Routers:
         :type user_schema: BaseModel
         :param is_view: Flag indicating if the input is a view or not. Toggling which endpoints to create.
         :type is_view: bool
+        :param limiter: Rate limiter applying the limits configured in modelconfig, defaults to None
+        :type limiter: Optional[RouteLimiter], optional
+        :param route_hooks: Functions wrapping the request handler of every route, defaults to None
+        :type route_hooks: Optional[Sequence[RouteHook]], optional
+        :param executors: Threadpools per endpoint class to run the endpoints on, defaults to None
+        :type executors: Optional[Executors], optional
+        :param get_db_for: Function returning the session helper of an endpoint class, defaults to None
+        :type get_db_for: Optional[Callable[[str], Callable]], optional
+        :param timeouts: Applies the statement timeouts configured in modelconfig to the sessions, defaults to None
+        :type timeouts: Optional[StatementTimeouts], optional
+        :param profiler: Profiler sampling the threads running the endpoints of profiled requests, defaults to None
+        :type profiler: Optional[Profiler], optional
+        :param negotiation: Renders the responses in the format accepted by the client, defaults to None
+        :type negotiation: Optional[ContentNegotiation], optional
+        :param exporter: Adds an export route writing the table as Arrow IPC or Parquet, defaults to None
+        :type exporter: Optional[ArrowExport], optional
+        :param aggregator: Adds an aggregate route computing metrics per group of entries, defaults to None
+        :type aggregator: Optional[Aggregator], optional
+        :param expansion: Expands relationships in the get routes with the expand parameter, defaults to None
+        :type expansion: Optional[Expansion], optional
+        :param ingest: Adds a bulk route inserting streamed NDJSON or CSV uploads to tables, defaults to None
+        :type ingest: Optional[BulkIngest], optional
+        :param jobs: Adds job routes running posts and puts of multiple entries in the background, defaults to None
+        :type jobs: Optional[Jobs], optional
+        :param changes: Adds a changes route to the tables configuring a change feed, defaults to None
+        :type changes: Optional[ChangeFeeds], optional
+        :param subscriptions: Adds a subscribe route streaming the committed writes of the table, defaults to None
+        :type subscriptions: Optional[Subscriptions], optional
+        :param response_schema: Pydantic schema of the responses without deferred columns, or a function returning it, defaults to None, the schema
+        :type response_schema: Optional[Union[BaseModel, Callable[[], BaseModel]]], optional
         :return: Router object for the specific database table or view.
         :rtype: APIRouter
         """
         # pylint: enable=C0301
+        if not isinstance(schema, type):
+            schema = schema()
+        if response_schema is None:
+            response_schema = schema
+        elif not isinstance(response_schema, type):
+            response_schema = response_schema()
         route = f"{modelconfig['route']}"
 
-        router = APIRouter(prefix=route, tags=[model.__name__])
+        router_kwargs = {}
+        if negotiation:
+            router_kwargs["default_response_class"] = negotiation.response_class
+        router = APIRouter(
+            prefix=route,
+            tags=[model.__name__],
+            route_class=hooked_route_class(route_hooks),
+            **router_kwargs,
+        )
         router_routes = {
             "get": router.get,
             "post": router.post,
             "put": router.put,
             "delete": router.delete,
         }
+        if executors:
+            router_routes = {
+                name: executors.method(router_method)
+                for name, router_method in router_routes.items()
+            }
+        if profiler:
+            # outermost, so the thread running the endpoint function is sampled
+            router_routes = {
+                name: profiler.method(router_method)
+                for name, router_method in router_routes.items()
+            }
+        read_db, write_db, bulk_db, export_db = (
+            get_db_for(kind) if get_db_for else get_db
+            for kind in ("read", "write", "bulk", "export")
+        )
+        # the complete schema, deferred columns are left out of the responses only
         schema_opt = model_with_optional_fields(schema)
+        deferred_columns = modelconfig.get("deferred_columns", [])
+
+        def method_kwargs(method: str, kwargs_key: str, weighted: bool = False):
+            kwargs = modelconfig.get(kwargs_key, {})
+            if not limiter:
+                return kwargs
+            dependencies = limiter.route_dependencies(
+                modelconfig, method, model.__name__, weighted=weighted
+            )
+            return with_dependencies(kwargs, dependencies)
+
+        def session_getter(session_db: Callable, method: str):
+            if not timeouts:
+                return session_db
+            return timeouts.session_getter(session_db, modelconfig, method)
 
         getall_creator(
             method=router_routes["get"],
             model=model,
-            schema=schema,
-            get_db=get_db,
-            method_kwargs=modelconfig.get("get_kwargs", {}),
+            schema=response_schema,
+            get_db=session_getter(read_db, "get"),
+            method_kwargs=method_kwargs("get", "get_kwargs"),
             get_current_user=get_current_user,
             user_schema=user_schema,
+            expansion=expansion,
+            deferred_columns=deferred_columns,
         )
+        if exporter:
+            # registered before get_id, so /export is not taken for a primary key
+            export_creator(
+                method=router_routes["get"],
+                model=model,
+                exporter=exporter,
+                get_db=session_getter(export_db, "export"),
+                method_kwargs=method_kwargs("export", "export_kwargs"),
+                get_current_user=get_current_user,
+                user_schema=user_schema,
+            )
+        if aggregator:
+            # registered before get_id, so /aggregate is not taken for a primary key
+            aggregate_creator(
+                method=router_routes["get"],
+                model=model,
+                aggregator=aggregator,
+                get_db=session_getter(export_db, "aggregate"),
+                method_kwargs=method_kwargs("aggregate", "aggregate_kwargs"),
+                get_current_user=get_current_user,
+                user_schema=user_schema,
+            )
+        feed = changes.feed(model.__name__) if changes else None
+        if feed:
+            # registered before get_id, so /changes is not taken for a primary key
+            changes_creator(
+                method=router_routes["get"],
+                model=model,
+                schema=response_schema,
+                feed=feed,
+                get_db=session_getter(read_db, "changes"),
+                method_kwargs=method_kwargs("changes", "changes_kwargs"),
+                get_current_user=get_current_user,
+                user_schema=user_schema,
+            )
+        if subscriptions:
+            # registered before get_id, so /subscribe is not taken for a primary key
+            subscribe_creator(
+                method=router_routes["get"],
+                model=model,
+                subscriptions=subscriptions,
+                method_kwargs=method_kwargs("subscribe", "subscribe_kwargs"),
+                get_current_user=get_current_user,
+                user_schema=user_schema,
+            )
         get_id_creator(
             method=router_routes["get"],
             model=model,
-            schema=schema,
-            get_db=get_db,
-            method_kwargs=modelconfig.get("get_id_kwargs", {}),
+            schema=response_schema,
+            get_db=session_getter(read_db, "get_id"),
+            method_kwargs=method_kwargs("get_id", "get_id_kwargs"),
             get_current_user=get_current_user,
             user_schema=user_schema,
+            expansion=expansion,
+            deferred_columns=deferred_columns,
         )
+        if deferred_columns:
+            column_creator(
+                method=router_routes["get"],
+                model=model,
+                readers={name: ColumnReader(model, name) for name in deferred_columns},
+                get_db=session_getter(export_db, "column"),
+                method_kwargs=method_kwargs("column", "column_kwargs"),
+                get_current_user=get_current_user,
+                user_schema=user_schema,
+            )
         if is_view:
             return router
 
+        publish = (
+            functools.partial(subscriptions.publish, model.__name__)
+            if subscriptions
+            else None
+        )
+
+        if jobs:
+            # registered before put_creator, so /jobs is not taken for a primary key
+            job_creator(
+                router_routes["post"],
+                model,
+                schema_opt,
+                jobs,
+                "insert",
+                excluded_columns=modelconfig.get("excluded_columns_post", None),
+                method_kwargs=method_kwargs("post", "post_kwargs", weighted=True),
+                get_current_user=get_current_user,
+                user_schema=user_schema,
+                publish=publish,
+            )
+            job_creator(
+                router_routes["put"],
+                model,
+                schema_opt,
+                jobs,
+                "upsert",
+                excluded_columns=modelconfig.get("excluded_columns_put", None),
+                method_kwargs=method_kwargs("put", "put_kwargs", weighted=True),
+                get_current_user=get_current_user,
+                user_schema=user_schema,
+                publish=publish,
+            )
         put_creator_many(
             router_routes["put"],
             model,
             schema_opt,
             excluded_columns=modelconfig.get("excluded_columns_put", None),
-            get_db=get_db,
-            method_kwargs=modelconfig.get("put_kwargs", {}),
+            get_db=session_getter(bulk_db, "put"),
+            method_kwargs=method_kwargs("put", "put_kwargs", weighted=True),
             get_current_user=get_current_user,
             user_schema=user_schema,
+            publish=publish,
         )
         put_creator(
             router_routes["put"],
             model,
             schema_opt,
             excluded_columns=modelconfig.get("excluded_columns_put", None),
-            get_db=get_db,
-            method_kwargs=modelconfig.get("put_kwargs", {}),
+            get_db=session_getter(write_db, "put"),
+            method_kwargs=method_kwargs("put", "put_kwargs"),
             get_current_user=get_current_user,
             user_schema=user_schema,
+            publish=publish,
+        )
+        coalesce_writes = modelconfig.get("coalesce_writes")
+        coalescer = (
+            WriteCoalescer(
+                model, **(coalesce_writes if isinstance(coalesce_writes, dict) else {})
+            )
+            if coalesce_writes
+            else None
         )
         post_creator(
             router_routes["post"],
             model,
             schema_opt,
             excluded_columns=modelconfig.get("excluded_columns_post", None),
-            get_db=get_db,
-            method_kwargs=modelconfig.get("post_kwargs", {}),
+            # bulk posts run on the bulk executor, so they use the sessions of the bulk class
+            get_db=post_session_getter(
+                session_getter(write_db, "post"),
+                session_getter(bulk_db, "post"),
+                executors=executors,
+            ),
+            method_kwargs=method_kwargs("post", "post_kwargs", weighted=True),
+            coalescer=coalescer,
             get_current_user=get_current_user,
             user_schema=user_schema,
+            publish=publish,
         )
+        if ingest:
+            bulk_ingest_creator(
+                router_routes["post"],
+                model,
+                schema_opt,
+                ingest,
+                excluded_columns=modelconfig.get("excluded_columns_post", None),
+                get_db=session_getter(bulk_db, "post"),
+                # the limit of post is charged by the rows of every chunk instead of per request
+                method_kwargs=modelconfig.get("post_kwargs", {}),
+                get_current_user=get_current_user,
+                user_schema=user_schema,
+                limiter=limiter,
+                limit=(
+                    limiter.limit(modelconfig, "post", model.__name__)
+                    if limiter
+                    else None
+                ),
+                executors=executors,
+                publish=publish,
+            )
         delete_creator(
             router_routes["delete"],
             model,
-            get_db=get_db,
-            method_kwargs=modelconfig.get("delete_kwargs", {}),
+            get_db=session_getter(bulk_db, "delete"),
+            method_kwargs=method_kwargs("delete", "delete_kwargs", weighted=True),
+            feed=feed,
             get_current_user=get_current_user,
             user_schema=user_schema,
+            publish=publish,
         )
         delete_creator_id(
             router_routes["delete"],
             model,
-            get_db=get_db,
-            method_kwargs=modelconfig.get("delete_kwargs", {}),
+            get_db=session_getter(write_db, "delete"),
+            method_kwargs=method_kwargs("delete", "delete_kwargs"),
+            feed=feed,
             get_current_user=get_current_user,
             user_schema=user_schema,
+            publish=publish,
         )
 
         return router
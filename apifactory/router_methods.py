@@ -4,22 +4,41 @@
 # pylint: disable=E1101
 # pylint: disable=W0613
 # pylint: disable=C0301
-from typing import Any, Callable, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
-from fastapi import Depends, Request
-from sqlalchemy.orm import Session
-from sqlalchemy import Table
+import asyncio
+import functools
+
+from fastapi import Depends, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, defer
+from sqlalchemy import Table, select
 from pydantic import BaseModel, Field
+from limits import parse_many
 
 from fastapi_pagination import Page
 from fastapi_pagination.ext.sqlalchemy import paginate
 
+from apifactory.aggregate import Aggregator
+from apifactory.changes import ChangeFeed
+from apifactory.coalescer import WriteCoalescer
+from apifactory.deferred import ColumnReader, parse_range
+from apifactory.executors import Executors
+from apifactory.expand import Expansion
+from apifactory.export import ARROW_MEDIA_TYPE, PARQUET_MEDIA_TYPE, ArrowExport
+from apifactory.ingest import FORMATS, BulkIngest, sync_chunks
+from apifactory.jobs import OPERATIONS, Jobs
+from apifactory.ratelimit import RouteLimiter
+from apifactory.subscriptions import Subscriptions
 from apifactory.utils import (
+    column_filters,
     exclude_columns,
     not_found,
-    param_invalid,
     primary_key_checker,
     inserter,
+    upsert_entry,
 )
 
 
@@ -31,6 +50,8 @@ def getall_creator(
     get_current_user: Callable,
     user_schema: BaseModel,
     method_kwargs: dict,
+    expansion: Optional[Expansion] = None,
+    deferred_columns: Optional[List[str]] = None,
 ) -> Callable:
     """Function for creating a get endpoint that retrives all entries.
 
@@ -49,6 +70,10 @@ def getall_creator(
     :type user_schema: BaseModel
     :param method_kwargs: Key word arguments to add to the router method.
     :type method_kwargs: dict
+    :param expansion: Expands the relationships named by the expand parameter, defaults to None
+    :type expansion: Optional[Expansion], optional
+    :param deferred_columns: Columns left out of the query, read with the column route, defaults to None
+    :type deferred_columns: Optional[List[str]], optional
     :return: Endpoint function.
     :rtype: Callable
     """
@@ -56,6 +81,7 @@ def getall_creator(
     #     @app.get("/users/default", response_model=Page[UserOut])
     # @app.get("/users/limit-offset", response_model=LimitOffsetPage[UserOut])
     _, pk_column = primary_key_checker(model)
+    load_options = [defer(getattr(model, name)) for name in deferred_columns or ()]
 
     @method("/", response_model=Page[schema], **method_kwargs)
     # @method("/limit-offset", response_model=LimitOffsetPage[schema], **method_kwargs)
@@ -64,19 +90,241 @@ def getall_creator(
         db: Session = Depends(get_db),
         current_user: user_schema = Depends(get_current_user),
     ):
-        response = db.query(model)
-        for param, value in request.query_params.items():
-            if param in ("offset", "limit", "limit-offset", "page", "size"):
-                continue
-            if not hasattr(model, param):
-                param_invalid(model, param)
-            column = getattr(model, param, None)
-            response = response.filter(column == value)
+        tree = (
+            expansion.parse(model, request.query_params.get("expand"))
+            if expansion
+            else None
+        )
+        conditions = column_filters(
+            model,
+            request.query_params,
+            ("offset", "limit", "limit-offset", "page", "size")
+            + (("expand",) if expansion else ()),
+        )
+        response = db.query(model).options(*load_options).filter(*conditions)
+        if tree:
+            # the related entries of the page are loaded with a query per relationship
+            return expansion.paginate(response.order_by(pk_column), model, tree)
         return paginate(response.order_by(pk_column))
 
     return get_all
 
 
+def export_creator(
+    method: Callable,
+    model: Table,
+    exporter: ArrowExport,
+    get_db: Callable,
+    get_current_user: Callable,
+    user_schema: BaseModel,
+    method_kwargs: dict,
+) -> Callable:
+    """Creates an endpoint exporting the filtered entries of a table as Arrow IPC or Parquet.
+    Register before get_id_creator, the export path would otherwise be taken for a primary key.
+
+    :param method: FastAPI Router method to decorate the endpoint function with.
+    :type method: Callable
+    :param model: SQLalchemy model for the table containing endpoint data.
+    :type model: Table
+    :param exporter: Converts the entries to record batches and writes them.
+    :type exporter: ArrowExport
+    :param get_db: Function to acquire a database session.
+    :type get_db: Callable
+    :param get_current_user: Function to acquire and verify the current user.
+    :type get_current_user: Callable
+    :param user_schema: Pydantic schema describing user information.
+    :type user_schema: BaseModel
+    :param method_kwargs: Key word arguments to add to the router method.
+    :type method_kwargs: dict
+    :return: Endpoint function.
+    :rtype: Callable
+    """
+    _, pk_column = primary_key_checker(model)
+    table = model.__table__
+    schema = exporter.schema(table)
+    responses = {
+        200: {"content": {ARROW_MEDIA_TYPE: {}, PARQUET_MEDIA_TYPE: {}}},
+    }
+
+    @method(
+        "/export",
+        response_class=StreamingResponse,
+        responses=responses,
+        **method_kwargs,
+    )
+    def export(
+        request: Request,
+        export_format: str = Query("arrow", alias="format", regex="^(arrow|parquet)$"),
+        db: Session = Depends(get_db),
+        current_user: user_schema = Depends(get_current_user),
+    ):
+        conditions = column_filters(model, request.query_params, ("format",))
+        statement = select(table).where(*conditions).order_by(pk_column)
+        # a server side cursor, rows are fetched per batch instead of all at once
+        result = db.execute(statement.execution_options(stream_results=True))
+        if export_format == "parquet":
+            spooled, size = exporter.parquet_file(result, schema)
+            return StreamingResponse(
+                exporter.chunks(spooled),
+                media_type=PARQUET_MEDIA_TYPE,
+                headers={
+                    "Content-Length": str(size),
+                    "Content-Disposition": f'attachment; filename="{table.name}.parquet"',
+                },
+            )
+        return StreamingResponse(
+            exporter.arrow_stream(result, schema), media_type=ARROW_MEDIA_TYPE
+        )
+
+    return export
+
+
+def aggregate_creator(
+    method: Callable,
+    model: Table,
+    aggregator: Aggregator,
+    get_db: Callable,
+    get_current_user: Callable,
+    user_schema: BaseModel,
+    method_kwargs: dict,
+) -> Callable:
+    """Creates an endpoint aggregating the filtered entries of a table with a GROUP BY query.
+    Register before get_id_creator, the aggregate path would otherwise be taken for a primary key.
+
+    :param method: FastAPI Router method to decorate the endpoint function with.
+    :type method: Callable
+    :param model: SQLalchemy model for the table containing endpoint data.
+    :type model: Table
+    :param aggregator: Validates and runs the aggregations, caching their results.
+    :type aggregator: Aggregator
+    :param get_db: Function to acquire a database session.
+    :type get_db: Callable
+    :param get_current_user: Function to acquire and verify the current user.
+    :type get_current_user: Callable
+    :param user_schema: Pydantic schema describing user information.
+    :type user_schema: BaseModel
+    :param method_kwargs: Key word arguments to add to the router method.
+    :type method_kwargs: dict
+    :return: Endpoint function.
+    :rtype: Callable
+    """
+
+    @method("/aggregate", response_model=List[Dict[str, Any]], **method_kwargs)
+    def aggregate(
+        request: Request,
+        group_by: Optional[str] = Query(
+            None, description="Comma separated columns to group by"
+        ),
+        metrics: Optional[str] = Query(
+            None,
+            description="Comma separated metrics, count or count, sum, avg, min or max of a column like sum:column",
+        ),
+        db: Session = Depends(get_db),
+        current_user: user_schema = Depends(get_current_user),
+    ):
+        return aggregator.aggregate(db, model, group_by, metrics, request.query_params)
+
+    return aggregate
+
+
+def changes_creator(
+    method: Callable,
+    model: Table,
+    schema: BaseModel,
+    feed: ChangeFeed,
+    get_db: Callable,
+    get_current_user: Callable,
+    user_schema: BaseModel,
+    method_kwargs: dict,
+) -> Callable:
+    """Creates an endpoint returning the entries changed and the keys deleted since a watermark token.
+    Register before get_id_creator, the changes path would otherwise be taken for a primary key.
+
+    :param method: FastAPI Router method to decorate the endpoint function with.
+    :type method: Callable
+    :param model: SQLalchemy model for the table containing endpoint data.
+    :type model: Table
+    :param schema: Pydantic schema describing input/output for the endpoints.
+    :type schema: BaseModel
+    :param feed: Reads the changes of the table.
+    :type feed: ChangeFeed
+    :param get_db: Function to acquire a database session.
+    :type get_db: Callable
+    :param get_current_user: Function to acquire and verify the current user.
+    :type get_current_user: Callable
+    :param user_schema: Pydantic schema describing user information.
+    :type user_schema: BaseModel
+    :param method_kwargs: Key word arguments to add to the router method.
+    :type method_kwargs: dict
+    :return: Endpoint function.
+    :rtype: Callable
+    """
+
+    @method("/changes", **method_kwargs)
+    def changes(
+        since: Optional[str] = None,
+        limit: int = Query(feed.limit, ge=1),
+        db: Session = Depends(get_db),
+        current_user: user_schema = Depends(get_current_user),
+    ):
+        return feed.changes(db, schema, since, limit)
+
+    return changes
+
+
+def subscribe_creator(
+    method: Callable,
+    model: Table,
+    subscriptions: Subscriptions,
+    get_current_user: Callable,
+    user_schema: BaseModel,
+    method_kwargs: dict,
+) -> Callable:
+    """Creates an endpoint streaming the events of committed writes to the table as server-sent events.
+    Query parameters filter the events on column values, like the filters of get all.
+    Register before get_id_creator, the subscribe path would otherwise be taken for a primary key.
+
+    :param method: FastAPI Router method to decorate the endpoint function with.
+    :type method: Callable
+    :param model: SQLalchemy model for the table containing endpoint data.
+    :type model: Table
+    :param subscriptions: Broker fanning out the events to the subscribers.
+    :type subscriptions: Subscriptions
+    :param get_current_user: Function to acquire and verify the current user.
+    :type get_current_user: Callable
+    :param user_schema: Pydantic schema describing user information.
+    :type user_schema: BaseModel
+    :param method_kwargs: Key word arguments to add to the router method.
+    :type method_kwargs: dict
+    :return: Endpoint function.
+    :rtype: Callable
+    """
+    table_name = model.__name__
+    responses = {200: {"content": {"text/event-stream": {}}}}
+
+    @method(
+        "/subscribe",
+        response_class=StreamingResponse,
+        responses=responses,
+        **method_kwargs,
+    )
+    async def subscribe(
+        request: Request,
+        current_user: user_schema = Depends(get_current_user),
+    ):
+        filters = dict(request.query_params)
+        # raises http 400 for parameters that are not columns of the table
+        column_filters(model, filters)
+        subscriber = subscriptions.subscribe(table_name, filters)
+        return StreamingResponse(
+            subscriptions.stream(subscriber, request.is_disconnected),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    return subscribe
+
+
 def get_id_creator(
     method: Callable,
     model: Table,
@@ -86,6 +334,8 @@ def get_id_creator(
     user_schema: BaseModel,
     method_kwargs: dict,
     primary_key_type: Any = int,
+    expansion: Optional[Expansion] = None,
+    deferred_columns: Optional[List[str]] = None,
 ) -> Callable:
     """Generate an get endpoint to retrive elements by primarykey value.
 
@@ -107,25 +357,129 @@ def get_id_creator(
     :type method_kwargs: dict
     :param primary_key_type: Type of the primary key to use in endpoint, defaults to int
     :type primary_key_type: Any, optional
+    :param expansion: Expands the relationships named by the expand parameter, defaults to None
+    :type expansion: Optional[Expansion], optional
+    :param deferred_columns: Columns left out of the query, read with the column route, defaults to None
+    :type deferred_columns: Optional[List[str]], optional
     :return: Endpoint function.
     :rtype: Callable
     """
     key_name, column = primary_key_checker(model)
+    load_options = [defer(getattr(model, name)) for name in deferred_columns or ()]
 
     @method("/{key}", response_model=schema, **method_kwargs)
     def get_id(
         key: primary_key_type,
+        request: Request,
         db: Session = Depends(get_db),
         current_user: user_schema = Depends(get_current_user),
     ):
-        response = db.query(model).filter(column == key).first()
+        tree = (
+            expansion.parse(model, request.query_params.get("expand"))
+            if expansion
+            else None
+        )
+        response = db.query(model).options(*load_options).filter(column == key)
+        if tree:
+            # the amount of related entries is checked before they are loaded
+            expansion.check(db, model, tree, response.subquery())
+            response = response.options(*expansion.options(model, tree))
+        response = response.first()
         if not response:
             not_found(model, key_name, key)
+        if tree:
+            return expansion.response(expansion.expand(model, tree, [response])[0])
         return response
 
     return get_id
 
 
+def column_creator(
+    method: Callable,
+    model: Table,
+    readers: dict,
+    get_db: Callable,
+    get_current_user: Callable,
+    user_schema: BaseModel,
+    method_kwargs: dict,
+    primary_key_type: Any = int,
+) -> Callable:
+    """Creates an endpoint streaming the value of a deferred column of an entry.
+    Binary values support Range requests, text values are sent whole.
+
+    :param method: FastAPI Router method to decorate the endpoint function with.
+    :type method: Callable
+    :param model: SQLalchemy model for the table containing endpoint data.
+    :type model: Table
+    :param readers: Names of the deferred columns mapped to the readers of their values.
+    :type readers: dict
+    :param get_db: Function to acquire a database session.
+    :type get_db: Callable
+    :param get_current_user: Function to acquire and verify the current user.
+    :type get_current_user: Callable
+    :param user_schema: Pydantic schema describing user information.
+    :type user_schema: BaseModel
+    :param method_kwargs: Key word arguments to add to the router method.
+    :type method_kwargs: dict
+    :param primary_key_type: Type of the primary key to use in endpoint, defaults to int
+    :type primary_key_type: Any, optional
+    :return: Endpoint function.
+    :rtype: Callable
+    """
+    responses = {
+        200: {"content": {"application/octet-stream": {}, "text/plain": {}}},
+        206: {"description": "Partial Content"},
+    }
+
+    @method(
+        "/{key}/{column}",
+        response_class=StreamingResponse,
+        responses=responses,
+        **method_kwargs,
+    )
+    def get_column(
+        key: primary_key_type,
+        column: str,
+        request: Request,
+        db: Session = Depends(get_db),
+        current_user: user_schema = Depends(get_current_user),
+    ):
+        reader: Optional[ColumnReader] = readers.get(column)
+        if reader is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"model: {model.__name__} does not have a deferred column {column}",
+            )
+        length = reader.length(db, key)
+        if length is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"{column} of {key} is null",
+            )
+        if not reader.binary:
+            # the length of text is counted in characters, not in bytes
+            return StreamingResponse(
+                reader.chunks(db, key),
+                media_type=reader.media_type,
+                headers={"Accept-Ranges": "none"},
+            )
+        byte_range = parse_range(request.headers.get("range"), length)
+        start, end = byte_range or (0, length - 1)
+        headers = {"Accept-Ranges": "bytes", "Content-Length": str(end - start + 1)}
+        status_code = status.HTTP_200_OK
+        if byte_range:
+            headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+        return StreamingResponse(
+            reader.chunks(db, key, start, end),
+            status_code=status_code,
+            media_type=reader.media_type,
+            headers=headers,
+        )
+
+    return get_column
+
+
 def put_creator_many(
     method: Callable,
     model: Table,
@@ -135,6 +489,7 @@ def put_creator_many(
     user_schema: BaseModel,
     method_kwargs: dict,
     excluded_columns: Optional[List] = None,
+    publish: Optional[Callable] = None,
 ) -> Callable:
     """Creates put endpoint for updating multiple entries in the database.
     Behaviour for any keys not present in the database is inserting them into the database.
@@ -155,32 +510,36 @@ def put_creator_many(
     :type method_kwargs: dict
     :param excluded_columns: List contaning columns to exclude from the put request. For example primary key should not be updated, defaults to None
     :type excluded_columns: Optional[List], optional
+    :param publish: Publishes the events of committed writes to subscribers, called with the operation, key and entry, defaults to None
+    :type publish: Optional[Callable], optional
     :return: Endpoint function.
     :rtype: Callable
     """
 
-    primary_key_col, column = primary_key_checker(model)
+    primary_key_col, _ = primary_key_checker(model)
     # schema = model_with_optional_fields(schema)
 
     @method("/", **method_kwargs)
-    async def update_many(
+    def update_many(
         request: List[schema],
         db: Session = Depends(get_db),
         current_user: user_schema = Depends(get_current_user),
     ):
 
         key_list = {pk.dict()[primary_key_col]: pk.dict() for pk in request}
+        events = []
 
         for primary_key, content in key_list.items():
-            db_item = db.query(model).filter(column == primary_key)
             if excluded_columns:
                 content = exclude_columns(content, excluded_columns)
-            if not db_item.first():
-                content[primary_key_col] = primary_key
-                db.add(model(**content))
-            else:
-                db_item.update(content)
+            operation = upsert_entry(db, model, primary_key, content)
+            events.append((operation, primary_key, content))
         db.commit()
+        if publish:
+            for operation, primary_key, content in events:
+                publish(
+                    operation, primary_key, {**content, primary_key_col: primary_key}
+                )
         return "updated"
 
     return update_many
@@ -196,6 +555,7 @@ def put_creator(
     method_kwargs: dict,
     primary_key_type: Any = int,
     excluded_columns: Optional[List] = None,
+    publish: Optional[Callable] = None,
 ) -> Callable:
     """Creates put endpoint for updating single entries in the database.
 
@@ -217,6 +577,8 @@ def put_creator(
     :type primary_key_type: Any, optional
     :param excluded_columns: List contaning columns to exclude from the put request. For example primary key should not be updated, defaults to None
     :type excluded_columns: Optional[List], optional
+    :param publish: Publishes the events of committed writes to subscribers, called with the operation, key and entry, defaults to None
+    :type publish: Optional[Callable], optional
     :return: Endpoint function.
     :rtype: Callable
     """
@@ -225,7 +587,7 @@ def put_creator(
     # schema = model_with_optional_fields(schema)
 
     @method("/{key}", **method_kwargs)
-    async def update(
+    def update(
         request: schema,
         key: primary_key_type,
         db: Session = Depends(get_db),
@@ -240,6 +602,8 @@ def put_creator(
             request = exclude_columns(request, excluded_columns)
         db_item.update(request)
         db.commit()
+        if publish:
+            publish("update", key, {**request, key_name: key})
         return "updated"
 
     return update
@@ -254,6 +618,8 @@ def post_creator(
     user_schema: BaseModel,
     method_kwargs: dict,
     excluded_columns: Optional[List] = None,
+    coalescer: Optional[WriteCoalescer] = None,
+    publish: Optional[Callable] = None,
 ) -> Callable:
     """Creates a post endpoint for single or multiple entries into the database.
 
@@ -274,10 +640,16 @@ def post_creator(
     :type method_kwargs: dict
     :param excluded_columns: List contaning columns to exclude from the put request. For example primary key should not be updated, defaults to None
     :type excluded_columns: Optional[List], optional
+    :param coalescer: Inserts single entries of concurrent requests in batches, defaults to None
+    :type coalescer: Optional[WriteCoalescer], optional
+    :param publish: Publishes the events of committed writes to subscribers, called with the operation, key and entry, defaults to None
+    :type publish: Optional[Callable], optional
     :return: Endpoint function.
     :rtype: Callable
     """
 
+    key_name, _ = primary_key_checker(model)
+
     @method("/", **method_kwargs)
     def post(
         request: Union[List[schema], schema],
@@ -290,13 +662,197 @@ def post_creator(
         #     insert_many(request,excluded_columns,db,model)
         # else:
         #     insert_single(request,excluded_columns,db,model)
-        inserter(request, excluded_columns, db, model)
+        if coalescer and not isinstance(request, list):
+            content = request.dict()
+            if excluded_columns:
+                content = exclude_columns(content, excluded_columns)
+            coalescer.insert(db, content)
+        else:
+            inserter(request, excluded_columns, db, model)
+        if publish:
+            for entry in request if isinstance(request, list) else [request]:
+                content = entry.dict()
+                if excluded_columns:
+                    content = exclude_columns(content, excluded_columns)
+                publish("insert", content.get(key_name), content)
 
         return original_request
 
     return post
 
 
+def bulk_ingest_creator(
+    method: Callable,
+    model: Table,
+    schema: BaseModel,
+    ingest: BulkIngest,
+    get_db: Callable,
+    get_current_user: Callable,
+    user_schema: BaseModel,
+    method_kwargs: dict,
+    excluded_columns: Optional[List] = None,
+    limiter: Optional[RouteLimiter] = None,
+    limit: Optional[Tuple[str, str, Callable]] = None,
+    executors: Optional[Executors] = None,
+    publish: Optional[Callable] = None,
+) -> Callable:
+    # pylint: disable=C0301
+    """Creates a post endpoint inserting a streamed NDJSON or CSV body, optionally gzip compressed.
+    The body is never held in memory as a whole, rows are validated and inserted in chunks.
+
+    :param method: FastAPI Router method to decorate the endpoint function with.
+    :type method: Callable
+    :param model: SQLalchemy model for the table containing endpoint data.
+    :type model: Table
+    :param schema: Pydantic schema to validate the rows with.
+    :type schema: BaseModel
+    :param ingest: Inserts the rows in chunks and reports failing rows.
+    :type ingest: BulkIngest
+    :param get_db: Function to acquire a database session.
+    :type get_db: Callable
+    :param get_current_user: Function to acquire and verify the current user.
+    :type get_current_user: Callable
+    :param user_schema: Pydantic schema describing user information.
+    :type user_schema: BaseModel
+    :param method_kwargs: Key word arguments to add to the router method.
+    :type method_kwargs: dict
+    :param excluded_columns: List contaning columns to exclude from the inserted rows, defaults to None
+    :type excluded_columns: Optional[List], optional
+    :param limiter: Rate limiter charging the rows of every chunk against limit, defaults to None
+    :type limiter: Optional[RouteLimiter], optional
+    :param limit: Limit of the post method of the table, as returned by RouteLimiter.limit, defaults to None
+    :type limit: Optional[Tuple[str, str, Callable]], optional
+    :param executors: Threadpools per endpoint class, uploads run on the bulk threadpool, defaults to None
+    :type executors: Optional[Executors], optional
+    :param publish: Publishes the rows of committed transactions to subscribers, called with the operation, key and entry, defaults to None
+    :type publish: Optional[Callable], optional
+    :return: Endpoint function.
+    :rtype: Callable
+    """
+    # pylint: enable=C0301
+    items = parse_many(limit[0]) if limiter and limit else None
+    request_body = {
+        "requestBody": {
+            "required": True,
+            "content": {
+                media_type: {"schema": {"type": "string", "format": "binary"}}
+                for media_type in FORMATS
+            },
+        }
+    }
+
+    @method("/bulk", openapi_extra=request_body, **method_kwargs)
+    async def bulk_ingest(
+        request: Request,
+        db: Session = Depends(get_db),
+        current_user: user_schema = Depends(get_current_user),
+    ):
+        row_format = ingest.row_format(request.headers.get("content-type", ""))
+        if row_format is None:
+            raise HTTPException(
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail=f"Content-Type must be one of {', '.join(FORMATS)}",
+            )
+        compressed = request.headers.get("content-encoding", "").lower() == "gzip"
+        charge = None
+        if items:
+            # the rows are charged chunk by chunk while the body streams in
+            _, scope, key_func = limit
+            charge = functools.partial(limiter.charge, request, items, scope, key_func)
+        # the rows are parsed and inserted in a worker thread reading the body as it arrives
+        chunks = sync_chunks(request.stream(), asyncio.get_running_loop())
+        arguments = (
+            ingest.ingest_body,
+            db,
+            model,
+            schema,
+            chunks,
+            row_format,
+            compressed,
+            excluded_columns,
+            charge,
+            publish,
+        )
+        if executors:
+            return await executors.run("bulk", *arguments)
+        return await run_in_threadpool(*arguments)
+
+    return bulk_ingest
+
+
+def job_creator(
+    method: Callable,
+    model: Table,
+    schema: BaseModel,
+    jobs: Jobs,
+    operation: str,
+    get_current_user: Callable,
+    user_schema: BaseModel,
+    method_kwargs: dict,
+    excluded_columns: Optional[List] = None,
+    publish: Optional[Callable] = None,
+) -> Callable:
+    # pylint: disable=C0301
+    """Creates an endpoint submitting a list of entries as a background job, answered with http 202.
+    The insert operation writes the entries like post, the upsert operation like put of multiple entries.
+    Register before put_creator, the jobs path would otherwise be taken for a primary key.
+
+    :param method: FastAPI Router method to decorate the endpoint function with.
+    :type method: Callable
+    :param model: SQLalchemy model for the table containing endpoint data.
+    :type model: Table
+    :param schema: Pydantic schema describing input/output for the endpoints.
+    :type schema: BaseModel
+    :param jobs: Stores the jobs and runs them on its workers.
+    :type jobs: Jobs
+    :param operation: Operation of the jobs, insert or upsert.
+    :type operation: str
+    :param get_current_user: Function to acquire and verify the current user.
+    :type get_current_user: Callable
+    :param user_schema: Pydantic schema describing user information.
+    :type user_schema: BaseModel
+    :param method_kwargs: Key word arguments to add to the router method.
+    :type method_kwargs: dict
+    :param excluded_columns: List contaning columns to exclude from the written entries, defaults to None
+    :type excluded_columns: Optional[List], optional
+    :param publish: Publishes the events of committed chunks to subscribers, called with the operation, key and entry, defaults to None
+    :type publish: Optional[Callable], optional
+    :return: Endpoint function.
+    :rtype: Callable
+    """
+    # pylint: enable=C0301
+    table_name = model.__name__
+    jobs.register(
+        table_name,
+        operation,
+        functools.partial(
+            OPERATIONS[operation],
+            model=model,
+            schema=schema,
+            excluded_columns=excluded_columns,
+        ),
+        publish,
+    )
+
+    # the request only stores the entries, no database session is used
+    def submit_job(
+        request: List[schema],
+        response: Response,
+        current_user: user_schema = Depends(get_current_user),
+    ):
+        job = jobs.submit(
+            current_user.email, table_name, operation, jsonable_encoder(request)
+        )
+        response.headers["Location"] = jobs.location(job["id"])
+        return job
+
+    # the name of the endpoint is its endpoint class, see routing.ENDPOINT_CLASSES
+    submit_job.__name__ = f"{operation}_job"
+    return method("/jobs", status_code=status.HTTP_202_ACCEPTED, **method_kwargs)(
+        submit_job
+    )
+
+
 def delete_creator(
     method: Callable,
     model: Table,
@@ -305,6 +861,8 @@ def delete_creator(
     user_schema: BaseModel,
     method_kwargs: dict,
     primary_key_type: Any = int,
+    feed: Optional[ChangeFeed] = None,
+    publish: Optional[Callable] = None,
 ) -> Callable:
     """Creates an endpoint to delete multiple entries by request data.
 
@@ -322,6 +880,10 @@ def delete_creator(
     :type method_kwargs: dict
     :param primary_key_type: Type of the primary key to use in endpoint, defaults to int
     :type primary_key_type: Any, optional
+    :param feed: Change feed recording tombstones of the deleted entries, defaults to None
+    :type feed: Optional[ChangeFeed], optional
+    :param publish: Publishes the events of committed writes to subscribers, called with the operation, key and entry, defaults to None
+    :type publish: Optional[Callable], optional
     :return: Endpoint function.
     :rtype: Callable
     """
@@ -340,9 +902,17 @@ def delete_creator(
         current_user: user_schema = Depends(get_current_user),
     ):
         key_list = [pk.dict()["primary_key"] for pk in request]
+        if feed or publish:
+            # tombstones and events only for the keys that exist
+            key_list = [key for (key,) in db.query(column).filter(column.in_(key_list))]
         db_items = db.query(model).filter(column.in_(key_list))
         db_items.delete(synchronize_session=False)
+        if feed:
+            feed.record_deletes(db, key_list)
         db.commit()
+        if publish:
+            for key in key_list:
+                publish("delete", key)
         return "records deleted"
 
     return delete_many
@@ -356,6 +926,8 @@ def delete_creator_id(
     user_schema: BaseModel,
     method_kwargs: dict,
     primary_key_type: Any = int,
+    feed: Optional[ChangeFeed] = None,
+    publish: Optional[Callable] = None,
 ) -> Callable:
     """Creates an endpoint to delete a single entry by primary key.
 
@@ -373,6 +945,10 @@ def delete_creator_id(
     :type method_kwargs: dict
     :param primary_key_type: Type of the primary key to use in endpoint, defaults to int
     :type primary_key_type: Any, optional
+    :param feed: Change feed recording tombstones of the deleted entries, defaults to None
+    :type feed: Optional[ChangeFeed], optional
+    :param publish: Publishes the events of committed writes to subscribers, called with the operation, key and entry, defaults to None
+    :type publish: Optional[Callable], optional
     :return: Endpoint function.
     :rtype: Callable
     """
@@ -389,7 +965,11 @@ def delete_creator_id(
         if not db_item.first():
             not_found(model, key_name, key)
         db_item.delete(synchronize_session=False)
+        if feed:
+            feed.record_deletes(db, [key])
         db.commit()
+        if publish:
+            publish("delete", key)
         return f"record with primary key: {key} deleted"
 
     return delete
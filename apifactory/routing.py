@@ -0,0 +1,257 @@
+"""Module containing the route classes used by the generated routers.
+Route hooks wrap the request handler of every generated route,
+allowing behaviour to be added around complete requests.
+Lazy routes stand in for the routes of a table until the table is first requested.
+"""
+import threading
+from typing import Awaitable, Callable, Optional, Sequence, Tuple, Type
+
+from fastapi import APIRouter, FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from fastapi_pagination import add_pagination
+from starlette.background import BackgroundTask, BackgroundTasks
+from starlette.routing import BaseRoute, Match, NoMatchFound
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+RouteHook = Callable[[APIRoute, Handler], Handler]
+
+ENDPOINT_CLASSES = {
+    "get_all": "read",
+    "get_id": "read",
+    "export": "export",
+    "aggregate": "export",
+    "get_column": "export",
+    "changes": "read",
+    "subscribe": "read",
+    "post": "write",
+    "update": "write",
+    "delete": "write",
+    "update_many": "bulk",
+    "delete_many": "bulk",
+    "bulk_ingest": "bulk",
+    "insert_job": "write",
+    "upsert_job": "write",
+    "batch": "bulk",
+}
+
+# method names used for per method options in the configuration of a table
+CONFIG_METHODS = {
+    "get_all": "get",
+    "get_id": "get_id",
+    "export": "export",
+    "aggregate": "aggregate",
+    "get_column": "column",
+    "changes": "changes",
+    "subscribe": "subscribe",
+    "post": "post",
+    "bulk_ingest": "post",
+    "insert_job": "post",
+    "upsert_job": "put",
+    "update": "put",
+    "update_many": "put",
+    "delete": "delete",
+    "delete_many": "delete",
+}
+
+
+def endpoint_class(route: APIRoute) -> Optional[str]:
+    """Returns the class (read, write, bulk or export) of a generated route.
+
+    :param route: Route to classify.
+    :type route: APIRoute
+    :return: Name of the endpoint class or None for routes not generated by apifactory.
+    :rtype: Optional[str]
+    """
+    return ENDPOINT_CLASSES.get(route.name)
+
+
+async def body_start(request: Request) -> bytes:
+    """Returns the first byte of the body that is not whitespace, empty for empty bodies.
+    Only the messages up to that byte are received, they are replayed to the route handler,
+    so classifying a request does not buffer its body.
+
+    :param request: Incoming request.
+    :type request: Request
+    :return: The first byte of the body that is not whitespace.
+    :rtype: bytes
+    """
+    if hasattr(request, "_body"):
+        # read before, by another route hook
+        return request._body.lstrip()[:1]  # pylint: disable=W0212
+    received = []
+    start = b""
+    while True:
+        message = await request.receive()
+        received.append(message)
+        start = message.get("body", b"").lstrip()[:1]
+        if start or not message.get("more_body", False):
+            break
+    receive = request._receive  # pylint: disable=W0212
+
+    async def replay():
+        if received:
+            return received.pop(0)
+        return await receive()
+
+    request._receive = replay  # pylint: disable=W0212
+    return start
+
+
+async def request_class(route: APIRoute, request: Request) -> Optional[str]:
+    """Returns the endpoint class of a single request.
+    Posts containing a list of entries are bulk requests,
+    told apart by the first byte of their body instead of the whole body.
+
+    :param route: Route handling the request.
+    :type route: APIRoute
+    :param request: Incoming request.
+    :type request: Request
+    :return: Name of the endpoint class or None for routes not generated by apifactory.
+    :rtype: Optional[str]
+    """
+    kind = endpoint_class(route)
+    if route.name == "post" and await body_start(request) == b"[":
+        kind = "bulk"
+    return kind
+
+
+def after_body(response: Response, callback: Callable[[int], None]) -> bool:
+    # pylint: disable=C0301
+    """Calls callback once with the size of the body of a streamed response when the body is sent.
+    Streams ended early, by an error or a disconnect, call it too: when the body stops,
+    or else in a background task run after the response, before the background tasks of the route.
+
+    :param response: Response returned by a request handler.
+    :type response: Response
+    :param callback: Function called on the event loop with the amount of bytes sent.
+    :type callback: Callable[[int], None]
+    :return: Whether the response is streamed, callback is not called for other responses.
+    :rtype: bool
+    """
+    # pylint: enable=C0301
+    if not isinstance(response, StreamingResponse):
+        return False
+    iterator = response.body_iterator
+    sent = {"size": 0, "done": False}
+
+    def finish() -> None:
+        if not sent["done"]:
+            sent["done"] = True
+            callback(sent["size"])
+
+    async def body():
+        try:
+            async for chunk in iterator:
+                sent["size"] += len(
+                    chunk
+                    if isinstance(chunk, bytes)
+                    else chunk.encode(response.charset)
+                )
+                yield chunk
+        finally:
+            finish()
+
+    async def finish_task() -> None:
+        finish()
+
+    response.body_iterator = body()
+    tasks = [BackgroundTask(finish_task)]
+    if response.background:
+        tasks.append(response.background)
+    response.background = BackgroundTasks(tasks)
+    return True
+
+
+class HookedRoute(APIRoute):
+    """APIRoute that wraps its request handler with the route hooks of the class.
+    Hooks are applied in order, the first hook being the outermost.
+    """
+
+    route_hooks: Tuple[RouteHook, ...] = ()
+
+    def get_route_handler(self) -> Handler:
+        handler = super().get_route_handler()
+        for hook in reversed(self.route_hooks):
+            handler = hook(self, handler)
+        return handler
+
+
+def hooked_route_class(route_hooks: Optional[Sequence[RouteHook]]) -> Type[APIRoute]:
+    """Creates a route class applying the given route hooks.
+
+    :param route_hooks: Functions accepting the route and its handler, returning a new handler.
+    :type route_hooks: Optional[Sequence[RouteHook]]
+    :return: Route class to pass to an APIRouter.
+    :rtype: Type[APIRoute]
+    """
+    if not route_hooks:
+        return APIRoute
+    return type("HookedRoute", (HookedRoute,), {"route_hooks": tuple(route_hooks)})
+
+
+# routes of the app are replaced by one lazy route at a time
+MATERIALIZE_LOCK = threading.RLock()
+
+
+class LazyRoute(BaseRoute):
+    # pylint: disable=C0301
+    """Placeholder matching every path of a table, creating the routes of the table on the first request.
+    The placeholder replaces itself with the created routes and passes the request on to the app.
+
+    :param app: App the routes are added to.
+    :type app: FastAPI
+    :param prefix: Path prefix of the routes of the table, for example /test_table.
+    :type prefix: str
+    :param create_router: Function creating the router of the table.
+    :type create_router: Callable[[], APIRouter]
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self, app: FastAPI, prefix: str, create_router: Callable[[], APIRouter]
+    ) -> None:
+        self.app = app
+        self.prefix = prefix
+        self.create_router = create_router
+        self.materialized = False
+
+    def matches(self, scope) -> Tuple[Match, dict]:
+        if scope["type"] == "http":
+            path = scope["path"]
+            if path == self.prefix or path.startswith(f"{self.prefix}/"):
+                return Match.FULL, {}
+        return Match.NONE, {}
+
+    def url_path_for(self, name: str, **path_params):
+        raise NoMatchFound()
+
+    def materialize(self) -> None:
+        """Replaces the placeholder in the routes of the app with the routes of the table."""
+        with MATERIALIZE_LOCK:
+            if self.materialized:
+                return
+            routes = self.app.router.routes
+            existing = len(routes)
+            self.app.include_router(add_pagination(self.create_router()))
+            created = routes[existing:]
+            del routes[existing:]
+            position = routes.index(self)
+            routes[position : position + 1] = created
+            self.materialized = True
+
+    async def handle(self, scope, receive, send) -> None:
+        self.materialize()
+        await self.app.router(scope, receive, send)
+
+
+def materialize_lazy_routes(app: FastAPI) -> None:
+    """Creates the routes of all tables that were not requested yet, for example to document them.
+
+    :param app: App containing lazy routes.
+    :type app: FastAPI
+    """
+    for route in list(app.router.routes):
+        if isinstance(route, LazyRoute):
+            route.materialize()
@@ -1,8 +1,9 @@
 """ module for auto generating schema from SQL alchemy models.
 """
 # pylint: disable=E0611
+import threading
 
-from pydantic import BaseConfig
+from pydantic import BaseConfig, create_model
 
 import sqlalchemy.orm
 import sqlalchemy.sql.sqltypes
@@ -26,6 +27,10 @@ class Schemas:
 
     :param models: Models object generated by the DataBase class.
     :type models: Models
+    :param lazy: Create the schema of a table on its first use, defaults to False
+    :type lazy: bool, optional
+    :param deferred: Deferred columns per table, left out of the response schemas, defaults to None
+    :type deferred: dict, optional
 
 
     Basic usage is instantiate a Database form api factory
@@ -39,17 +44,62 @@ class Schemas:
 
     """
 
-    def __init__(self, models: Models) -> None:
+    def __init__(
+        self, models: Models, lazy: bool = False, deferred: dict = None
+    ) -> None:
 
         tables = [
             getattr(models, x)
             for x in dir(models)
             if (type(getattr(models, x)) == sqlalchemy.orm.decl_api.DeclarativeMeta)
         ]
+        # underscored so they do not collide with the names of tables
+        self._pending = {}
+        self._models = {str(table.__table__.name): table for table in tables}
+        self._deferred = deferred or {}
+        self._responses = {}
+        self._lock = threading.Lock()
         for table in tables:
             # disabled false positve pylint error
             # pylint: disable=C0103
             table_name = str(table.__table__.name)
             # pylint: enable=C0103
+            if lazy:
+                self._pending[table_name] = table
+                continue
             schema = sqlalchemy_to_pydantic(table, config=OrmConfig)
             setattr(self, table_name, schema)
+
+    def __getattr__(self, name: str):
+        """Creates the schema of a table on first access in lazy mode."""
+        pending = self.__dict__.get("_pending", {})
+        if name not in pending:
+            raise AttributeError(f"{type(self).__name__} has no attribute {name}")
+        with self._lock:
+            if name not in self.__dict__:
+                schema = sqlalchemy_to_pydantic(pending[name], config=OrmConfig)
+                setattr(self, name, schema)
+        return self.__dict__[name]
+
+    def response_schema(self, name: str):
+        """Schema of the responses of a table, without its deferred columns.
+        Posts and puts use the complete schema, so deferred columns can still be written.
+
+        :param name: Name of the table.
+        :type name: str
+        :return: Pydantic schema of the table without its deferred columns.
+        :rtype: BaseModel
+        """
+        schema = getattr(self, name)
+        if not self._deferred.get(name):
+            return schema
+        with self._lock:
+            if name not in self._responses:
+                response = sqlalchemy_to_pydantic(
+                    self._models[name], config=OrmConfig, exclude=self._deferred[name]
+                )
+                # renamed, the openapi schemas of a table are told apart by name
+                self._responses[name] = create_model(
+                    f"{schema.__name__}Response", __base__=response
+                )
+        return self._responses[name]
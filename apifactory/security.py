@@ -10,10 +10,11 @@ from collections.abc import Callable
 from pydantic import BaseModel
 from passlib.context import CryptContext
 from jose import JWTError, jwt
-from fastapi import APIRouter, Depends, status, HTTPException
+from fastapi import APIRouter, Depends, Request, status, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from sqlalchemy import Table
+from slowapi.util import get_remote_address
 
 
 # from database import get_db, Models
@@ -167,7 +168,7 @@ class Security:
         encoded_jwt = jwt.encode(to_encode, self.secret_key, algorithm=self.algorithm)
         return encoded_jwt
 
-    def verify_token(self, token: str, credentials_exception: Exception):
+    def verify_token(self, token: str, credentials_exception: Exception) -> TokenData:
         # pylint: disable=C0301
         """Function for checking the validity of jwt tokens.
         Checks if the required fields are present and if the JWT can be recreated.
@@ -177,6 +178,8 @@ class Security:
         :param credentials_exception: Exception to raise when faced with invalid credentials.
         :type credentials_exception: Exception
         :raises credentials_exception: The provided token is invalid and the user is not granted acces to the endpoint.
+        :return: Data contained in the token.
+        :rtype: TokenData
         """
         # pylint: enable=C0301
         try:
@@ -184,9 +187,30 @@ class Security:
             email: str = payload.get("sub")
             if email is None:
                 raise credentials_exception
-            TokenData(email=email)
         except JWTError as error:
             raise credentials_exception from error
+        return TokenData(email=email)
+
+    def subject_or_address(self, request: Request) -> str:
+        """Rate limit key function. Returns the subject of the bearer token of the request.
+        Falls back to the remote address if the request carries no valid token.
+
+        :param request: Incoming request.
+        :type request: Request
+        :return: Subject of the JWT or the address of the client.
+        :rtype: str
+        """
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and token:
+            try:
+                payload = jwt.decode(
+                    token, self.secret_key, algorithms=[self.algorithm]
+                )
+            except JWTError:
+                payload = {}
+            if payload.get("sub"):
+                return f"sub:{payload['sub']}"
+        return get_remote_address(request)
 
     def login_router(self, usermodel: Table, get_db: Callable) -> APIRouter:
         # pylint: disable=C0301
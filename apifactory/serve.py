@@ -0,0 +1,227 @@
+"""Module containing the prefork launcher of apifactory.
+The master process creates the app once: it reflects the database, generates the schemas and routers
+and builds the openapi document. It then forks the workers, which share all of it copy-on-write
+and serve the app with uvicorn on a single listening socket.
+
+    apifactory serve config.yaml --host 0.0.0.0 --port 8000 --workers 4
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI
+
+from apifactory.app_factory import ApiFactory
+
+logger = logging.getLogger(__name__)
+
+
+def load_factory(config_file: str, **kwargs) -> ApiFactory:
+    # pylint: disable=C0301
+    """Instantiates ApiFactory from a yaml or json configuration file.
+
+    :param config_file: Path to a yaml or json file containing valid configuration for ApiFactory.
+    :type config_file: str
+    :return: Instantiated ApiFactory object.
+    :rtype: ApiFactory
+    """
+    # pylint: enable=C0301
+    if config_file.endswith(".json"):
+        return ApiFactory.from_json(config_file, **kwargs)
+    return ApiFactory.from_yaml(config_file, **kwargs)
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    """Creates the listening socket shared by all workers.
+
+    :param host: Address to bind to.
+    :type host: str
+    :param port: Port to bind to.
+    :type port: int
+    :param backlog: Maximum amount of pending connections, defaults to 2048
+    :type backlog: int, optional
+    :return: Listening socket, inherited by forked workers.
+    :rtype: socket.socket
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Prefork:
+    # pylint: disable=C0301
+    """Master process forking workers that serve a single app.
+    Workers exiting unexpectedly are replaced, unless they exit within min_uptime seconds of their start,
+    which means every new worker would fail as well.
+
+    :param factory: ApiFactory the app was created with.
+    :type factory: ApiFactory
+    :param app: App to serve.
+    :type app: FastAPI
+    :param sock: Listening socket shared by the workers.
+    :type sock: socket.socket
+    :param workers: Amount of worker processes, defaults to 1
+    :type workers: int, optional
+    :param min_uptime: Seconds a worker must run before it is replaced after exiting, defaults to 1.0
+    :type min_uptime: float, optional
+    :param server_kwargs: Further arguments to uvicorn.Config, for example log_level.
+
+
+    >>> factory = ApiFactory.from_yaml("config.yaml")
+    >>> app = factory.app_factory()
+    >>> Prefork(factory, app, bind_socket("0.0.0.0", 8000), workers=4).run()
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        factory: ApiFactory,
+        app: FastAPI,
+        sock: socket.socket,
+        workers: int = 1,
+        min_uptime: float = 1.0,
+        **server_kwargs,
+    ) -> None:
+        self.factory = factory
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.min_uptime = min_uptime
+        self.server_kwargs = server_kwargs
+        self.children: Dict[int, float] = {}
+        self.stopping = False
+        self.exit_code = 0
+
+    def prepare(self) -> None:
+        # pylint: disable=C0301
+        """Finishes all work shared by the workers and moves it out of reach of the garbage collector.
+        Building the openapi document also creates the routes of lazy tables.
+        Freezing keeps the collector from touching, and so copying, the pages of the shared objects.
+        """
+        # pylint: enable=C0301
+        self.factory.openapi_cache.build()
+        # no connection of the master may be shared with the workers
+        self.factory.db.dispose_pools()
+        gc.collect()
+        gc.freeze()
+
+    def spawn(self) -> int:
+        """Forks a worker.
+
+        :return: Process id of the worker.
+        :rtype: int
+        """
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self.worker()
+            except BaseException:  # pylint: disable=W0703
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)  # pylint: disable=W0212
+        self.children[pid] = time.monotonic()
+        return pid
+
+    def worker(self) -> None:
+        """Serves the app in a forked worker until uvicorn shuts down."""
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        # pools created after the fork, connections are never shared between processes
+        self.factory.db.dispose_pools(close=False)
+        config = uvicorn.Config(self.app, **self.server_kwargs)
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def stop(self, signum: int, frame=None) -> None:  # pylint: disable=W0613
+        """Signal handler of the master, passing the signal on to the workers."""
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                self.children.pop(pid, None)
+
+    def reap(self, pid: int, status: int) -> None:
+        """Handles the exit of a worker, replacing it if it ran long enough."""
+        started = self.children.pop(pid, None)
+        if started is None or self.stopping:
+            return
+        code = os.waitstatus_to_exitcode(status)
+        if time.monotonic() - started < self.min_uptime:
+            logger.error("worker %s exited with %s right after starting", pid, code)
+            self.exit_code = 1
+            self.stop(signal.SIGTERM)
+            return
+        logger.warning("worker %s exited with %s, starting a new worker", pid, code)
+        self.spawn()
+
+    def run(self) -> int:
+        """Prepares the app, starts the workers and supervises them until they are stopped.
+
+        :return: Exit code of the master.
+        :rtype: int
+        """
+        self.prepare()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            self.reap(pid, status)
+        self.sock.close()
+        return self.exit_code
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parses the command line arguments of apifactory."""
+    parser = argparse.ArgumentParser(prog="apifactory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser(
+        "serve", help="serve an app with prefork workers sharing its models"
+    )
+    serve.add_argument("config", help="yaml or json configuration of ApiFactory")
+    serve.add_argument("--host", default="127.0.0.1", help="address to bind to")
+    serve.add_argument("--port", type=int, default=8000, help="port to bind to")
+    serve.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="worker processes"
+    )
+    serve.add_argument(
+        "--backlog", type=int, default=2048, help="maximum pending connections"
+    )
+    serve.add_argument("--log-level", default="info", help="log level of uvicorn")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Entry point of the apifactory command."""
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper())
+    factory = load_factory(args.config)
+    app = factory.app_factory()
+    sock = bind_socket(args.host, args.port, args.backlog)
+    prefork = Prefork(
+        factory,
+        app,
+        sock,
+        workers=args.workers,
+        log_level=args.log_level,
+        backlog=args.backlog,
+    )
+    sys.exit(prefork.run())
@@ -0,0 +1,247 @@
+"""Module containing the slow query log of the generated endpoints.
+Statements of generated endpoints exceeding a threshold are recorded with the shapes
+of their parameters and the query plan of the database,
+so filters that do not use an index can be found and tuned.
+Query plans are retrieved once the response is sent, on a connection of their own.
+"""
+# the signatures of the listeners are given by sqlalchemy
+# pylint: disable=W0613
+import contextvars
+import datetime
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterable, List, Optional, Sequence
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.background import BackgroundTask, BackgroundTasks
+
+from apifactory.routing import Handler
+
+SLOW_START_KEY = "apifactory_slow_query_start"
+
+current_route: contextvars.ContextVar = contextvars.ContextVar(
+    "apifactory_slow_query_route", default=None
+)
+# slow statements of the current request waiting for their query plan
+pending_plans: contextvars.ContextVar = contextvars.ContextVar(
+    "apifactory_slow_query_plans", default=None
+)
+
+
+def parameter_shapes(parameters):
+    """Returns the types of bound parameters, leaving out their values."""
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def query_plan(
+    dialect: str, dbapi_connection, statement: str, parameters
+) -> Optional[List[str]]:
+    # pylint: disable=C0301
+    """Retrieves the query plan of a select statement with the mechanism of the database dialect.
+    EXPLAIN QUERY PLAN for sqlite, EXPLAIN for postgresql and mysql and SHOWPLAN_TEXT for mssql.
+    The plan is retrieved on the raw connection, so it does not trigger the statement listeners.
+    Use a connection without an open transaction, SHOWPLAN_TEXT cannot be set within one.
+
+    :param dialect: Name of the database dialect.
+    :type dialect: str
+    :param dbapi_connection: DBAPI connection to retrieve the plan on.
+    :param statement: SQL text of the statement.
+    :type statement: str
+    :param parameters: Bound parameters of the statement.
+    :return: Rows of the plan, one string per row, None for dialects without a query plan.
+    :rtype: Optional[List[str]]
+    """
+    # pylint: enable=C0301
+    if dialect not in ("sqlite", "postgresql", "mysql", "mariadb", "mssql"):
+        return None
+    cursor = dbapi_connection.cursor()
+    try:
+        if dialect == "sqlite":
+            cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        elif dialect in ("postgresql", "mysql", "mariadb"):
+            cursor.execute(f"EXPLAIN {statement}", parameters)
+        elif dialect == "mssql":
+            cursor.execute("SET SHOWPLAN_TEXT ON")
+            try:
+                cursor.execute(statement, parameters)
+                rows = []
+                while True:
+                    rows.extend(" ".join(map(str, row)) for row in cursor.fetchall())
+                    if not cursor.nextset():
+                        break
+                return rows
+            finally:
+                cursor.execute("SET SHOWPLAN_TEXT OFF")
+        return [" ".join(map(str, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+class SlowQueryLog:
+    # pylint: disable=C0301
+    """Records statements of the generated endpoints that take longer than a threshold.
+    Records are kept in a bounded in memory store and can be viewed by admin users on an admin route.
+
+    :param engines: Engines to install the statement listeners on.
+    :type engines: Iterable[Engine]
+    :param threshold: Statements taking at least this amount of seconds are recorded, defaults to 0.5
+    :type threshold: float, optional
+    :param max_records: Maximum amount of records kept, older records are dropped, defaults to 100
+    :type max_records: int, optional
+    :param explain: Whether to retrieve the query plan of slow select statements, defaults to True
+    :type explain: bool, optional
+    :param admin_users: Subjects (user names) allowed to view the records, defaults to None
+    :type admin_users: Optional[Sequence[str]], optional
+    :param route: Path of the admin route, defaults to "/admin/slow-queries"
+    :type route: str, optional
+
+
+    >>> slow_queries = SlowQueryLog(db.all_engines(), threshold=0.2, admin_users=["admin"])
+    >>> routers = Routers(..., route_hooks=[slow_queries.route_hook])
+    >>> app.include_router(slow_queries.router(security.get_current_user))
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        engines: Iterable[Engine],
+        threshold: float = 0.5,
+        max_records: int = 100,
+        explain: bool = True,
+        admin_users: Optional[Sequence[str]] = None,
+        route: str = "/admin/slow-queries",
+    ) -> None:
+        self.threshold = threshold
+        self.explain = explain
+        self.admin_users = set(admin_users or ())
+        self.route = route
+        self.records: deque = deque(maxlen=max_records)
+        self.lock = threading.Lock()
+        for engine in engines:
+            self.install(engine)
+
+    def install(self, engine: Engine) -> None:
+        """Installs the statement listeners on an engine.
+
+        :param engine: Engine to install the listeners on.
+        :type engine: Engine
+        """
+        event.listen(engine, "before_cursor_execute", self.statement_start)
+        event.listen(engine, "after_cursor_execute", self.statement_end)
+
+    @staticmethod
+    def statement_start(conn, cursor, statement, parameters, context, executemany):
+        """Engine before_cursor_execute listener, timing statements of generated routes."""
+        if current_route.get() is not None:
+            conn.info[SLOW_START_KEY] = time.perf_counter()
+
+    def statement_end(self, conn, cursor, statement, parameters, context, executemany):
+        """Engine after_cursor_execute listener, recording slow statements."""
+        started = conn.info.pop(SLOW_START_KEY, None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        if duration < self.threshold:
+            return
+        route, table = current_route.get()
+        record = {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "route": route,
+            "table": table,
+            "duration": round(duration, 6),
+            "statement": statement,
+            "parameters": parameter_shapes(parameters),
+            "dialect": conn.dialect.name,
+            "plan": None,
+        }
+        is_select = statement.lstrip()[:6].upper() in ("SELECT", "WITH")
+        plans = pending_plans.get()
+        if self.explain and is_select and not executemany and plans is not None:
+            # the connection of the statement still has rows to fetch and may be in a transaction
+            plans.append((record, conn.engine, statement, parameters))
+        with self.lock:
+            self.records.append(record)
+
+    @staticmethod
+    def explain_plans(plans: list) -> None:
+        # pylint: disable=C0301
+        """Retrieves the query plans of the slow statements of a request on connections of their own.
+
+        :param plans: Records of slow statements with the engine, statement and parameters to explain.
+        :type plans: list
+        """
+        # pylint: enable=C0301
+        for record, engine, statement, parameters in plans:
+            try:
+                connection = engine.raw_connection()
+                try:
+                    record["plan"] = query_plan(
+                        engine.dialect.name, connection, statement, parameters
+                    )
+                finally:
+                    connection.close()
+            except Exception as error:  # pylint: disable=W0703
+                record["plan_error"] = str(error)
+
+    def route_hook(self, route: APIRoute, handler: Handler) -> Handler:
+        """Route hook marking the statements of a route as statements of a generated endpoint.
+
+        :param route: Route to record.
+        :type route: APIRoute
+        :param handler: Request handler of the route.
+        :type handler: Handler
+        :return: Request handler marking its statements.
+        :rtype: Handler
+        """
+        marker = (route.path_format, route.tags[0] if route.tags else None)
+
+        async def recorded_handler(request: Request) -> Response:
+            plans: list = []
+            token = current_route.set(marker)
+            plans_token = pending_plans.set(plans)
+            try:
+                response = await handler(request)
+            finally:
+                current_route.reset(token)
+                pending_plans.reset(plans_token)
+            if plans:
+                # runs after the response is sent, next to the background tasks of the route
+                tasks = [BackgroundTask(self.explain_plans, plans)]
+                if response.background:
+                    tasks.insert(0, response.background)
+                response.background = BackgroundTasks(tasks)
+            return response
+
+        return recorded_handler
+
+    def router(self, get_current_user: Callable) -> APIRouter:
+        """Creates the admin route listing the recorded statements, slowest first.
+
+        :param get_current_user: Function to acquire and verify the current user.
+        :type get_current_user: Callable
+        :return: Router containing the admin route.
+        :rtype: APIRouter
+        """
+        router = APIRouter(tags=["admin"])
+
+        @router.get(self.route)
+        def slow_queries(limit: int = 20, current_user=Depends(get_current_user)):
+            if current_user.email not in self.admin_users:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Slow queries are only available to admin users",
+                )
+            with self.lock:
+                records = list(self.records)
+            records.sort(key=lambda record: record["duration"], reverse=True)
+            return records[:limit]
+
+        return router
@@ -0,0 +1,252 @@
+"""Module containing the change subscriptions of tables.
+Clients subscribe to a table with server-sent events and receive an event for every entry
+posted, put or deleted through the generated routes, once the write is committed.
+Rows of bulk uploads and jobs are sent once their transaction or chunk is committed.
+Events are fanned out by a broker per process,
+a bus carries them between the workers of apifactory serve.
+"""
+import asyncio
+import json
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+from fastapi.encoders import jsonable_encoder
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+Deliver = Callable[[dict], None]
+
+
+class LocalBus:
+    """Bus delivering events to the subscribers of the current process only.
+    Enough for a single worker, and a stand-in for cross worker buses in tests.
+    """
+
+    def __init__(self) -> None:
+        self.deliver: Optional[Deliver] = None
+
+    def start(self, deliver: Deliver) -> None:
+        """Starts delivering published events to deliver."""
+        self.deliver = deliver
+
+    def publish(self, event: dict) -> None:
+        """Publishes an event to the subscribers of all workers."""
+        if self.deliver:
+            self.deliver(event)
+
+    def close(self) -> None:
+        """Stops delivering events."""
+        self.deliver = None
+
+
+class RedisBus:
+    # pylint: disable=C0301
+    """Bus carrying events between workers and hosts over redis publish/subscribe.
+    Requires redis, installed with the redis extra.
+
+    :param url: Redis url, for example redis://localhost:6379.
+    :type url: str
+    :param channel: Redis channel of the events, defaults to "apifactory-events"
+    :type channel: str, optional
+    """
+    # pylint: enable=C0301
+
+    def __init__(self, url: str, channel: str = "apifactory-events") -> None:
+        if redis is None:
+            raise ImportError("The redis bus requires redis, install apifactory[redis]")
+        self.url = url
+        self.channel = channel
+        self.client = None
+        self.pubsub = None
+        self.thread = None
+
+    def start(self, deliver: Deliver) -> None:
+        """Connects and delivers the events of the channel from a listener thread.
+        Run after forking.
+        """
+        self.client = redis.Redis.from_url(self.url)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(
+            **{self.channel: lambda message: deliver(json.loads(message["data"]))}
+        )
+        self.thread = self.pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def publish(self, event: dict) -> None:
+        """Publishes an event to the subscribers of all workers."""
+        self.client.publish(self.channel, json.dumps(event))
+
+    def close(self) -> None:
+        """Stops the listener thread and closes the connections."""
+        if self.thread:
+            self.thread.stop()
+            self.pubsub.close()
+            self.client.close()
+
+
+def create_bus(bus) -> object:
+    """Bus from the bus option.
+    local for None, a redis url or an object with start, publish and close.
+    """
+    if bus is None or bus == "local":
+        return LocalBus()
+    if isinstance(bus, str):
+        if bus.startswith(("redis://", "rediss://", "unix://")):
+            return RedisBus(bus)
+        raise ValueError(f"Unknown bus {bus}, use local or a redis url")
+    return bus
+
+
+class Subscriber:
+    """Queue of the events of a single subscription, filled from any thread.
+
+    :param table: Name of the table.
+    :type table: str
+    :param filters: Column values the entries of the events must have.
+    :type filters: Dict[str, str]
+    :param max_queue: Events kept for a subscriber that does not keep up.
+    :type max_queue: int
+    """
+
+    def __init__(self, table: str, filters: Dict[str, str], max_queue: int) -> None:
+        self.table = table
+        self.filters = filters
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+
+    def matches(self, event: dict) -> bool:
+        """Whether an event is for this subscriber, deletes match any filter."""
+        entry = event.get("entry")
+        if entry is None:
+            return True
+        return all(
+            str(entry.get(column)) == value for column, value in self.filters.items()
+        )
+
+    def put(self, event: Optional[dict]) -> None:
+        """Queues an event on the loop of the subscriber.
+        A subscriber that fell behind gets None instead, ending its stream.
+        """
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = None
+        self.queue.put_nowait(event)
+
+
+class Subscriptions:
+    # pylint: disable=C0301
+    """Broker fanning out the events of committed writes to the subscribers of a table.
+
+    :param bus: local, a redis url, or an object with start, publish and close methods, defaults to None, local
+    :type bus: optional
+    :param heartbeat: Seconds between keep alive comments of idle streams, defaults to 15
+    :type heartbeat: float, optional
+    :param max_queue: Events kept per subscriber, subscribers falling further behind are disconnected, defaults to 1000
+    :type max_queue: int, optional
+
+
+    >>> subscriptions = Subscriptions(bus="redis://localhost:6379")
+    >>> subscriptions.publish("test_table", "insert", 1, {"primarykey": 1})
+    """
+    # pylint: enable=C0301
+
+    def __init__(self, bus=None, heartbeat: float = 15, max_queue: int = 1000) -> None:
+        self.bus = create_bus(bus)
+        self.heartbeat = heartbeat
+        self.max_queue = max_queue
+        self.subscribers: Dict[str, Set[Subscriber]] = {}
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self) -> None:
+        """Starts the bus, on the first use in a process, so forked workers connect on their own."""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        self.bus.start(self.deliver)
+
+    def close(self) -> None:
+        """Stops the bus, run when the app shuts down."""
+        with self.lock:
+            started, self.started = self.started, False
+        if started:
+            self.bus.close()
+
+    def publish(self, table: str, operation: str, key=None, entry=None) -> None:
+        # pylint: disable=C0301
+        """Publishes the event of a committed write.
+
+        :param table: Name of the table.
+        :type table: str
+        :param operation: insert, update or delete.
+        :type operation: str
+        :param key: Primary key of the entry, defaults to None
+        :param entry: Column values of inserted and updated entries, defaults to None
+        :type entry: Optional[dict], optional
+        """
+        # pylint: enable=C0301
+        self.start()
+        event = {"table": table, "operation": operation, "key": key, "entry": entry}
+        self.bus.publish(jsonable_encoder(event))
+
+    def deliver(self, event: dict) -> None:
+        """Queues an event from the bus for the matching subscribers of its table."""
+        with self.lock:
+            subscribers = list(self.subscribers.get(event["table"], ()))
+        for subscriber in subscribers:
+            if not subscriber.matches(event):
+                continue
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.put, event)
+            except RuntimeError:
+                # the loop of the subscriber was closed
+                self.unsubscribe(subscriber)
+
+    def subscribe(self, table: str, filters: Dict[str, str]) -> Subscriber:
+        """Registers a subscriber of a table, call from the event loop serving it."""
+        self.start()
+        subscriber = Subscriber(table, filters, self.max_queue)
+        with self.lock:
+            self.subscribers.setdefault(table, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """Removes a subscriber."""
+        with self.lock:
+            self.subscribers.get(subscriber.table, set()).discard(subscriber)
+
+    async def stream(
+        self, subscriber: Subscriber, is_disconnected: Callable[[], Awaitable[bool]]
+    ) -> AsyncIterator[str]:
+        # pylint: disable=C0301
+        """Server-sent events of a subscriber, with keep alive comments while idle.
+        The stream ends when the client disconnects or when the subscriber fell behind, after an overflow event.
+
+        :param subscriber: Subscriber registered with subscribe.
+        :type subscriber: Subscriber
+        :param is_disconnected: Coroutine function telling whether the client disconnected, like Request.is_disconnected.
+        :type is_disconnected: Callable[[], Awaitable[bool]]
+        :yield: Events in the text/event-stream format.
+        :rtype: AsyncIterator[str]
+        """
+        # pylint: enable=C0301
+        try:
+            yield ": subscribed\n\n"
+            while not await is_disconnected():
+                try:
+                    event = await asyncio.wait_for(
+                        subscriber.queue.get(), self.heartbeat
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    yield "event: overflow\ndata: {}\n\n"
+                    return
+                yield f"event: {event['operation']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,323 @@
+"""Module containing statement timeouts for the generated endpoints.
+Timeouts are applied with the mechanism of the database dialect:
+SET LOCAL statement_timeout for postgresql, a progress handler for sqlite
+and the query timeout of the connection for mssql (pyodbc).
+Other dialects and drivers cannot enforce timeouts per request,
+configuring a timeout for them is an error.
+Statements of a request are cancelled when the client disconnects.
+"""
+# the signatures of the listeners and exception handlers are given by sqlalchemy and starlette
+# pylint: disable=W0613
+import asyncio
+import math
+import time
+from typing import Callable, Iterable, Optional
+
+from fastapi import Depends, Request, status
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from apifactory.utils import config_for_method
+
+GUARD_KEY = "apifactory_statement_guard"
+# dialects able to enforce a timeout per request, with the drivers supported for each
+TIMEOUT_DRIVERS = {"postgresql": None, "sqlite": None, "mssql": ("pyodbc",)}
+
+
+def enforces_timeouts(engine: Engine) -> bool:
+    """Whether statement timeouts can be applied to the connections of an engine.
+    pymssql only offers a query timeout shared by all connections of the process.
+    """
+    dialect = engine.dialect
+    if dialect.name not in TIMEOUT_DRIVERS:
+        return False
+    drivers = TIMEOUT_DRIVERS[dialect.name]
+    return drivers is None or dialect.driver in drivers
+
+
+class StatementTimeoutError(Exception):
+    """Exception raised when a statement exceeds its statement timeout."""
+
+
+class StatementCancelledError(Exception):
+    """Exception raised when a statement is cancelled because the client disconnected."""
+
+
+class StatementGuard:
+    """Applies the statement timeout of a single request to the connections of its session.
+    Connections refer to the guard in their info dictionary until they are returned to the pool.
+
+    :param timeout: Statement timeout in seconds, None for no timeout.
+    :type timeout: Optional[float]
+    """
+
+    def __init__(self, timeout: Optional[float]) -> None:
+        self.timeout = timeout
+        self.cancelled = False
+        self.started: Optional[float] = None
+        self.dbapi_connection = None
+        self.dialect: Optional[str] = None
+
+    def attach(self, session, transaction, connection) -> None:
+        """Session after_begin listener, applying the timeout to the connection."""
+        connection.info[GUARD_KEY] = self
+        self.dialect = connection.dialect.name
+        self.dbapi_connection = connection.connection
+        if self.dialect == "postgresql" and self.timeout:
+            connection.exec_driver_sql(
+                f"SET LOCAL statement_timeout = {int(self.timeout * 1000)}"
+            )
+        elif self.dialect == "sqlite":
+            self.dbapi_connection.set_progress_handler(self.progress, 1000)
+        elif self.dialect == "mssql" and self.timeout:
+            if hasattr(self.dbapi_connection, "timeout"):
+                self.dbapi_connection.timeout = max(math.ceil(self.timeout), 1)
+
+    def detach(self, dbapi_connection) -> None:
+        """Removes the timeout from a connection returned to the pool."""
+        if self.dialect == "sqlite":
+            dbapi_connection.set_progress_handler(None, 0)
+        elif self.dialect == "mssql" and hasattr(dbapi_connection, "timeout"):
+            dbapi_connection.timeout = 0
+        self.started = None
+
+    def expired(self) -> bool:
+        """Whether the running statement exceeded the timeout."""
+        return bool(
+            self.timeout
+            and self.started is not None
+            and time.monotonic() - self.started >= self.timeout
+        )
+
+    def progress(self) -> int:
+        """sqlite progress handler, a non zero return value interrupts the statement."""
+        return int(self.cancelled or self.expired())
+
+    def cancel(self) -> None:
+        """Cancels the running statement of the request."""
+        self.cancelled = True
+        if self.started is not None and self.dialect == "postgresql":
+            self.dbapi_connection.cancel()
+
+
+def statement_start(conn, cursor, statement, parameters, context, executemany):
+    """Engine before_cursor_execute listener, starting the timeout of a statement."""
+    guard = conn.info.get(GUARD_KEY)
+    if guard:
+        guard.started = time.monotonic()
+
+
+def statement_end(conn, cursor, statement, parameters, context, executemany):
+    """Engine after_cursor_execute listener, stopping the timeout of a statement."""
+    guard = conn.info.get(GUARD_KEY)
+    if guard:
+        guard.started = None
+
+
+def statement_error(context) -> None:
+    """Engine handle_error listener, raising errors for timed out or cancelled statements."""
+    guard = context.connection.info.get(GUARD_KEY) if context.connection else None
+    if not guard:
+        return
+    if guard.cancelled:
+        guard.started = None
+        raise StatementCancelledError(
+            "Statement cancelled, client disconnected"
+        ) from context.original_exception
+    if guard.expired():
+        guard.started = None
+        raise StatementTimeoutError(
+            f"Statement exceeded timeout of {guard.timeout} seconds"
+        ) from context.original_exception
+
+
+def connection_checkin(dbapi_connection, connection_record) -> None:
+    """Pool checkin listener, removing the guard from connections returned to the pool."""
+    guard = connection_record.info.pop(GUARD_KEY, None)
+    if guard and dbapi_connection is not None:
+        guard.detach(dbapi_connection)
+
+
+class DisconnectWatcher:
+    # pylint: disable=C0301
+    """Watches a request for the disconnect of its client without taking messages of the body from the route handler.
+    Receiving is wrapped: body messages received by the watcher are passed on to the handler,
+    and the watcher reads at most one message ahead of a handler streaming the body.
+
+    :param request: Request to watch, its receive channel is wrapped immediately.
+    :type request: Request
+    """
+    # pylint: enable=C0301
+
+    def __init__(self, request: Request) -> None:
+        self.receive = request._receive  # pylint: disable=W0212
+        # FastAPI reads bodies before solving the dependencies, except for streamed bodies
+        self.body_read = hasattr(request, "_body") or getattr(
+            request, "_stream_consumed", False
+        )
+        self.pending: list = []
+        self.drained = asyncio.Event()
+        self.disconnected = asyncio.Event()
+        self.lock = asyncio.Lock()
+        request._receive = self.watched_receive  # pylint: disable=W0212
+
+    def inspect(self, message: dict) -> None:
+        """Notes disconnects and the end of the body."""
+        if message["type"] == "http.disconnect":
+            self.disconnected.set()
+        elif not message.get("more_body", False):
+            self.body_read = True
+
+    def take_pending(self) -> dict:
+        """First message received by the watcher for the route handler."""
+        message = self.pending.pop(0)
+        if not self.pending:
+            self.drained.set()
+        return message
+
+    async def watched_receive(self) -> dict:
+        """Receive channel of the request, returning the messages received by the watcher first."""
+        if self.pending:
+            return self.take_pending()
+        async with self.lock:
+            # the watcher may have received the next message in the meantime
+            if self.pending:
+                return self.take_pending()
+            if self.disconnected.is_set():
+                return {"type": "http.disconnect"}
+            message = await self.receive()
+        self.inspect(message)
+        return message
+
+    async def watch(self, guard: StatementGuard) -> None:
+        """Cancels the statements of the guard once the client disconnects.
+
+        :param guard: Guard of the session of the request.
+        :type guard: StatementGuard
+        """
+        while not self.disconnected.is_set():
+            if self.pending and not self.body_read:
+                # the handler streams the body, wait until it took the message read ahead
+                self.drained.clear()
+                await self.drained.wait()
+                continue
+            async with self.lock:
+                message = await self.receive()
+            self.inspect(message)
+            if message["type"] != "http.disconnect":
+                self.pending.append(message)
+        guard.cancel()
+
+
+class StatementTimeouts:
+    # pylint: disable=C0301
+    """Creates session helpers applying statement timeouts and cancelling statements of disconnected clients.
+    Timeouts are read from the router configuration of a table with the statement_timeout key.
+    Either a single timeout in seconds or a dictionary with timeouts per method.
+
+    :param engines: Engines to install the statement listeners on once a session is guarded.
+    :type engines: Iterable[Engine]
+    :param default_timeout: Timeout in seconds for tables without a timeout of their own, defaults to None
+    :type default_timeout: Optional[float], optional
+    :param cancel_on_disconnect: Whether to cancel statements when the client disconnects, defaults to False
+    :type cancel_on_disconnect: bool, optional
+    :raises ValueError: Raises an error for a default timeout on an engine that cannot enforce it, see enforces_timeouts.
+
+
+    >>> config = {"test_table": {"statement_timeout": {"default": 5, "get": 30}}}
+    """
+    # pylint: enable=C0301
+
+    def __init__(
+        self,
+        engines: Iterable[Engine],
+        default_timeout: Optional[float] = None,
+        cancel_on_disconnect: bool = False,
+    ) -> None:
+        self.engines = list(engines)
+        self.default_timeout = default_timeout
+        self.cancel_on_disconnect = cancel_on_disconnect
+        if default_timeout:
+            self.check_engines()
+
+    def check_engines(self) -> None:
+        """Raises a ValueError if an engine cannot enforce statement timeouts."""
+        for engine in self.engines:
+            if not enforces_timeouts(engine):
+                dialect = engine.dialect
+                raise ValueError(
+                    f"Statement timeouts are not supported for {dialect.name}+{dialect.driver},"
+                    " supported are postgresql, sqlite and mssql+pyodbc"
+                )
+
+    @staticmethod
+    def install(engine: Engine) -> None:
+        """Installs the statement listeners on an engine and its pool.
+
+        :param engine: Engine to install the listeners on.
+        :type engine: Engine
+        """
+        listeners = (
+            ("before_cursor_execute", statement_start),
+            ("after_cursor_execute", statement_end),
+            ("handle_error", statement_error),
+            ("checkin", connection_checkin),
+        )
+        for name, listener in listeners:
+            if not event.contains(engine, name, listener):
+                event.listen(engine, name, listener)
+
+    def session_getter(
+        self, get_db: Callable, modelconfig: dict, method: str
+    ) -> Callable:
+        # pylint: disable=C0301
+        """Wraps a session helper so the sessions it yields apply the timeout of the method.
+
+        :param get_db: Function to acquire a database session.
+        :type get_db: Callable
+        :param modelconfig: Configuration for the endpoints of the table.
+        :type modelconfig: dict
+        :param method: Name of the method (get, get_id, post, put, delete) to look up in the configuration.
+        :type method: str
+        :return: Function to acquire a guarded database session, get_db if there is nothing to guard.
+        :rtype: Callable
+        """
+        # pylint: enable=C0301
+        timeout = config_for_method(
+            modelconfig, "statement_timeout", method, self.default_timeout
+        )
+        if not timeout and not self.cancel_on_disconnect:
+            return get_db
+        if timeout:
+            self.check_engines()
+        for engine in self.engines:
+            self.install(engine)
+
+        async def get_guarded_db(request: Request, db: Session = Depends(get_db)):
+            guard = StatementGuard(timeout)
+            event.listen(db, "after_begin", guard.attach)
+            watcher = None
+            if self.cancel_on_disconnect:
+                watcher = asyncio.ensure_future(DisconnectWatcher(request).watch(guard))
+            try:
+                yield db
+            finally:
+                if watcher:
+                    watcher.cancel()
+
+        return get_guarded_db
+
+
+async def statement_timeout_handler(request: Request, exc: Exception) -> JSONResponse:
+    """Exception handler returning a http 504 error for timed out statements."""
+    return JSONResponse(
+        {"detail": str(exc)}, status_code=status.HTTP_504_GATEWAY_TIMEOUT
+    )
+
+
+async def statement_cancelled_handler(request: Request, exc: Exception) -> JSONResponse:
+    """Exception handler for statements cancelled because the client disconnected."""
+    # 499 client closed request, nobody is left to read the response
+    return JSONResponse({"detail": str(exc)}, status_code=499)
@@ -2,12 +2,15 @@
 
 """
 # pylint: disable=E0611
-from typing import Type, Callable
-from functools import singledispatch
+from typing import List, Tuple, Type, Callable
+from functools import partial, singledispatch
 
 from fastapi import HTTPException, status, FastAPI
 from pydantic import BaseModel
 from sqlalchemy import Table
+from sqlalchemy.orm import Session
+
+from apifactory.routing import LazyRoute
 
 
 class PrimaryKeyAmountError(Exception):
@@ -59,6 +62,31 @@ def param_invalid(model: str, parameter: str):
     )
 
 
+def column_filters(model: Table, query_params, reserved=()) -> list:
+    # pylint: disable=C0301
+    """Converts the query parameters of a request into filters on the columns of a table.
+
+    :param model: SQLalchemy model of the table to filter.
+    :type model: Table
+    :param query_params: Query parameters of the request.
+    :type query_params: Mapping[str, str]
+    :param reserved: Parameters that are not filters, for example paging parameters, defaults to ()
+    :type reserved: Collection[str], optional
+    :raises HTTPException: Raises http 400 error for parameters that are not columns of the table.
+    :return: Conditions to pass to filter.
+    :rtype: list
+    """
+    # pylint: enable=C0301
+    conditions = []
+    for param, value in query_params.items():
+        if param in reserved:
+            continue
+        if not hasattr(model, param):
+            param_invalid(model, param)
+        conditions.append(getattr(model, param) == value)
+    return conditions
+
+
 def primary_key_checker(model: Table):
     """checks the amount of primary key columns if amount > 1 raise PrimaryKeyAmountError.
     Otherwise return primary key name and the column object
@@ -78,6 +106,29 @@ def primary_key_checker(model: Table):
     return key_name, column
 
 
+def upsert_entry(db: Session, model: Table, primary_key, content: dict) -> str:
+    """Updates the entry with the primary key, inserting it when it does not exist.
+
+    :param db: Database session.
+    :type db: Session
+    :param model: SQLalchemy model of the table.
+    :type model: Table
+    :param primary_key: Value of the primary key of the entry.
+    :param content: Column values of the entry, the primary key is added for inserts.
+    :type content: dict
+    :return: The executed operation, insert or update.
+    :rtype: str
+    """
+    primary_key_col, column = primary_key_checker(model)
+    db_item = db.query(model).filter(column == primary_key)
+    if not db_item.first():
+        content[primary_key_col] = primary_key
+        db.add(model(**content))
+        return "insert"
+    db_item.update(content)
+    return "update"
+
+
 def model_with_optional_fields(model: Type[BaseModel]) -> Type[BaseModel]:
     """Generate a `BaseModel` class with
     all the same fields as `model` but as optional
@@ -114,6 +165,72 @@ def exclude_columns(request: dict, excluded_columns: list) -> dict:
     return {i: j for i, j in request.items() if i not in excluded_columns}
 
 
+def with_dependencies(method_kwargs: dict, dependencies: list) -> dict:
+    """Adds route dependencies to the key word arguments of a router method.
+    Dependencies already present in method_kwargs are kept.
+
+    :param method_kwargs: Key word arguments to add to the router method.
+    :type method_kwargs: dict
+    :param dependencies: Dependencies to add to the route.
+    :type dependencies: list
+    :return: Copy of method_kwargs containing the added dependencies.
+    :rtype: dict
+    """
+    if not dependencies:
+        return method_kwargs
+    return method_kwargs | {
+        "dependencies": [*method_kwargs.get("dependencies", []), *dependencies]
+    }
+
+
+def config_for_method(modelconfig: dict, key: str, method: str, default=None):
+    # pylint: disable=C0301
+    """Looks up a configuration option that can be set for a whole table or per method.
+    The option is either a single value or a dictionary with values per method and a default entry.
+
+    :param modelconfig: Configuration for the endpoints of the table.
+    :type modelconfig: dict
+    :param key: Name of the configuration option.
+    :type key: str
+    :param method: Name of the method (get, get_id, post, put, delete).
+    :type method: str
+    :param default: Value to return if neither the method nor the table configure the option, defaults to None
+    :type default: Any, optional
+    :return: Configured value for the method.
+    :rtype: Any
+    """
+    # pylint: enable=C0301
+    value = modelconfig.get(key)
+    if isinstance(value, dict):
+        value = value.get(method, value.get("default"))
+    return default if value is None else value
+
+
+def quality_values(header: str) -> List[Tuple[str, float]]:
+    """Parses a header with quality values, like Accept or Accept-Encoding.
+
+    :param header: Value of the header.
+    :type header: str
+    :return: Lower cased values with their quality, in the order of the header.
+    :rtype: List[Tuple[str, float]]
+    """
+    values = []
+    for part in header.split(","):
+        value, *params = (item.strip() for item in part.split(";"))
+        if not value:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        values.append((value.lower(), quality))
+    return values
+
+
 def add_routes(routers, app: FastAPI) -> FastAPI:
     """Function that adds all routers from a Routers class to a FastAPI app.
 
@@ -123,8 +240,19 @@ def add_routes(routers, app: FastAPI) -> FastAPI:
     :type app: FastAPI
     :return: FastAPI app instance with added routers.
     :rtype: FastAPI
+
+    Routers created in lazy mode are added as lazy routes,
+    creating the routes of a table on its first request.
     """
 
+    if getattr(routers, "lazy", False):
+        for router_name in sorted(routers.router_names):
+            app.router.routes.append(
+                LazyRoute(
+                    app, f"/{router_name}", partial(routers.materialize, router_name)
+                )
+            )
+        return app
     for router_name in routers.router_names:
         app.include_router(getattr(routers, router_name))
     return app
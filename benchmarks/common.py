@@ -0,0 +1,176 @@
+"""Helpers shared by the benchmarks: synthetic databases and reporting.
+"""
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+from typing import Optional
+
+from apifactory.app_factory import ApiFactory
+from apifactory.security import Hash
+
+USER = "bench@apifactory"
+PASSWORD = "bench"
+JWT_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
+CATEGORIES = 10
+
+
+def create_database(
+    path: str,
+    rows: int,
+    columns: int = 5,
+    width: int = 20,
+    tables: int = 1,
+    vary_columns: bool = False,
+) -> str:
+    # pylint: disable=C0301
+    """Creates a sqlite database with synthetic tables and a user to log in with.
+    Tables are named bench (bench_1, bench_2, ... for further tables) and contain an integer primary key,
+    an indexed category column and text columns col_0, col_1, ... of the given width.
+
+    :param path: Path of the database file, an existing file is replaced.
+    :type path: str
+    :param rows: Amount of rows per table.
+    :type rows: int
+    :param columns: Amount of text columns per table, defaults to 5
+    :type columns: int, optional
+    :param width: Amount of characters per text value, defaults to 20
+    :type width: int, optional
+    :param tables: Amount of tables, defaults to 1
+    :type tables: int, optional
+    :param vary_columns: Give tables 1 up to columns text columns instead of columns each, defaults to False
+    :type vary_columns: bool, optional
+    :return: Connection string of the database.
+    :rtype: str
+    """
+    # pylint: enable=C0301
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    connection.execute(
+        'CREATE TABLE "Users" ("id" TEXT PRIMARY KEY, "Name" TEXT, "Email" TEXT, "Password" TEXT)'
+    )
+    connection.execute(
+        'INSERT INTO "Users" VALUES (?, ?, ?, ?)',
+        ("0", "bench", USER, Hash().hash(PASSWORD)),
+    )
+    for table_number in range(tables):
+        table_columns = table_number % columns + 1 if vary_columns else columns
+        text_columns = [f"col_{number}" for number in range(table_columns)]
+        table = "bench" if table_number == 0 else f"bench_{table_number}"
+        definitions = ", ".join(f'"{column}" TEXT' for column in text_columns)
+        connection.execute(
+            f'CREATE TABLE "{table}" ("id" INTEGER PRIMARY KEY, "category" INTEGER, {definitions})'
+        )
+        connection.execute(
+            f'CREATE INDEX "ix_{table}_category" ON "{table}" ("category")'
+        )
+        placeholders = ", ".join("?" for _ in range(table_columns + 2))
+        connection.executemany(
+            f'INSERT INTO "{table}" VALUES ({placeholders})',
+            (
+                (
+                    key,
+                    key % CATEGORIES,
+                    *(str(key).rjust(width, "x") for _ in text_columns),
+                )
+                for key in range(rows)
+            ),
+        )
+    connection.commit()
+    connection.close()
+    return f"sqlite:///{path}"
+
+
+def create_factory(database_url: str, **kwargs) -> ApiFactory:
+    """Creates an ApiFactory for a database of create_database, without table configuration.
+
+    :param database_url: Connection string of the database.
+    :type database_url: str
+    :return: The ApiFactory, further keyword arguments are passed to it.
+    :rtype: ApiFactory
+    """
+    return ApiFactory(
+        database_url=database_url,
+        usermodel_name="Users",
+        jwt_key=JWT_KEY,
+        config={},
+        **kwargs,
+    )
+
+
+def commit() -> Optional[str]:
+    """Returns the git commit of the working directory, None outside a git repository."""
+    try:
+        return (
+            subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                check=True,
+                text=True,
+            ).stdout.strip()
+            or None
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata(**settings) -> dict:
+    """Describes the environment and settings of a benchmark run."""
+    return {
+        "commit": commit(),
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        **settings,
+    }
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Returns the value below which the given fraction of the sorted values fall."""
+    if not values:
+        return 0.0
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def write_report(report: dict, output: Optional[str]) -> None:
+    """Writes a report as json to output, or to stdout without output."""
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf8") as report_file:
+            report_file.write(text + "\n")
+    else:
+        print(text)
+
+
+def compare(report: dict, baseline_file: str, key: str) -> None:
+    # pylint: disable=C0301
+    """Prints the change of a value of every result compared to a baseline report.
+
+    :param report: Report of the current run.
+    :type report: dict
+    :param baseline_file: Path of the json report to compare with.
+    :type baseline_file: str
+    :param key: Name of the value to compare, for example p50_ms.
+    :type key: str
+    """
+    # pylint: enable=C0301
+    with open(baseline_file, encoding="utf8") as report_file:
+        baseline = json.load(report_file)
+    print(
+        f"{'benchmark':<24}{'baseline':>12}{'current':>12}{'change':>10}",
+        file=sys.stderr,
+    )
+    for name, result in report["results"].items():
+        previous = baseline["results"].get(name, {}).get(key)
+        if not previous:
+            continue
+        change = (result[key] - previous) / previous * 100
+        print(
+            f"{name:<24}{previous:>12.3f}{result[key]:>12.3f}{change:>+9.1f}%",
+            file=sys.stderr,
+        )
@@ -0,0 +1,287 @@
+"""Benchmark of every type of generated endpoint.
+Builds a synthetic sqlite database, creates the app with ApiFactory
+and drives all routes in process.
+Reports throughput, latency percentiles and memory allocated per request as json.
+
+    python -m benchmarks.endpoints --rows 10000 --iterations 500 --output results.json
+    python -m benchmarks.endpoints --compare results.json
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Tuple
+
+from fastapi.testclient import TestClient
+
+from benchmarks.common import (
+    CATEGORIES,
+    PASSWORD,
+    USER,
+    compare,
+    create_database,
+    create_factory,
+    metadata,
+    percentile,
+    write_report,
+)
+
+Request = Tuple[str, str, dict]
+
+
+class Scenarios:
+    # pylint: disable=C0301
+    """Requests of every generated endpoint type.
+    Every scenario returns the method, url and keyword arguments of its request for an iteration.
+    Rows created by post and bulk post are removed again by delete and bulk delete.
+
+    :param rows: Amount of rows in the synthetic table.
+    :type rows: int
+    :param columns: Amount of text columns in the synthetic table.
+    :type columns: int
+    :param batch: Amount of rows per bulk request.
+    :type batch: int
+    """
+    # pylint: enable=C0301
+
+    def __init__(self, rows: int, columns: int, batch: int) -> None:
+        self.rows = rows
+        self.columns = columns
+        self.batch = batch
+
+    def row(self, key: int, value: str = "benchmark") -> dict:
+        """Content of a row of the synthetic table."""
+        content = {"id": key, "category": key % CATEGORIES}
+        content.update({f"col_{number}": value for number in range(self.columns)})
+        return content
+
+    def new_key(self, iteration: int, offset: int = 0) -> int:
+        """Primary key beyond the synthetic rows, unique per iteration."""
+        return self.rows + offset + iteration
+
+    def get_all(self, iteration: int) -> Request:
+        page = iteration % max(self.rows // 50, 1) + 1
+        return "GET", f"/bench/?page={page}&size=50", {}
+
+    def get_all_filtered(self, iteration: int) -> Request:
+        return "GET", f"/bench/?category={iteration % CATEGORIES}&size=50", {}
+
+    def get_id(self, iteration: int) -> Request:
+        return "GET", f"/bench/{iteration * 7919 % self.rows}", {}
+
+    def put(self, iteration: int) -> Request:
+        key = iteration * 7919 % self.rows
+        return "PUT", f"/bench/{key}", {"json": self.row(key, "put")}
+
+    def put_many(self, iteration: int) -> Request:
+        keys = (
+            (iteration * self.batch + number) % self.rows
+            for number in range(self.batch)
+        )
+        return "PUT", "/bench/", {"json": [self.row(key, "put") for key in keys]}
+
+    def post(self, iteration: int) -> Request:
+        return "POST", "/bench/", {"json": self.row(self.new_key(iteration))}
+
+    def delete(self, iteration: int) -> Request:
+        return "DELETE", f"/bench/{self.new_key(iteration)}", {}
+
+    def post_bulk(self, iteration: int) -> Request:
+        offset = self.rows * 2
+        keys = range(
+            self.new_key(iteration * self.batch, offset),
+            self.new_key((iteration + 1) * self.batch, offset),
+        )
+        return "POST", "/bench/", {"json": [self.row(key) for key in keys]}
+
+    def delete_many(self, iteration: int) -> Request:
+        offset = self.rows * 2
+        keys = range(
+            self.new_key(iteration * self.batch, offset),
+            self.new_key((iteration + 1) * self.batch, offset),
+        )
+        return "DELETE", "/bench/", {"json": [{"id": key} for key in keys]}
+
+    def all(self) -> Dict[str, Callable[[int], Request]]:
+        """Scenarios in the order they run, deletes run after the posts creating their rows."""
+        return {
+            "get_all": self.get_all,
+            "get_all_filtered": self.get_all_filtered,
+            "get_id": self.get_id,
+            "put": self.put,
+            "put_many": self.put_many,
+            "post": self.post,
+            "delete": self.delete,
+            "post_bulk": self.post_bulk,
+            "delete_many": self.delete_many,
+        }
+
+
+def login(client: TestClient) -> dict:
+    """Logs in as the benchmark user and returns the authorization headers."""
+    response = client.post(
+        "/login",
+        data={"username": USER, "password": PASSWORD},
+    )
+    response.raise_for_status()
+    return {"Authorization": f"bearer {response.json()['access_token']}"}
+
+
+def run_scenario(
+    client: TestClient,
+    headers: dict,
+    scenario: Callable[[int], Request],
+    iterations: int,
+    start: int,
+    trace_allocations: bool,
+) -> dict:
+    # pylint: disable=C0301
+    """Runs the requests of a scenario, measuring the latency or the allocations of each request.
+
+    :param client: Client of the app.
+    :type client: TestClient
+    :param headers: Authorization headers.
+    :type headers: dict
+    :param scenario: Function returning the request of an iteration.
+    :type scenario: Callable[[int], Request]
+    :param iterations: Amount of requests.
+    :type iterations: int
+    :param start: Iteration to start at, so repeated runs do not reuse keys.
+    :type start: int
+    :param trace_allocations: Whether to trace allocations instead of measuring latency.
+    :type trace_allocations: bool
+    :return: Latencies in seconds or allocated bytes per request, and the amount of failed requests.
+    :rtype: dict
+    """
+    # pylint: enable=C0301
+    measurements = []
+    errors = 0
+    for iteration in range(start, start + iterations):
+        method, url, kwargs = scenario(iteration)
+        if trace_allocations:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            response = client.request(method, url, headers=headers, **kwargs)
+            measurements.append(tracemalloc.get_traced_memory()[1] - baseline)
+        else:
+            started = time.perf_counter()
+            response = client.request(method, url, headers=headers, **kwargs)
+            measurements.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            errors += 1
+    return {"measurements": measurements, "errors": errors}
+
+
+def summarize(latencies: list, allocations: list, errors: int) -> dict:
+    """Summarizes the measurements of a scenario."""
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / total, 2) if total else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "peak_alloc_kib": round(statistics.fmean(allocations) / 1024, 2)
+        if allocations
+        else None,
+    }
+
+
+def benchmark(args: argparse.Namespace) -> dict:
+    """Runs all scenarios and returns the report."""
+    directory = tempfile.mkdtemp(prefix="apifactory-bench-")
+    database_url = create_database(
+        os.path.join(directory, "bench.db"), args.rows, args.columns, args.width
+    )
+    factory = create_factory(
+        database_url,
+        engine_kwargs={"connect_args": {"check_same_thread": False}},
+    )
+    client = TestClient(factory.app_factory())
+    headers = login(client)
+    scenarios = Scenarios(args.rows, args.columns, args.batch)
+    selected = args.scenario or list(scenarios.all())
+    results = {}
+    for name, scenario in scenarios.all().items():
+        if name not in selected:
+            continue
+        print(f"running {name}", file=sys.stderr)
+        # every pass uses new iterations, so posted keys never collide
+        start = 0
+        run_scenario(client, headers, scenario, args.warmup, start, False)
+        start += args.warmup
+        timed = run_scenario(client, headers, scenario, args.iterations, start, False)
+        start += args.iterations
+        allocations = []
+        errors = timed["errors"]
+        if args.allocations:
+            tracemalloc.start()
+            traced = run_scenario(
+                client, headers, scenario, args.allocations, start, True
+            )
+            tracemalloc.stop()
+            allocations = traced["measurements"]
+            errors += traced["errors"]
+        results[name] = summarize(timed["measurements"], allocations, errors)
+    return {
+        "benchmark": "endpoints",
+        "meta": metadata(
+            rows=args.rows,
+            columns=args.columns,
+            width=args.width,
+            batch=args.batch,
+            iterations=args.iterations,
+            warmup=args.warmup,
+        ),
+        "results": results,
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parses the command line arguments of the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000, help="rows in the table")
+    parser.add_argument(
+        "--columns", type=int, default=5, help="text columns in the table"
+    )
+    parser.add_argument(
+        "--width", type=int, default=20, help="characters per text value"
+    )
+    parser.add_argument("--batch", type=int, default=50, help="rows per bulk request")
+    parser.add_argument(
+        "--iterations", type=int, default=200, help="timed requests per scenario"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=20, help="untimed requests per scenario"
+    )
+    parser.add_argument(
+        "--allocations",
+        type=int,
+        default=20,
+        help="requests per scenario traced for allocations, 0 to skip",
+    )
+    parser.add_argument(
+        "--scenario", action="append", help="scenario to run, can be repeated"
+    )
+    parser.add_argument("--output", help="file to write the json report to")
+    parser.add_argument("--compare", help="json report to compare p50 latency with")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    """Entry point of the benchmark."""
+    args = parse_args(argv)
+    report = benchmark(args)
+    write_report(report, args.output)
+    if args.compare:
+        compare(report, args.compare, "p50_ms")
+
+
+if __name__ == "__main__":
+    main()
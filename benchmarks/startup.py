@@ -0,0 +1,248 @@
+"""Benchmark of the startup of an app for growing schemas.
+Generates sqlite schemas with an increasing amount of tables of varying width
+and times every stage of creating the app: the database engine, Database.auto_create_models,
+Schemas, Routers.create_routers, the rest of ApiFactory.__init__, app_factory
+and the first app.openapi() call.
+Every schema size runs in a fresh process,
+the models of apifactory are shared by instances in a process.
+
+    python -m benchmarks.startup --tables 10 100 1000 5000 --output startup.json
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from apifactory.database import Database
+from apifactory.route_factory import Routers
+from apifactory.schemas import Schemas
+from benchmarks.common import create_database, create_factory, metadata, write_report
+
+STAGES = (
+    "database",
+    "auto_create_models",
+    "schemas",
+    "create_routers",
+    "init_other",
+    "app_factory",
+    "openapi",
+)
+
+
+class StageRecorder:
+    """Records the duration and memory of the stages of creating an app.
+
+    :param trace: Whether to trace memory with tracemalloc, defaults to False
+    :type trace: bool, optional
+    """
+
+    def __init__(self, trace: bool = False) -> None:
+        self.trace = trace
+        self.stages: dict = {}
+
+    @contextmanager
+    def measure(self, stage: str):
+        """Measures the code inside the context as a stage."""
+        if self.trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            result = self.stages.setdefault(stage, {"seconds": 0.0})
+            result["seconds"] += duration
+            if self.trace:
+                current, peak = tracemalloc.get_traced_memory()
+                result["retained_kib"] = round((current - before) / 1024, 1)
+                result["peak_kib"] = round((peak - before) / 1024, 1)
+
+
+RECORDER = StageRecorder()
+
+
+class TimedDatabase(Database):
+    """Database measuring its creation and the reflection of the models."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        with RECORDER.measure("database_init"):
+            super().__init__(*args, **kwargs)
+
+    def auto_create_models(self):
+        with RECORDER.measure("auto_create_models"):
+            return super().auto_create_models()
+
+
+class TimedSchemas(Schemas):
+    """Schemas measuring the creation of the pydantic schemas."""
+
+    def __init__(self, models, **kwargs) -> None:
+        with RECORDER.measure("schemas"):
+            super().__init__(models, **kwargs)
+
+
+class TimedRouters(Routers):
+    """Routers measuring the creation of the routers."""
+
+    def create_routers(self, *args, **kwargs):
+        with RECORDER.measure("create_routers"):
+            return super().create_routers(*args, **kwargs)
+
+
+def startup(database_url: str, trace: bool, lazy: bool = False) -> dict:
+    """Creates an app for the database, measuring every stage.
+
+    :param database_url: Connection string of the database.
+    :type database_url: str
+    :param trace: Whether to trace memory with tracemalloc.
+    :type trace: bool
+    :param lazy: Whether to create the schemas and routers of tables on first use, defaults to False
+    :type lazy: bool, optional
+    :return: Duration and memory per stage.
+    :rtype: dict
+    """
+    RECORDER.trace = trace
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    factory = create_factory(
+        database_url,
+        database=TimedDatabase,
+        schemas=TimedSchemas,
+        routers=TimedRouters,
+        lazy=lazy,
+    )
+    init_seconds = time.perf_counter() - started
+    with RECORDER.measure("app_factory"):
+        app = factory.app_factory()
+    with RECORDER.measure("openapi"):
+        app.openapi()
+    if trace:
+        tracemalloc.stop()
+    stages = RECORDER.stages
+    # Database.__init__ reflects the models, the database stage is the rest of it
+    database = stages.pop("database_init")
+    stages["database"] = {
+        "seconds": database["seconds"] - stages["auto_create_models"]["seconds"]
+    }
+    measured = ("database", "auto_create_models", "schemas", "create_routers")
+    stages["init_other"] = {
+        "seconds": init_seconds - sum(stages[stage]["seconds"] for stage in measured)
+    }
+    return {stage: stages[stage] for stage in STAGES if stage in stages}
+
+
+def run_size(database_url: str, trace: bool, lazy: bool) -> dict:
+    """Runs a startup in a fresh process."""
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(startup, (database_url, trace, lazy))
+
+
+def exponent(sizes: list, seconds: list) -> float:
+    """Growth exponent of a stage between the smallest and largest schema, 1 is linear."""
+    if len(sizes) < 2 or seconds[0] <= 0 or seconds[-1] <= 0:
+        return 0.0
+    return math.log(seconds[-1] / seconds[0]) / math.log(sizes[-1] / sizes[0])
+
+
+def benchmark(args: argparse.Namespace) -> dict:
+    """Runs the startup for all schema sizes and returns the report."""
+    directory = tempfile.mkdtemp(prefix="apifactory-startup-")
+    results = {}
+    for tables in args.tables:
+        print(f"creating schema with {tables} tables", file=sys.stderr)
+        database_url = create_database(
+            os.path.join(directory, f"startup-{tables}.db"),
+            args.rows,
+            columns=args.columns,
+            tables=tables,
+            vary_columns=True,
+        )
+        result = run_size(database_url, trace=False, lazy=args.lazy)
+        if args.memory:
+            traced = run_size(database_url, trace=True, lazy=args.lazy)
+            for stage, values in traced.items():
+                result[stage].update(
+                    {key: value for key, value in values.items() if key != "seconds"}
+                )
+        results[str(tables)] = result
+    sizes = [int(size) for size in results]
+    growth = {
+        stage: round(
+            exponent(sizes, [results[str(size)][stage]["seconds"] for size in sizes]), 3
+        )
+        for stage in STAGES
+    }
+    return {
+        "benchmark": "startup",
+        "meta": metadata(
+            tables=args.tables, columns=args.columns, rows=args.rows, lazy=args.lazy
+        ),
+        "results": results,
+        "growth_exponent": growth,
+        "worst_stage": max(growth, key=growth.get) if growth else None,
+    }
+
+
+def print_summary(report: dict) -> None:
+    """Prints the seconds per stage and size and the growth exponent of every stage."""
+    sizes = list(report["results"])
+    header = "".join(f"{size:>12}" for size in sizes)
+    print(f"{'stage':<20}{header}{'growth':>10}", file=sys.stderr)
+    for stage, growth in report["growth_exponent"].items():
+        seconds = "".join(
+            f"{report['results'][size][stage]['seconds']:>12.3f}" for size in sizes
+        )
+        marker = "  <- worst" if stage == report["worst_stage"] else ""
+        print(f"{stage:<20}{seconds}{growth:>10.2f}{marker}", file=sys.stderr)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parses the command line arguments of the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--tables",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 5000],
+        help="amounts of tables of the schemas",
+    )
+    parser.add_argument(
+        "--columns",
+        type=int,
+        default=20,
+        help="maximum amount of text columns per table",
+    )
+    parser.add_argument("--rows", type=int, default=0, help="rows per table")
+    parser.add_argument(
+        "--lazy",
+        action="store_true",
+        help="create the schemas and routers of tables on first use",
+    )
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="skip the pass tracing memory per stage",
+    )
+    parser.add_argument("--output", help="file to write the json report to")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    """Entry point of the benchmark."""
+    args = parse_args(argv)
+    report = benchmark(args)
+    print_summary(report)
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
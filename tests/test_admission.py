@@ -0,0 +1,144 @@
+"""tests for admission control of the generated routes
+"""
+import asyncio
+import os
+from types import SimpleNamespace
+
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+from apifactory.admission import ConcurrencyLimiter
+from apifactory.app_factory import ApiFactory
+from apifactory.routing import request_class
+
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_admission.yaml")
+app = ApiFactory.from_yaml(file_name).app_factory()
+
+
+client = TestClient(app)
+
+HEADER = {
+    "accept": "application/json",
+    "Content-Type": "application/x-www-form-urlencoded",
+}
+
+bearer_token = client.post(
+    "/login",
+    headers=HEADER,
+    data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+)
+token = bearer_token.json()["access_token"]
+
+header = {"accept": "application/json", "Authorization": f"bearer {token}"}
+
+
+def test_limiter_queue():
+    async def run():
+        limiter = ConcurrencyLimiter(1, queue=1, timeout=0.05)
+        assert await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        # queue is full, rejected without waiting
+        assert not await limiter.acquire()
+        limiter.release()
+        assert await waiting
+        # slot was handed over, next request times out in the queue
+        assert not await limiter.acquire()
+        limiter.release()
+        assert limiter.active == 0
+
+    asyncio.run(run())
+
+
+def test_shed_reads():
+    response = client.get("test_table/0", headers=header)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+
+def test_admit_writes():
+    response = client.delete("test_table/9000", headers=header)
+    assert response.status_code == 404
+
+
+def test_request_class_reads_body_prefix():
+    messages = [
+        {"type": "http.request", "body": b"  ", "more_body": True},
+        {"type": "http.request", "body": b'\n[{"primarykey": 1}', "more_body": True},
+        {"type": "http.request", "body": b', {"primarykey": 2}]', "more_body": False},
+    ]
+    received = []
+
+    async def receive():
+        received.append(messages[len(received)])
+        return received[-1]
+
+    async def run():
+        request = Request({"type": "http", "method": "POST", "headers": []}, receive)
+        kind = await request_class(SimpleNamespace(name="post"), request)
+        # classified without receiving the rest of the body
+        assert len(received) == 2
+        return kind, await request.body()
+
+    kind, body = asyncio.run(run())
+    assert kind == "bulk"
+    assert body == b'  \n[{"primarykey": 1}, {"primarykey": 2}]'
+
+
+def test_stream_holds_slot():
+    export_app = ApiFactory.from_yaml(
+        file_name, admission={"export": {"limit": 1}}, export=True
+    ).app_factory()
+
+    async def run():
+        # the stream is held open, so the app is called without the test client
+        started, finish = asyncio.Event(), asyncio.Event()
+
+        async def request(hold: bool) -> int:
+            scope = {
+                "type": "http",
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": "/test_table/export",
+                "raw_path": b"/test_table/export",
+                "root_path": "",
+                "query_string": b"",
+                "server": ("testserver", 80),
+                "client": ("testclient", 50000),
+                "headers": [
+                    (b"host", b"testserver"),
+                    (b"authorization", f"bearer {token}".encode()),
+                ],
+            }
+            statuses = []
+            requested = []
+
+            async def receive():
+                if not requested:
+                    requested.append(True)
+                    return {"type": "http.request", "body": b""}
+                # the client stays connected until the body is sent
+                await asyncio.Event().wait()
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    statuses.append(message["status"])
+                    if hold:
+                        started.set()
+                        await finish.wait()
+
+            await asyncio.wait_for(export_app(scope, receive, send), 5)
+            return statuses[0]
+
+        held = asyncio.ensure_future(request(hold=True))
+        await asyncio.wait_for(started.wait(), 5)
+        # the body of the first export is not sent yet
+        shed = await request(hold=False)
+        finish.set()
+        return await held, shed, await request(hold=False)
+
+    assert asyncio.run(run()) == (200, 503, 200)
@@ -0,0 +1,110 @@
+"""tests for the aggregate route
+"""
+import os
+import shutil
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apifactory.app_factory import ApiFactory
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_aggregate.yaml")
+
+
+@pytest.fixture
+def factory(tmp_path):
+    database = tmp_path / "aggregate.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), database)
+    factory = ApiFactory.from_yaml(file_name, database_url=f"sqlite:///{database}")
+    client = TestClient(factory.app_factory())
+    token = client.post(
+        "/login",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+    ).json()["access_token"]
+    header = {"Authorization": f"bearer {token}"}
+    client.post(
+        "/test_table/",
+        json=[
+            {"primarykey": 1, "someothercoll": "a"},
+            {"primarykey": 2, "someothercoll": "a"},
+            {"primarykey": 3, "someothercoll": "b"},
+        ],
+        headers=header,
+    )
+    return factory, client, header
+
+
+def test_aggregate_group_by(factory):
+    _, client, header = factory
+    response = client.get(
+        "/test_table/aggregate?group_by=someothercoll"
+        "&metrics=count,sum:primarykey,max:primarykey,min:someothercoll",
+        headers=header,
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {
+            "someothercoll": "a",
+            "count": 2,
+            "sum_primarykey": 3,
+            "max_primarykey": 2,
+            "min_someothercoll": "a",
+        },
+        {
+            "someothercoll": "b",
+            "count": 1,
+            "sum_primarykey": 3,
+            "max_primarykey": 3,
+            "min_someothercoll": "b",
+        },
+        {
+            "someothercoll": "posty",
+            "count": 1,
+            "sum_primarykey": 0,
+            "max_primarykey": 0,
+            "min_someothercoll": "posty",
+        },
+    ]
+
+
+def test_aggregate_filters_and_cache(factory):
+    factory, client, header = factory
+    response = client.get(
+        "/test_table/aggregate?someothercoll=a&metrics=avg:primarykey",
+        headers=header,
+    )
+    assert response.json() == [{"avg_primarykey": 1.5}]
+    client.post(
+        "/test_table/", json={"primarykey": 4, "someothercoll": "a"}, headers=header
+    )
+    response = client.get(
+        "/test_table/aggregate?metrics=avg:primarykey&someothercoll=a",
+        headers=header,
+    )
+    assert response.json() == [{"avg_primarykey": 1.5}]
+    factory.aggregator.cache.clear()
+    response = client.get(
+        "/test_table/aggregate?metrics=avg:primarykey&someothercoll=a",
+        headers=header,
+    )
+    assert response.json() == [{"avg_primarykey": 7 / 3}]
+
+
+@pytest.mark.parametrize(
+    "query, status_code",
+    [
+        ("group_by=unknown", 400),
+        ("metrics=median:primarykey", 400),
+        ("metrics=sum", 400),
+        ("metrics=sum:someothercoll", 400),
+        ("unknown=1", 400),
+        ("group_by=primarykey", 413),
+    ],
+)
+def test_aggregate_invalid(factory, query, status_code):
+    _, client, header = factory
+    response = client.get(f"/test_table/aggregate?{query}", headers=header)
+    assert response.status_code == status_code
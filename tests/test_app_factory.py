@@ -8,6 +8,7 @@ import os
 from fastapi import FastAPI
 from apifactory.app_factory import ApiFactory
 from apifactory.database import Database
+from apifactory.schemas import Schemas
 
 BASE_PATH = os.path.abspath(os.path.dirname(__file__))
 
@@ -38,3 +39,19 @@ def test_app_creation_customdb():
     # check if the final class is not of type DataBase
     assert not isinstance(type(app.db), Database)
     assert isinstance(app.app_factory(), FastAPI)
+
+
+def test_app_creation_custom_signatures():
+    class CustomDatabase(Database):
+        def __init__(self, database_url, engine_kwargs=None, views=None):
+            super().__init__(database_url, engine_kwargs=engine_kwargs, views=views)
+
+    class CustomSchemas(Schemas):
+        def __init__(self, models):
+            super().__init__(models)
+
+    file_name = os.path.join(BASE_PATH, "testfiles/test.yaml")
+    app = ApiFactory.from_yaml(
+        file_name, database=CustomDatabase, schemas=CustomSchemas
+    )
+    assert isinstance(app.app_factory(), FastAPI)
@@ -0,0 +1,178 @@
+"""tests for the batch endpoint
+"""
+import asyncio
+import os
+import shutil
+
+import pytest
+from fastapi import Depends, HTTPException
+from fastapi.testclient import TestClient
+
+from apifactory.app_factory import ApiFactory
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_batch.yaml")
+
+
+def login(factory):
+    client = TestClient(factory.app_factory())
+    token = client.post(
+        "/login",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+    ).json()["access_token"]
+    return client, {"Authorization": f"bearer {token}"}
+
+
+@pytest.fixture
+def factory(tmp_path):
+    database = tmp_path / "batch.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), database)
+    return ApiFactory.from_yaml(file_name, database_url=f"sqlite:///{database}")
+
+
+@pytest.fixture
+def client(factory):
+    return login(factory)
+
+
+def test_batch_in_order(client):
+    client, header = client
+    operations = [
+        {
+            "method": "post",
+            "table": "test_table",
+            "body": [{"primarykey": 4000, "someothercoll": "a"}],
+        },
+        {
+            "method": "put",
+            "table": "test_table",
+            "key": 4000,
+            "body": {"someothercoll": "b"},
+        },
+        {"method": "get", "table": "test_table", "key": 4000},
+        {"method": "get", "table": "test_table", "params": {"someothercoll": "b"}},
+        {"method": "delete", "table": "test_table", "key": 0},
+    ]
+    response = client.post("/batch", json=operations, headers=header)
+    assert response.status_code == 200
+    results = response.json()
+    assert results[1] == "updated"
+    assert results[2] == {"primarykey": 4000, "someothercoll": "b"}
+    assert results[3] == [{"primarykey": 4000, "someothercoll": "b"}]
+    assert client.get("/test_table/0", headers=header).status_code == 404
+
+
+def test_failing_operation_rolls_back(client):
+    client, header = client
+    operations = [
+        {"method": "post", "table": "test_table", "body": {"primarykey": 4100}},
+        {"method": "post", "table": "test_table", "body": {"primarykey": 0}},
+    ]
+    response = client.post("/batch", json=operations, headers=header)
+    assert response.status_code == 409
+    assert response.json()["detail"]["operation"] == 1
+    assert client.get("/test_table/4100", headers=header).status_code == 404
+
+
+def test_operation_errors(client):
+    client, header = client
+    response = client.post(
+        "/batch",
+        json=[{"method": "get", "table": "test_table", "key": 4200}],
+        headers=header,
+    )
+    assert response.status_code == 404
+    assert response.json()["detail"]["operation"] == 0
+    response = client.post(
+        "/batch",
+        json=[{"method": "post", "table": "selection_view", "body": {}}],
+        headers=header,
+    )
+    assert response.status_code == 405
+    response = client.post(
+        "/batch", json=[{"method": "get", "table": "unknown"}], headers=header
+    )
+    assert response.status_code == 404
+    response = client.post(
+        "/batch",
+        json=[{"method": "get", "table": "test_table", "key": 0}] * 6,
+        headers=header,
+    )
+    assert response.status_code == 413
+
+
+def test_batch_requires_login(client):
+    client, _ = client
+    response = client.post("/batch", json=[])
+    assert response.status_code == 401
+
+
+def test_batch_publishes_after_commit(factory):
+    client, header = login(factory)
+    subscriptions = factory.subscriptions
+
+    async def subscribe():
+        subscriber = subscriptions.subscribe("test_table", {})
+        loop = asyncio.get_running_loop()
+        operations = [
+            {"method": "post", "table": "test_table", "body": {"primarykey": 4300}},
+            {"method": "put", "table": "test_table", "body": [{"primarykey": 0}]},
+            {"method": "delete", "table": "test_table", "body": [{"primarykey": 4300}]},
+            {"method": "delete", "table": "test_table", "body": [{"primarykey": 4301}]},
+        ]
+        failing = [
+            {"method": "post", "table": "test_table", "body": {"primarykey": 4400}},
+            {"method": "post", "table": "test_table", "body": {"primarykey": 0}},
+        ]
+
+        def write():
+            assert client.post("/batch", json=operations, headers=header).ok
+            assert (
+                client.post("/batch", json=failing, headers=header).status_code == 409
+            )
+
+        await loop.run_in_executor(None, write)
+        await asyncio.sleep(0)
+        events = []
+        while not subscriber.queue.empty():
+            events.append(subscriber.queue.get_nowait())
+        return events
+
+    events = asyncio.run(subscribe())
+    assert [(event["operation"], event["key"]) for event in events] == [
+        ("insert", 4300),
+        ("update", 0),
+        ("delete", 4300),
+    ]
+
+
+def test_batch_applies_route_dependencies(tmp_path):
+    database = tmp_path / "batch.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), database)
+    calls = []
+
+    def forbid_deletes():
+        calls.append("delete")
+        raise HTTPException(status_code=403, detail="deletes are not allowed")
+
+    config = {
+        "test_table": {"delete_kwargs": {"dependencies": [Depends(forbid_deletes)]}},
+        "views": {"selection_view": [["Personid", "INTEGER"]]},
+    }
+    client, header = login(
+        ApiFactory.from_yaml(
+            file_name, database_url=f"sqlite:///{database}", config=config
+        )
+    )
+    get = {"method": "get", "table": "test_table", "key": 0}
+    response = client.post("/batch", json=[get], headers=header)
+    assert response.status_code == 200
+    assert not calls
+    delete = {"method": "delete", "table": "test_table", "key": 0}
+    response = client.post("/batch", json=[get, delete, delete], headers=header)
+    assert response.status_code == 403
+    assert calls == ["delete"]
+    assert client.get("/test_table/0", headers=header).status_code == 200
+    assert client.delete("/test_table/0", headers=header).status_code == 403
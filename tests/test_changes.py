@@ -0,0 +1,108 @@
+"""tests for the change feeds
+"""
+import os
+import shutil
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apifactory.app_factory import ApiFactory
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_changes.yaml")
+
+
+@pytest.fixture
+def client(tmp_path):
+    database = tmp_path / "changes.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), database)
+    app = ApiFactory.from_yaml(
+        file_name, database_url=f"sqlite:///{database}"
+    ).app_factory()
+    client = TestClient(app)
+    token = client.post(
+        "/login",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+    ).json()["access_token"]
+    return client, {"Authorization": f"bearer {token}"}
+
+
+def changes(client, header, since=None):
+    params = {"since": since} if since else {}
+    response = client.get("/test_table/changes", params=params, headers=header)
+    assert response.status_code == 200
+    return response.json()
+
+
+def keys(page):
+    return [item["primarykey"] for item in page["items"]]
+
+
+def test_pages_and_watermarks(client):
+    client, header = client
+    client.post(
+        "/test_table/",
+        json=[{"primarykey": key, "someothercoll": f"a{key}"} for key in (1, 2, 3)],
+        headers=header,
+    )
+    page = changes(client, header)
+    assert keys(page) == [1, 2]
+    assert page["more"]
+    page = changes(client, header, page["next"])
+    # the existing entry 0 has the value posty
+    assert keys(page) == [3, 0]
+    assert not page["more"]
+    watermark = page["next"]
+    assert keys(changes(client, header, watermark)) == []
+    client.put("/test_table/1", json={"someothercoll": "z1"}, headers=header)
+    page = changes(client, header, watermark)
+    assert keys(page) == [1]
+    assert page["items"][0]["someothercoll"] == "z1"
+
+
+def test_equal_values_are_not_skipped(client):
+    client, header = client
+    client.post(
+        "/test_table/",
+        json=[{"primarykey": key, "someothercoll": "same"} for key in (10, 11, 12)],
+        headers=header,
+    )
+    # the existing entry 0 has the value posty
+    page = changes(client, header)
+    assert keys(page) == [0, 10]
+    assert keys(changes(client, header, page["next"])) == [11, 12]
+
+
+def test_deletes_are_tombstoned(client):
+    client, header = client
+    watermark = changes(client, header)["next"]
+    client.delete("/test_table/0", headers=header)
+    # keys that do not exist are not tombstoned
+    client.request(
+        "DELETE", "/test_table/", json=[{"primarykey": 9000}], headers=header
+    )
+    client.post(
+        "/batch",
+        json=[
+            {"method": "post", "table": "test_table", "body": {"primarykey": 20}},
+            {
+                "method": "delete",
+                "table": "test_table",
+                "body": [{"primarykey": 20}, {"primarykey": 9001}],
+            },
+        ],
+        headers=header,
+    )
+    page = changes(client, header, watermark)
+    assert page["items"] == []
+    assert page["deleted"] == [0, 20]
+
+
+def test_invalid_token(client):
+    client, header = client
+    response = client.get(
+        "/test_table/changes", params={"since": "invalid"}, headers=header
+    )
+    assert response.status_code == 400
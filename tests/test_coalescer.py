@@ -0,0 +1,72 @@
+"""tests for the write coalescer of single entry posts
+"""
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from apifactory.app_factory import ApiFactory
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_coalescer.yaml")
+
+
+@pytest.fixture
+def client(tmp_path):
+    database = tmp_path / "coalescer.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), database)
+    factory = ApiFactory.from_yaml(file_name, database_url=f"sqlite:///{database}")
+    client = TestClient(factory.app_factory(), raise_server_exceptions=False)
+    token = client.post(
+        "/login",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+    ).json()["access_token"]
+    commits = []
+    event.listen(factory.db.engine, "commit", commits.append)
+    return client, {"Authorization": f"bearer {token}"}, commits
+
+
+def post_concurrently(client, header, keys):
+    def post(key):
+        return client.post(
+            "/test_table/",
+            json={"primarykey": key, "someothercoll": f"row {key}"},
+            headers=header,
+        )
+
+    with ThreadPoolExecutor(len(keys)) as pool:
+        return list(pool.map(post, keys))
+
+
+def test_posts_share_a_transaction(client):
+    client, header, commits = client
+    responses = post_concurrently(client, header, [3000, 3001, 3002, 3003])
+    assert [response.status_code for response in responses] == [200] * 4
+    assert responses[1].json() == {"primarykey": 3001, "someothercoll": "row 3001"}
+    assert len(commits) < 4
+    for key in (3000, 3001, 3002, 3003):
+        assert client.get(f"/test_table/{key}", headers=header).status_code == 200
+
+
+def test_failing_entry_is_isolated(client):
+    client, header, _ = client
+    # 0 is an existing primary key
+    responses = post_concurrently(client, header, [3100, 0, 3101])
+    assert [response.status_code for response in responses] == [200, 500, 200]
+    assert client.get("/test_table/3101", headers=header).status_code == 200
+
+
+def test_lists_are_not_coalesced(client):
+    client, header, commits = client
+    response = client.post(
+        "/test_table/",
+        json=[{"primarykey": 3200, "someothercoll": "a"}],
+        headers=header,
+    )
+    assert response.status_code == 200
+    assert len(commits) == 1
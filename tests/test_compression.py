@@ -0,0 +1,192 @@
+"""tests for response compression and content negotiation
+"""
+import asyncio
+import gzip
+import os
+import zlib
+
+import pytest
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from apifactory.app_factory import ApiFactory
+from apifactory.compression import CompressionMiddleware
+from apifactory.negotiation import ContentNegotiation, NegotiatedResponse
+from apifactory.routing import hooked_route_class
+
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_compression.yaml")
+app = ApiFactory.from_yaml(file_name).app_factory()
+
+
+client = TestClient(app)
+token = client.post(
+    "/login",
+    headers={"Content-Type": "application/x-www-form-urlencoded"},
+    data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+).json()["access_token"]
+header = {"Authorization": f"bearer {token}", "Accept-Encoding": "gzip"}
+
+
+def test_compressed_page():
+    response = client.get("/test_table/", headers=header)
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.json()["items"][0]["primarykey"] == 0
+
+
+def test_small_response_not_compressed():
+    response = client.get("/test_table/0", headers=header)
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+
+
+def test_identity_not_compressed():
+    response = client.get(
+        "/test_table/", headers={**header, "Accept-Encoding": "identity"}
+    )
+    assert "content-encoding" not in response.headers
+    assert response.json()["items"]
+
+
+def test_streamed_response_flushed_per_chunk():
+    chunks = [b'{"row": %d}\n' % number * 20 for number in range(5)]
+
+    async def rows():
+        for chunk in chunks:
+            yield chunk
+
+    streaming_app = FastAPI()
+
+    @streaming_app.get("/export")
+    def export():
+        return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+    streaming_app.add_middleware(CompressionMiddleware, minimum_size=10)
+    response = TestClient(streaming_app).get(
+        "/export", headers={"Accept-Encoding": "gzip"}, stream=True
+    )
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    raw = b"".join(response.raw.stream(decode_content=False))
+    assert gzip.decompress(raw) == b"".join(chunks)
+    # every chunk ends with a sync flush, so clients can decompress rows as they arrive
+    decompressor = zlib.decompressobj(31)
+    first_flush = raw.index(b"\x00\x00\xff\xff") + 4
+    assert decompressor.decompress(raw[:first_flush]) == chunks[0]
+
+
+def test_not_acceptable():
+    response = client.get(
+        "/test_table/", headers={**header, "Accept": "application/xml"}
+    )
+    assert response.status_code == 406
+
+
+def test_accept_json():
+    response = client.get(
+        "/test_table/0", headers={**header, "Accept": "text/html,*/*;q=0.8"}
+    )
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["vary"] == "Accept"
+
+
+def test_msgpack():
+    msgpack = pytest.importorskip("msgpack")
+    response = client.get(
+        "/test_table/", headers={**header, "Accept": "application/msgpack"}
+    )
+    assert response.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content)["items"][0]["primarykey"] == 0
+
+
+def test_arrow():
+    pyarrow = pytest.importorskip("pyarrow")
+    response = client.get(
+        "/test_table/",
+        headers={**header, "Accept": "application/vnd.apache.arrow.stream"},
+    )
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert table.column("primarykey")[0].as_py() == 0
+    assert table.schema.metadata[b"page"] == b"1"
+
+
+def test_export_not_negotiated():
+    pytest.importorskip("pyarrow")
+    response = client.get(
+        "/test_table/export?format=parquet",
+        headers={**header, "Accept": "application/vnd.apache.parquet"},
+    )
+    assert response.status_code == 200
+    assert "Accept" not in response.headers.get("vary", "")
+
+
+def test_vary_appended():
+    negotiation = ContentNegotiation()
+    router = APIRouter(
+        default_response_class=NegotiatedResponse,
+        route_class=hooked_route_class([negotiation.route_hook]),
+    )
+
+    @router.get("/cors")
+    def cors():
+        return NegotiatedResponse({"cors": True}, headers={"Vary": "Origin"})
+
+    negotiated_app = FastAPI()
+    negotiated_app.include_router(router)
+    response = TestClient(negotiated_app).get("/cors")
+    assert response.headers["vary"] == "Origin, Accept"
+
+
+def test_event_stream_not_negotiated_or_compressed():
+    async def subscribe():
+        # the stream does not end by itself, so the app is called without the test client
+        disconnect = asyncio.Event()
+        requested = []
+        messages = []
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": "/test_table/subscribe",
+            "raw_path": b"/test_table/subscribe",
+            "root_path": "",
+            "query_string": b"",
+            "server": ("testserver", 80),
+            "client": ("testclient", 50000),
+            "headers": [
+                (b"host", b"testserver"),
+                (b"accept", b"text/event-stream"),
+                (b"accept-encoding", b"gzip"),
+                (b"authorization", f"bearer {token}".encode()),
+            ],
+        }
+
+        async def receive():
+            if not requested:
+                requested.append(True)
+                return {"type": "http.request", "body": b""}
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            messages.append(message)
+            if message["type"] == "http.response.body":
+                # the first event arrived without waiting for minimum_size
+                disconnect.set()
+
+        await asyncio.wait_for(app(scope, receive, send), 5)
+        return messages
+
+    start, first, *_ = asyncio.run(subscribe())
+    headers = dict(start["headers"])
+    assert start["status"] == 200
+    assert headers[b"content-type"].startswith(b"text/event-stream")
+    assert b"content-encoding" not in headers
+    assert first["body"] == b": subscribed\n\n"
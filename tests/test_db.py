@@ -1,10 +1,135 @@
 """module for testing Database class
 """
+import os
+import shutil
+import sqlite3
+
+from fastapi import Request
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from apifactory.app_factory import ApiFactory
 from apifactory.database import Database
 
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+JWT_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
+
 
 def test_db_table_inclusion():
     db = Database("sqlite:///tests/testdb/test.db")
     assert hasattr(db.models, "Users")
     assert hasattr(db.models, "Persons")
     assert hasattr(db.models, "test_table")
+
+
+def replica_factory(tmp_path, replica_url=None, **kwargs):
+    primary = tmp_path / "primary.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), primary)
+    if not replica_url:
+        replica = tmp_path / "replica.db"
+        shutil.copy(primary, replica)
+        with sqlite3.connect(replica) as connection:
+            connection.execute("UPDATE test_table SET someothercoll = 'replica'")
+        replica_url = f"sqlite:///{replica}"
+    factory = ApiFactory(
+        f"sqlite:///{primary}",
+        "Users",
+        JWT_KEY,
+        {"views": {"selection_view": [["Personid", "INTEGER"]]}},
+        replica_urls=[replica_url],
+        engine_kwargs={"connect_args": {"check_same_thread": False}},
+        **kwargs,
+    )
+    client = TestClient(factory.app_factory())
+    token = client.post(
+        "/login",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+    ).json()["access_token"]
+    return client, {"Authorization": f"bearer {token}"}
+
+
+def test_replica_reads(tmp_path):
+    client, header = replica_factory(tmp_path, read_your_writes=60)
+    response = client.get("test_table/0", headers=header)
+    assert response.json()["someothercoll"] == "replica"
+    response = client.put(
+        "test_table/0",
+        json={"primarykey": 0, "someothercoll": "primary"},
+        headers=header,
+    )
+    assert response.status_code == 200
+    # the client wrote, reads stay on the primary
+    response = client.get("test_table/0", headers=header)
+    assert response.json()["someothercoll"] == "primary"
+
+
+def test_unhealthy_replica(tmp_path):
+    replica_url = f"sqlite:///{tmp_path}/missing/replica.db"
+    client, header = replica_factory(tmp_path, replica_url=replica_url)
+    response = client.get("test_table/0", headers=header)
+    assert response.status_code == 200
+
+
+def replica_database(tmp_path):
+    primary = tmp_path / "primary.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), primary)
+    return Database(
+        f"sqlite:///{primary}",
+        replica_urls=[f"sqlite:///{primary}"],
+        read_your_writes=60,
+        engine_kwargs={"connect_args": {"check_same_thread": False}},
+    )
+
+
+def test_pinned_at_commit(tmp_path):
+    db = replica_database(tmp_path)
+    request = Request({"type": "http", "client": ("10.0.0.1", 1000), "headers": []})
+    sessions = db.session_getter("write")(request)
+    session = next(sessions)
+    assert not db.pinned(request)
+    session.commit()
+    # pinned before the session is closed, which happens after the response is sent
+    assert db.pinned(request)
+    sessions.close()
+
+
+def test_replica_health_cached(tmp_path):
+    db = replica_database(tmp_path)
+    replica = db.replicas.replicas[0]
+    checks = []
+
+    @event.listens_for(replica.engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        checks.append(statement)
+
+    try:
+        assert all(replica.available() for _ in range(10))
+        assert checks == ["SELECT 1"]
+        assert replica.monitor_thread.is_alive()
+    finally:
+        db.replicas.stop()
+    replica.monitor_thread.join(replica.check_interval + 1)
+    assert not replica.monitor_thread.is_alive()
+
+
+def test_dispose_pools_after_fork():
+    db = Database(
+        "sqlite:///tests/testdb/test.db",
+        pools={"read": {}},
+        engine_kwargs={
+            "connect_args": {"check_same_thread": False},
+            "poolclass": QueuePool,
+        },
+    )
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql("SELECT 1")
+    old_pools = [engine.pool for engine in db.all_engines()]
+    parent_connection = old_pools[0]._pool.queue[0].dbapi_connection
+    db.dispose_pools(close=False)
+    assert all(
+        engine.pool is not pool for engine, pool in zip(db.all_engines(), old_pools)
+    )
+    # connections of the parent process are left open
+    parent_connection.execute("SELECT 1")
@@ -0,0 +1,144 @@
+"""tests for deferred columns and the column route
+"""
+import os
+import shutil
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from apifactory.app_factory import ApiFactory
+from apifactory.database import Models
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_deferred.yaml")
+
+CONTENT = bytes(range(256)) * 1000
+BODY = "ünïcödé text " * 10000
+
+
+@pytest.fixture
+def factory(tmp_path):
+    database = tmp_path / "deferred.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), database)
+    connection = sqlite3.connect(database)
+    connection.execute(
+        "CREATE TABLE documents (id INTEGER PRIMARY KEY, name TEXT, content BLOB, body TEXT)"
+    )
+    connection.execute(
+        "INSERT INTO documents VALUES (1, 'report', ?, ?), (2, 'empty', NULL, NULL)",
+        (CONTENT, BODY),
+    )
+    connection.commit()
+    connection.close()
+    factory = ApiFactory.from_yaml(file_name, database_url=f"sqlite:///{database}")
+    client = TestClient(factory.app_factory())
+    token = client.post(
+        "/login",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+    ).json()["access_token"]
+    client.headers["Authorization"] = f"bearer {token}"
+    yield factory, client
+    # the table names of the models are shared by every app
+    Models.table_names.discard("documents")
+
+
+def test_deferred_columns_left_out(factory):
+    factory, client = factory
+    statements = []
+
+    @event.listens_for(factory.db.engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    response = client.get("/documents/")
+    assert response.json()["items"][0] == {"id": 1, "name": "report"}
+    assert client.get("/documents/1").json() == {"id": 1, "name": "report"}
+    # the count of the page wraps the query in a subquery whose columns are not read
+    selects = [
+        statement
+        for statement in statements
+        if "FROM documents" in statement and "count(*)" not in statement
+    ]
+    assert len(selects) == 2
+    assert not any("documents.content" in statement for statement in selects)
+
+
+def test_column_route(factory):
+    _, client = factory
+    response = client.get("/documents/1/content")
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["content-length"] == str(len(CONTENT))
+    assert response.headers["accept-ranges"] == "bytes"
+    response = client.get("/documents/1/body")
+    assert response.status_code == 200
+    assert response.text == BODY
+    assert response.headers["accept-ranges"] == "none"
+
+
+@pytest.mark.parametrize(
+    "header, start, end",
+    [
+        ("bytes=2-5", 2, 5),
+        ("bytes=65530-65540", 65530, 65540),
+        ("bytes=255990-", 255990, 255999),
+        ("bytes=-3", 255997, 255999),
+        ("bytes=255998-300000", 255998, 255999),
+    ],
+)
+def test_column_range(factory, header, start, end):
+    _, client = factory
+    response = client.get("/documents/1/content", headers={"Range": header})
+    assert response.status_code == 206
+    assert response.content == CONTENT[start : end + 1]
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{len(CONTENT)}"
+    assert response.headers["content-length"] == str(end - start + 1)
+
+
+@pytest.mark.parametrize(
+    "path, headers, status_code",
+    [
+        ("/documents/1/content", {"Range": "bytes=256000-"}, 416),
+        ("/documents/1/content", {"Range": "bytes=0-1,4-5"}, 200),
+        ("/documents/1/name", {}, 404),
+        ("/documents/3/content", {}, 404),
+        ("/documents/2/content", {}, 404),
+    ],
+)
+def test_column_errors(factory, path, headers, status_code):
+    _, client = factory
+    response = client.get(path, headers=headers)
+    assert response.status_code == status_code
+    if status_code == 416:
+        assert response.headers["content-range"] == "bytes */256000"
+
+
+def test_deferred_columns_written(factory):
+    _, client = factory
+    response = client.post("/documents/", json={"id": 3, "name": "new", "body": "text"})
+    assert response.status_code == 200
+    assert client.get("/documents/3").json() == {"id": 3, "name": "new"}
+    assert client.get("/documents/3/body").text == "text"
+    response = client.put("/documents/3", json={"name": "new", "body": "changed"})
+    assert response.status_code == 200
+    assert client.get("/documents/3/body").text == "changed"
+
+
+def test_batch_leaves_out_deferred_columns(factory):
+    _, client = factory
+    response = client.post(
+        "/batch",
+        json=[
+            {"method": "get", "table": "documents", "key": 1},
+            {"method": "get", "table": "documents"},
+        ],
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {"id": 1, "name": "report"},
+        [{"id": 1, "name": "report"}, {"id": 2, "name": "empty"}],
+    ]
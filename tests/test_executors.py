@@ -0,0 +1,167 @@
+"""tests for running the generated endpoints on separate executors
+"""
+import asyncio
+import os
+import threading
+from typing import Union
+
+from fastapi import APIRouter, Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from apifactory.app_factory import ApiFactory
+from apifactory.executors import Executors
+from apifactory.route_factory import post_session_getter
+
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_executors.yaml")
+factory = ApiFactory.from_yaml(file_name)
+app = factory.app_factory()
+
+
+client = TestClient(app)
+
+HEADER = {
+    "accept": "application/json",
+    "Content-Type": "application/x-www-form-urlencoded",
+}
+
+bearer_token = client.post(
+    "/login",
+    headers=HEADER,
+    data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+)
+token = bearer_token.json()["access_token"]
+
+header = {"accept": "application/json", "Authorization": f"bearer {token}"}
+
+
+def test_offload():
+    executors = Executors({"read": 1, "bulk": 1})
+
+    def get_id():
+        return threading.current_thread().name
+
+    def post(request):
+        return threading.current_thread().name
+
+    assert asyncio.run(executors.offload(get_id)()).startswith("apifactory-read")
+    # posts containing a list run on the bulk executor
+    bulk = asyncio.run(executors.offload(post)(request=[1, 2]))
+    assert bulk.startswith("apifactory-bulk")
+    single = asyncio.run(executors.offload(post)(request=1))
+    assert not single.startswith("apifactory")
+    executors.shutdown()
+
+
+def test_separate_pools():
+    assert set(factory.db.engines) == {"read", "bulk"}
+    assert factory.db.session_getter("write") == factory.db.get_db
+
+
+def test_routes():
+    response = client.get("test_table/", headers=header)
+    assert response.status_code == 200
+    response = client.get("test_table/0", headers=header)
+    assert response.status_code == 200
+    response = client.put("test_table/9000", json={}, headers=header)
+    assert response.status_code == 404
+    response = client.delete("test_table/", json=[{"primarykey": 9000}], headers=header)
+    assert response.status_code == 200
+
+
+def test_bulk_posts_use_bulk_pool():
+    statements = {"bulk": [], "primary": []}
+
+    def recorder(name):
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements[name].append(statement)
+
+        return record
+
+    bulk_recorder, primary_recorder = recorder("bulk"), recorder("primary")
+    event.listen(factory.db.engines["bulk"], "before_cursor_execute", bulk_recorder)
+    event.listen(factory.db.engine, "before_cursor_execute", primary_recorder)
+    try:
+        response = client.post(
+            "test_table/", json=[{"primarykey": 9100}], headers=header
+        )
+        assert response.status_code == 200
+        assert any("INSERT" in statement for statement in statements["bulk"])
+        assert not any("INSERT" in statement for statement in statements["primary"])
+        statements["bulk"].clear()
+        response = client.post("test_table/", json={"primarykey": 9101}, headers=header)
+        assert response.status_code == 200
+        assert any("INSERT" in statement for statement in statements["primary"])
+        assert not any("INSERT" in statement for statement in statements["bulk"])
+    finally:
+        event.remove(factory.db.engines["bulk"], "before_cursor_execute", bulk_recorder)
+        event.remove(factory.db.engine, "before_cursor_execute", primary_recorder)
+        client.delete(
+            "test_table/",
+            json=[{"primarykey": 9100}, {"primarykey": 9101}],
+            headers=header,
+        )
+
+
+def test_dependencies_run_on_executor():
+    executors = Executors({"read": 1})
+    threads = {}
+
+    def get_db():
+        threads["get_db"] = threading.current_thread().name
+        yield "session"
+        threads["close"] = threading.current_thread().name
+
+    def get_current_user(db=Depends(get_db)):
+        threads["get_current_user"] = threading.current_thread().name
+        return db
+
+    def get_user_override():
+        return "override"
+
+    router = APIRouter()
+
+    @executors.method(router.get)("/{item}")
+    def get_id(item: int, db=Depends(get_db), user=Depends(get_current_user)):
+        return [item, db, user]
+
+    test_app = FastAPI()
+    test_app.include_router(router)
+    with TestClient(test_app) as test_client:
+        assert test_client.get("/1").json() == [1, "session", "session"]
+        assert set(threads) == {"get_db", "get_current_user", "close"}
+        assert all(name.startswith("apifactory-read") for name in threads.values())
+        # overrides of the wrapped dependencies still apply
+        test_app.dependency_overrides[get_current_user] = get_user_override
+        assert test_client.get("/1").json() == [1, "session", "override"]
+    executors.shutdown()
+
+
+def test_post_resolves_one_session():
+    opened = []
+
+    def getter(name):
+        def get_db():
+            opened.append(name)
+            yield name
+
+        return get_db
+
+    router = APIRouter()
+
+    @router.post("/")
+    def post(
+        request: Union[list, dict],
+        db=Depends(post_session_getter(getter("write"), getter("bulk"))),
+    ):
+        return db
+
+    test_app = FastAPI()
+    test_app.include_router(router)
+    with TestClient(test_app) as test_client:
+        assert test_client.post("/", json={"a": 1}).json() == "write"
+        assert test_client.post("/", json=[{"a": 1}]).json() == "bulk"
+    assert opened == ["write", "bulk"]
@@ -0,0 +1,110 @@
+"""tests for the expansion of relationships
+"""
+import os
+import shutil
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from apifactory.app_factory import ApiFactory
+from apifactory.database import Models
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_expand.yaml")
+
+
+@pytest.fixture
+def client(tmp_path):
+    database = tmp_path / "expand.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), database)
+    connection = sqlite3.connect(database)
+    connection.executescript(
+        """
+        DELETE FROM Persons;
+        INSERT INTO Persons (Personid, Age, LastName, FirstName)
+        VALUES (1, 70, 'Doe', 'Jane'), (2, 40, 'Roe', 'Rick');
+        CREATE TABLE orders (
+            id INTEGER PRIMARY KEY,
+            item TEXT,
+            person_id INTEGER REFERENCES Persons(Personid)
+        );
+        INSERT INTO orders VALUES (1, 'book', 1), (2, 'pen', 1), (3, 'ink', 2);
+        """
+    )
+    connection.commit()
+    connection.close()
+    factory = ApiFactory.from_yaml(file_name, database_url=f"sqlite:///{database}")
+    client = TestClient(factory.app_factory())
+    token = client.post(
+        "/login",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+    ).json()["access_token"]
+    client.headers["Authorization"] = f"bearer {token}"
+    yield client
+    # the table names of the models are shared by every app
+    Models.table_names.discard("orders")
+
+
+def test_expand_many_to_one(client):
+    response = client.get("/orders/?expand=persons")
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert [item["persons"]["Personid"] for item in items] == [1, 1, 2]
+    assert items[0]["item"] == "book"
+    response = client.get("/orders/3?expand=persons")
+    assert response.json()["persons"]["Personid"] == 2
+    assert "persons" not in client.get("/orders/3").json()
+
+
+def test_expand_nested(client):
+    response = client.get("/orders/3?expand=persons.orders_collection")
+    assert response.status_code == 200
+    assert response.json()["persons"]["orders_collection"] == [
+        {"id": 3, "item": "ink", "person_id": 2}
+    ]
+    response = client.get("/Persons/?expand=orders_collection&Personid=1")
+    assert [
+        order["id"] for order in response.json()["items"][0]["orders_collection"]
+    ] == [1, 2]
+
+
+@pytest.mark.parametrize(
+    "expand, status_code",
+    [
+        ("unknown", 400),
+        ("persons.orders_collection.persons", 400),
+        ("persons.orders_collection,persons.orders_collection,id", 400),
+    ],
+)
+def test_expand_invalid(client, expand, status_code):
+    assert client.get(f"/orders/?expand={expand}").status_code == status_code
+
+
+def test_expand_max_related(client):
+    client.post("/orders/", json={"id": 4, "item": "paper", "person_id": 1})
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        response = client.get("/Persons/1?expand=orders_collection")
+        assert response.status_code == 413
+        # the related entries are counted, never loaded
+        assert not any("orders.item" in statement for statement in statements)
+        statements.clear()
+        response = client.get("/orders/1?expand=persons.orders_collection")
+        assert response.status_code == 413
+        # only the order itself is loaded
+        assert (
+            len([statement for statement in statements if "orders.item" in statement])
+            == 1
+        )
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
@@ -0,0 +1,120 @@
+"""tests for the columnar export of tables
+"""
+import io
+import os
+import shutil
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import types as sqltypes
+
+from apifactory.app_factory import ApiFactory
+from apifactory.database import Models
+
+pyarrow = pytest.importorskip("pyarrow")
+import pyarrow.ipc  # pylint: disable=C0413
+import pyarrow.parquet  # pylint: disable=C0413
+
+from apifactory.export import arrow_type  # pylint: disable=C0413
+
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_export.yaml")
+app = ApiFactory.from_yaml(file_name).app_factory()
+
+
+client = TestClient(app)
+token = client.post(
+    "/login",
+    headers={"Content-Type": "application/x-www-form-urlencoded"},
+    data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+).json()["access_token"]
+header = {"Authorization": f"bearer {token}"}
+
+
+def test_arrow_export():
+    response = client.get("/test_table/export", headers=header)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert table.schema.field("primarykey").type == pyarrow.int64()
+    assert table.schema.field("someothercoll").type == pyarrow.string()
+    rows = client.get("/test_table/", headers=header).json()["items"]
+    assert table.to_pylist() == rows
+
+
+def test_parquet_export():
+    response = client.get("/test_table/export?format=parquet", headers=header)
+    assert response.status_code == 200
+    assert int(response.headers["content-length"]) == len(response.content)
+    table = pyarrow.parquet.read_table(io.BytesIO(response.content))
+    assert table.column("primarykey").to_pylist()[0] == 0
+    # one row group per batch of the cursor
+    metadata = pyarrow.parquet.ParquetFile(io.BytesIO(response.content)).metadata
+    assert metadata.num_row_groups == -(-table.num_rows // 2)
+
+
+def test_export_filter():
+    response = client.get("/test_table/export?primarykey=0", headers=header)
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert table.column("primarykey").to_pylist() == [0]
+    response = client.get("/test_table/export?nocolumn=0", headers=header)
+    assert response.status_code == 400
+    response = client.get("/test_table/export?format=csv", headers=header)
+    assert response.status_code == 422
+
+
+def test_export_requires_login():
+    response = client.get("/test_table/export")
+    assert response.status_code == 401
+
+
+def test_arrow_types():
+    assert arrow_type(sqltypes.SmallInteger()) == pyarrow.int16()
+    assert arrow_type(sqltypes.Float()) == pyarrow.float64()
+    assert arrow_type(sqltypes.Numeric(10, 2)) == pyarrow.decimal128(10, 2)
+    assert arrow_type(sqltypes.DateTime()) == pyarrow.timestamp("us")
+    assert arrow_type(sqltypes.Date()) == pyarrow.date32()
+    assert arrow_type(sqltypes.LargeBinary()) == pyarrow.binary()
+    assert arrow_type(sqltypes.Boolean()) == pyarrow.bool_()
+    assert arrow_type(sqltypes.JSON()) == pyarrow.string()
+
+
+def test_numeric_export(tmp_path):
+    database = tmp_path / "export.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), database)
+    connection = sqlite3.connect(database)
+    connection.execute(
+        "CREATE TABLE measurements (id INTEGER PRIMARY KEY, amount NUMERIC, price NUMERIC(10, 2))"
+    )
+    connection.execute(
+        "INSERT INTO measurements VALUES (1, 1.5, 2.25), (2, NULL, NULL), (3, 3, 4)"
+    )
+    connection.commit()
+    connection.close()
+    try:
+        numeric_app = ApiFactory.from_yaml(
+            file_name, database_url=f"sqlite:///{database}"
+        ).app_factory()
+        numeric_client = TestClient(numeric_app)
+        response = numeric_client.post(
+            "/login",
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+        )
+        numeric_header = {"Authorization": f"bearer {response.json()['access_token']}"}
+        response = numeric_client.get("/measurements/export", headers=numeric_header)
+        assert response.status_code == 200
+        table = pyarrow.ipc.open_stream(response.content).read_all()
+        assert table.schema.field("amount").type == pyarrow.float64()
+        assert table.column("amount").to_pylist() == [1.5, None, 3.0]
+        assert [str(price) for price in table.column("price").to_pylist()] == [
+            "2.25",
+            "None",
+            "4.00",
+        ]
+    finally:
+        # the table names of the models are shared by every app
+        Models.table_names.discard("measurements")
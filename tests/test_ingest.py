@@ -0,0 +1,174 @@
+"""tests for the streaming bulk ingest
+"""
+import gzip
+import json
+import os
+import shutil
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apifactory.app_factory import ApiFactory
+from apifactory.ingest import BulkIngest, body_lines
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_ingest.yaml")
+NDJSON = {"Content-Type": "application/x-ndjson"}
+
+
+def client_factory(tmp_path, **kwargs):
+    database = tmp_path / "ingest.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), database)
+    app = ApiFactory.from_yaml(
+        file_name, database_url=f"sqlite:///{database}", **kwargs
+    ).app_factory()
+    client = TestClient(app)
+    token = client.post(
+        "/login",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+    ).json()["access_token"]
+    return client, {"Authorization": f"bearer {token}"}
+
+
+@pytest.fixture
+def client(tmp_path):
+    return client_factory(tmp_path)
+
+
+def rows(keys):
+    return [{"primarykey": key, "someothercoll": f"row {key}"} for key in keys]
+
+
+def test_ndjson_streamed(client):
+    client, header = client
+
+    def body():
+        for row in rows(range(1000, 1005)):
+            yield (json.dumps(row) + "\n").encode()
+
+    response = client.post(
+        "/test_table/bulk", data=body(), headers={**header, **NDJSON}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"inserted": 5, "failed": 0, "errors": []}
+    response = client.get("/test_table/1004", headers=header)
+    assert response.json()["someothercoll"] == "row 1004"
+
+
+def test_streamed_with_cancel_on_disconnect(tmp_path):
+    # the disconnect watcher must not take the messages of a streamed body
+    client, header = client_factory(tmp_path, cancel_on_disconnect=True)
+
+    def body():
+        for row in rows(range(1000, 1050)):
+            yield (json.dumps(row) + "\n").encode()
+
+    response = client.post(
+        "/test_table/bulk", data=body(), headers={**header, **NDJSON}
+    )
+    assert response.json() == {"inserted": 50, "failed": 0, "errors": []}
+
+
+def test_csv_gzip(client):
+    client, header = client
+    body = "primarykey,someothercoll\n1000,first\n1001,\n"
+    response = client.post(
+        "/test_table/bulk",
+        data=gzip.compress(body.encode()),
+        headers={**header, "Content-Type": "text/csv", "Content-Encoding": "gzip"},
+    )
+    assert response.json()["inserted"] == 2
+    response = client.get("/test_table/1001", headers=header)
+    assert response.json()["someothercoll"] is None
+
+
+def test_row_errors(client):
+    client, header = client
+    lines = [
+        json.dumps(rows([1000])[0]),
+        "{not json",
+        json.dumps({"primarykey": "abc"}),
+        json.dumps(rows([1001])[0]),
+        # the primary key already exists, the chunk is retried row by row
+        json.dumps(rows([0])[0]),
+        json.dumps(rows([1002])[0]),
+    ]
+    response = client.post(
+        "/test_table/bulk", data="\n".join(lines), headers={**header, **NDJSON}
+    )
+    report = response.json()
+    assert report["inserted"] == 3
+    assert report["failed"] == 3
+    assert [error["line"] for error in report["errors"]] == [2, 3, 5]
+    assert report["errors"][1]["errors"][0]["loc"] == ["primarykey"]
+    response = client.get("/test_table/1002", headers=header)
+    assert response.status_code == 200
+
+
+def test_single_transaction(tmp_path):
+    client, header = client_factory(tmp_path, bulk_ingest={"commit_every": 0})
+    lines = [json.dumps(row) for row in rows([1000, 1001, 0])]
+    response = client.post(
+        "/test_table/bulk", data="\n".join(lines), headers={**header, **NDJSON}
+    )
+    report = response.json()
+    assert report["rolled_back"]
+    assert report["inserted"] == 0
+    assert report["failed"] == 3
+    response = client.get("/test_table/1000", headers=header)
+    assert response.status_code == 404
+
+
+def test_rows_charged(tmp_path):
+    config = {
+        "test_table": {"ratelimit": {"post": "3/hour"}},
+        "views": {"selection_view": [["Personid", "INTEGER"]]},
+    }
+    client, header = client_factory(tmp_path, config=config)
+    lines = [json.dumps(row) for row in rows(range(1000, 1005))]
+    response = client.post(
+        "/test_table/bulk", data="\n".join(lines), headers={**header, **NDJSON}
+    )
+    # the second chunk of two rows exceeds the limit of three rows
+    assert response.status_code == 429
+    assert response.json()["detail"]["inserted"] == 2
+    assert "Retry-After" in response.headers
+    assert client.get("/test_table/1001", headers=header).status_code == 200
+    assert client.get("/test_table/1002", headers=header).status_code == 404
+
+
+def test_bulk_executor(tmp_path, monkeypatch):
+    client, header = client_factory(tmp_path, executors={"bulk": 1})
+    threads = []
+    ingest_body = BulkIngest.ingest_body
+
+    def recorded(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return ingest_body(*args, **kwargs)
+
+    monkeypatch.setattr(BulkIngest, "ingest_body", recorded)
+    response = client.post(
+        "/test_table/bulk",
+        data=json.dumps(rows([1000])[0]),
+        headers={**header, **NDJSON},
+    )
+    assert response.json()["inserted"] == 1
+    assert threads[0].startswith("apifactory-bulk")
+
+
+def test_unsupported_type(client):
+    client, header = client
+    response = client.post("/test_table/bulk", json=rows([1000]), headers=header)
+    assert response.status_code == 415
+
+
+def test_body_lines_split_chunks():
+    body = "héllo\nwörld\nlast".encode()
+    chunks = [body[:2], body[2:9], body[9:]]
+    assert list(body_lines(iter(chunks))) == ["héllo\n", "wörld\n", "last"]
+    compressed = gzip.compress(body)
+    chunks = [compressed[:5], compressed[5:]]
+    assert list(body_lines(iter(chunks), compressed=True))[-1] == "last"
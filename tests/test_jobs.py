@@ -0,0 +1,139 @@
+"""tests for the asynchronous bulk jobs
+"""
+import os
+import shutil
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apifactory.app_factory import ApiFactory
+from apifactory.jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobStore, now
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_jobs.yaml")
+
+
+def client_factory(tmp_path, **kwargs):
+    database = tmp_path / "jobs.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), database)
+    factory = ApiFactory.from_yaml(
+        file_name,
+        database_url=f"sqlite:///{database}",
+        jobs={"store": str(tmp_path / "store.db"), "workers": 1, "chunk_size": 2},
+        **kwargs,
+    )
+    client = TestClient(factory.app_factory())
+    token = client.post(
+        "/login",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+    ).json()["access_token"]
+    return factory, client, {"Authorization": f"bearer {token}"}
+
+
+@pytest.fixture
+def client(tmp_path):
+    return client_factory(tmp_path)
+
+
+def rows(keys):
+    return [{"primarykey": key, "someothercoll": f"row {key}"} for key in keys]
+
+
+def wait(client, header, location):
+    for _ in range(100):
+        job = client.get(location, headers=header).json()
+        if job["state"] not in (QUEUED, "running"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("job did not finish")
+
+
+def test_insert_job(client):
+    _, client, header = client
+    response = client.post(
+        "/test_table/jobs", json=rows(range(2000, 2005)), headers=header
+    )
+    assert response.status_code == 202
+    job = response.json()
+    assert job["state"] == QUEUED
+    assert job["total"] == 5
+    assert response.headers["location"] == f"/jobs/{job['id']}"
+    job = wait(client, header, response.headers["location"])
+    assert job["state"] == SUCCEEDED
+    assert job["done"] == 5
+    response = client.get("/test_table/2004", headers=header)
+    assert response.json()["someothercoll"] == "row 2004"
+
+
+def test_upsert_job(client):
+    _, client, header = client
+    response = client.put(
+        "/test_table/jobs",
+        json=[{"primarykey": 0, "someothercoll": "updated"}, *rows([2100])],
+        headers=header,
+    )
+    assert response.status_code == 202
+    job = wait(client, header, response.headers["location"])
+    assert job["state"] == SUCCEEDED
+    assert client.get("/test_table/0", headers=header).json()["someothercoll"] == (
+        "updated"
+    )
+    assert client.get("/test_table/2100", headers=header).status_code == 200
+
+
+def test_failed_job_keeps_progress(client):
+    _, client, header = client
+    # the second chunk contains an existing primary key
+    response = client.post(
+        "/test_table/jobs", json=rows([2200, 2201, 2202, 0]), headers=header
+    )
+    job = wait(client, header, response.headers["location"])
+    assert job["state"] == FAILED
+    assert job["done"] == 2
+    assert "UNIQUE" in job["error"]
+    assert client.get("/test_table/2201", headers=header).status_code == 200
+    assert client.get("/test_table/2202", headers=header).status_code == 404
+
+
+def test_unknown_job(client):
+    _, client, header = client
+    assert client.get("/jobs/unknown", headers=header).status_code == 404
+
+
+def test_resume_after_restart(tmp_path):
+    store = JobStore(str(tmp_path / "store.db"))
+    queued = store.create("admin", "test_table", "insert", rows([2300]))
+    running = store.create("admin", "test_table", "insert", rows([2301]))
+    store.claim(running["id"])
+    with store.connect() as connection:
+        # the restarted process got the same process id, the heartbeat stopped
+        connection.execute(
+            "UPDATE jobs SET worker = ?, heartbeat = ?", (os.getpid(), now(-60))
+        )
+    _, client, header = client_factory(tmp_path)
+    assert (
+        client.get(f"/jobs/{running['id']}", headers=header).json()["state"] == FAILED
+    )
+    with client:
+        job = wait(client, header, f"/jobs/{queued['id']}")
+    assert job["state"] == SUCCEEDED
+    assert client.get("/test_table/2300", headers=header).status_code == 200
+
+
+def test_stale_heartbeat_fails_running_job(tmp_path):
+    store = JobStore(str(tmp_path / "store.db"))
+    running = store.create("admin", "test_table", "insert", rows([2400]))
+    store.claim(running["id"])
+    factory, client, header = client_factory(tmp_path)
+    factory.jobs.heartbeat = 0.05
+    # the heartbeat of the claim is recent, its process may still be running
+    assert store.get(running["id"])["state"] == RUNNING
+    with client:
+        for _ in range(100):
+            if store.get(running["id"])["state"] != RUNNING:
+                break
+            time.sleep(0.05)
+    assert store.get(running["id"])["state"] == FAILED
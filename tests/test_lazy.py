@@ -0,0 +1,75 @@
+"""tests for creating the schemas and routers of tables on first use
+"""
+import os
+import threading
+
+from fastapi.testclient import TestClient
+
+from apifactory.app_factory import ApiFactory
+
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test.yaml")
+factory = ApiFactory.from_yaml(file_name, lazy=True)
+app = factory.app_factory()
+
+
+client = TestClient(app)
+
+HEADER = {
+    "accept": "application/json",
+    "Content-Type": "application/x-www-form-urlencoded",
+}
+
+bearer_token = client.post(
+    "/login",
+    headers=HEADER,
+    data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+)
+token = bearer_token.json()["access_token"]
+
+header = {"accept": "application/json", "Authorization": f"bearer {token}"}
+
+
+def test_nothing_created():
+    assert factory.routers.pending.keys() == factory.routers.router_names
+    # only the schema of the users is needed to create the app
+    assert "test_table" not in vars(factory.schemas)
+    assert "Users" in vars(factory.schemas)
+
+
+def test_created_on_request():
+    response = client.get("test_table/0", headers=header)
+    assert response.status_code == 200
+    response = client.get("test_table/", headers=header)
+    assert response.status_code == 200
+    assert "items" in response.json()
+    assert "test_table" not in factory.routers.pending
+    assert "test_table" in vars(factory.schemas)
+    assert "Persons" in factory.routers.pending
+    response = client.get("test_table/9000", headers=header)
+    assert response.status_code == 404
+
+
+def test_created_once():
+    routers = []
+
+    def materialize():
+        routers.append(factory.routers.materialize("Persons"))
+
+    threads = [threading.Thread(target=materialize) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(router is routers[0] for router in routers)
+
+
+def test_complete_document():
+    paths = client.get("/openapi.json").json()["paths"]
+    for name in factory.routers.router_names:
+        assert f"/{name}/" in paths
+    assert not factory.routers.pending
+    response = client.get("Persons/1", headers=header)
+    assert response.status_code == 200
@@ -0,0 +1,102 @@
+"""tests for the metrics of the generated routes
+"""
+import os
+import threading
+import time
+
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from apifactory.app_factory import ApiFactory
+from apifactory.metrics import Counter, Histogram, Metrics
+from apifactory.routing import hooked_route_class
+
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_metrics.yaml")
+app = ApiFactory.from_yaml(file_name).app_factory()
+
+
+client = TestClient(app)
+
+HEADER = {
+    "accept": "application/json",
+    "Content-Type": "application/x-www-form-urlencoded",
+}
+
+bearer_token = client.post(
+    "/login",
+    headers=HEADER,
+    data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+)
+token = bearer_token.json()["access_token"]
+
+header = {"accept": "application/json", "Authorization": f"bearer {token}"}
+
+
+def test_counter_shards():
+    counter = Counter("test_total", "test counter", ("kind",))
+
+    def count():
+        for _ in range(1000):
+            counter.inc(("read",))
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(counter.shards) == 4
+    assert counter.merged() == {("read",): 4000}
+
+
+def test_histogram_buckets():
+    histogram = Histogram("test_seconds", "test histogram", buckets=(1, 2))
+    for value in (0.5, 1.5, 3):
+        histogram.observe(value)
+    lines = histogram.exposition().splitlines()
+    assert 'test_seconds_bucket{le="1"} 1' in lines
+    assert 'test_seconds_bucket{le="2"} 2' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 3' in lines
+    assert "test_seconds_sum 5.0" in lines
+
+
+def test_route_metrics():
+    client.get("test_table/0", headers=header)
+    client.get("test_table/9000", headers=header)
+    response = client.get("/internal/metrics")
+    assert response.status_code == 200
+    body = response.text
+    labels = 'method="GET",route="/test_table/{key}",table="test_table"'
+    assert f'apifactory_requests_total{{{labels},status="200"}} 1' in body
+    assert f'apifactory_requests_total{{{labels},status="404"}} 1' in body
+    assert f"apifactory_requests_in_flight{{{labels}}} 0" in body
+    assert f"apifactory_request_duration_seconds_count{{{labels}}} 2" in body
+    assert f"apifactory_response_size_bytes_count{{{labels}}} 1" in body
+    assert 'apifactory_pool_wait_seconds_count{pool="read"}' in body
+    assert "/internal/metrics" not in app.openapi()["paths"]
+
+
+def test_streamed_response_metrics():
+    metrics = Metrics()
+    router = APIRouter(route_class=hooked_route_class([metrics.route_hook]))
+
+    @router.get("/stream")
+    def stream():
+        def body():
+            time.sleep(0.2)
+            yield b"streamed"
+
+        return StreamingResponse(body())
+
+    test_app = FastAPI()
+    test_app.include_router(router)
+    with TestClient(test_app) as test_client:
+        assert test_client.get("/stream").content == b"streamed"
+    labels = ("GET", "/stream", "")
+    assert metrics.latency.merged()[labels][-2] >= 0.2
+    assert metrics.response_size.merged()[labels][-2:] == [8, 1]
+    assert metrics.requests.merged() == {(*labels, 200): 1}
+    assert metrics.in_flight.merged() == {labels: 0}
@@ -0,0 +1,74 @@
+"""tests for the cached openapi document
+"""
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from apifactory.app_factory import ApiFactory
+
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test.yaml")
+app = ApiFactory.from_yaml(file_name).app_factory()
+
+
+client = TestClient(app)
+
+
+def test_cached_document():
+    response = client.get("/openapi.json")
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert "/test_table/" in response.json()["paths"]
+    assert response.json() == app.openapi()
+    etag = response.headers["etag"]
+    response = client.get("/openapi.json", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_tag_document():
+    response = client.get("/openapi/test_table.json")
+    assert response.status_code == 200
+    document = response.json()
+    assert set(document["paths"]) == {"/test_table/", "/test_table/{key}"}
+    schemas = document["components"]["schemas"]
+    assert "Page_test_table_" in schemas
+    assert "test_table" in schemas
+    assert "Persons" not in schemas
+    assert "OAuth2PasswordBearer" in document["components"]["securitySchemes"]
+    response = client.get("/openapi/unknown.json")
+    assert response.status_code == 404
+
+
+def test_docs():
+    response = client.get("/docs", params={"tag": "test_table"})
+    assert response.status_code == 200
+    assert "/openapi/test_table.json" in response.text
+    response = client.get("/redoc")
+    assert "/openapi.json" in response.text
+
+
+def test_docs_unknown_tag():
+    tag = '"></script><script>alert(1)</script>'
+    for docs in ("/docs", "/redoc"):
+        response = client.get(docs, params={"tag": tag})
+        assert response.status_code == 404
+        assert "<script>alert" not in response.text
+
+
+def test_precomputed_document(tmp_path, monkeypatch):
+    options = {"openapi": {"precompute": True, "directory": str(tmp_path)}}
+    ApiFactory.from_yaml(file_name, **options).app_factory()
+    stored = os.listdir(tmp_path)
+    assert len(stored) == 1
+    assert stored[0].startswith("openapi-")
+
+    def build_document(self):
+        pytest.fail("document should be loaded from disk")
+
+    monkeypatch.setattr(FastAPI, "openapi", build_document)
+    loaded = ApiFactory.from_yaml(file_name, **options).app_factory()
+    assert "/test_table/" in loaded.openapi()["paths"]
@@ -0,0 +1,96 @@
+"""tests for profiling single requests
+"""
+import os
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from apifactory.app_factory import ApiFactory
+
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_profiling.yaml")
+factory = ApiFactory.from_yaml(file_name)
+app = factory.app_factory()
+
+
+client = TestClient(app)
+
+HEADER = {
+    "accept": "application/json",
+    "Content-Type": "application/x-www-form-urlencoded",
+}
+
+bearer_token = client.post(
+    "/login",
+    headers=HEADER,
+    data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+)
+token = bearer_token.json()["access_token"]
+
+header = {"accept": "application/json", "Authorization": f"bearer {token}"}
+
+
+def test_unsigned_request():
+    response = client.get(
+        "test_table/0", headers=header | {"X-Apifactory-Profile": "invalid"}
+    )
+    assert response.status_code == 200
+    assert response.json()["primarykey"] == 0
+
+
+def slow_statement(conn, cursor, statement, parameters, context, executemany):
+    # the endpoint outlasts several sample intervals, however fast the query is
+    time.sleep(0.05)
+
+
+def test_signed_request():
+    signature = factory.profiler.signature("GET", "/test_table/")
+    event.listen(factory.db.engine, "before_cursor_execute", slow_statement)
+    try:
+        response = client.get(
+            "test_table/", headers=header | {"X-Apifactory-Profile": signature}
+        )
+    finally:
+        event.remove(factory.db.engine, "before_cursor_execute", slow_statement)
+    assert response.status_code == 200
+    profile = response.json()
+    assert profile["name"] == "GET /test_table/"
+    frames = {frame["name"] for frame in profile["shared"]["frames"]}
+    # the endpoint runs in the threadpool, its thread is sampled as well
+    assert "get_all" in frames
+
+
+def test_expired_signature():
+    signature = factory.profiler.signature("GET", "/test_table/0", int(time.time()) - 1)
+    response = client.get(
+        "test_table/0", headers=header | {"X-Apifactory-Profile": signature}
+    )
+    assert response.json()["primarykey"] == 0
+    # the expiry is part of the signed message
+    expires, _, digest = factory.profiler.signature("GET", "/test_table/0").partition(
+        ":"
+    )
+    forged = f"{int(expires) + 3600}:{digest}"
+    assert not factory.profiler.verify("GET", "/test_table/0", forged)
+
+
+def test_sampled_requests(tmp_path):
+    sampled = ApiFactory.from_yaml(
+        file_name,
+        profiling={
+            "sample": 2,
+            "directory": str(tmp_path),
+            "max_profiles": 2,
+            "format": "collapsed",
+        },
+    )
+    sampled_client = TestClient(sampled.app_factory())
+    for _ in range(6):
+        response = sampled_client.get("test_table/0", headers=header)
+        assert response.status_code == 200
+    profiles = sorted(os.listdir(tmp_path))
+    assert len(profiles) == 2
+    assert all(profile.endswith(".collapsed.txt") for profile in profiles)
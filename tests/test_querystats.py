@@ -0,0 +1,53 @@
+"""tests for the instrumentation of the statements issued per request
+"""
+import json
+import os
+
+from fastapi.testclient import TestClient
+
+from apifactory.app_factory import ApiFactory
+
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_querystats.yaml")
+app = ApiFactory.from_yaml(file_name).app_factory()
+
+
+client = TestClient(app)
+
+HEADER = {
+    "accept": "application/json",
+    "Content-Type": "application/x-www-form-urlencoded",
+}
+
+bearer_token = client.post(
+    "/login",
+    headers=HEADER,
+    data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+)
+token = bearer_token.json()["access_token"]
+
+header = {"accept": "application/json", "Authorization": f"bearer {token}"}
+
+
+def test_server_timing():
+    response = client.get("test_table/0", headers=header)
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    assert timing.startswith("db;dur=")
+    assert timing.endswith('desc="1 queries"')
+
+
+def test_query_budget(caplog):
+    data = [{"primarykey": key, "someothercoll": "budget"} for key in range(20, 25)]
+    response = client.put("test_table/", headers=header, json=data)
+    assert response.status_code == 500
+    assert "query budget of 3" in response.json()["detail"]
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record["route"] == "/test_table/"
+    assert record["queries"] == 4
+    assert record["problems"] == ["query budget exceeded", "repeated statement"]
+    # statements after the budget are not executed, nothing was committed
+    response = client.get("test_table/20", headers=header)
+    assert response.status_code == 404
@@ -1,6 +1,8 @@
 """testing ratelimiter
 """
 import os
+
+import pytest
 from fastapi.testclient import TestClient
 
 from apifactory.app_factory import ApiFactory
@@ -36,3 +38,67 @@ def test_get_all():
     response = client.get("test_table/", headers=header)
     response = client.get("test_table/", headers=header)
     assert response.status_code == 429
+
+
+route_file_name = os.path.join(BASE_PATH, "testfiles/test_route_ratelimit.yaml")
+route_app = ApiFactory.from_yaml(route_file_name).app_factory()
+route_client = TestClient(route_app)
+route_token = route_client.post(
+    "/login",
+    headers=HEADER,
+    data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+).json()["access_token"]
+route_header = {"accept": "application/json", "Authorization": f"bearer {route_token}"}
+
+
+def test_route_limit():
+    for _ in range(2):
+        response = route_client.get("test_table/0", headers=route_header)
+        assert response.status_code == 200
+    response = route_client.get("test_table/0", headers=route_header)
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    # other methods of the table are not limited
+    response = route_client.get("test_table/", headers=route_header)
+    assert response.status_code == 200
+
+
+def test_route_limit_cost():
+    data = [{"primarykey": 9001}, {"primarykey": 9002}]
+    response = route_client.delete("test_table/", json=data, headers=route_header)
+    assert response.status_code == 200
+    # the second request of two rows exceeds the budget of three rows
+    response = route_client.delete("test_table/", json=data, headers=route_header)
+    assert response.status_code == 429
+
+
+def test_batch_route_limit():
+    batch_client = TestClient(
+        ApiFactory.from_yaml(
+            route_file_name, batch={"max_operations": 50}
+        ).app_factory()
+    )
+    batch_token = batch_client.post(
+        "/login",
+        headers=HEADER,
+        data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+    ).json()["access_token"]
+    batch_header = {"Authorization": f"bearer {batch_token}"}
+    get_id = {"method": "get", "table": "test_table", "key": 0}
+    response = batch_client.post("/batch", json=[get_id], headers=batch_header)
+    assert response.status_code == 200
+    # one operation is left of the budget of two
+    response = batch_client.post("/batch", json=[get_id] * 20, headers=batch_header)
+    assert response.status_code == 429
+    assert batch_client.get("test_table/0", headers=batch_header).status_code == 200
+    response = batch_client.get("test_table/0", headers=batch_header)
+    assert response.status_code == 429
+    # other methods of the table are not limited
+    get_all = {"method": "get", "table": "test_table"}
+    response = batch_client.post("/batch", json=[get_all] * 5, headers=batch_header)
+    assert response.status_code == 200
+
+
+def test_unknown_ratelimit_key():
+    with pytest.raises(ValueError, match="ratelimit_key token is not one of ip, user"):
+        ApiFactory.from_yaml(file_name, ratelimit_key="token")
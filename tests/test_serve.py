@@ -0,0 +1,59 @@
+"""tests for the prefork launcher
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+import requests
+
+pytest.importorskip("uvicorn")
+
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test.yaml")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_serve_workers():
+    port = free_port()
+    master = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "apifactory",
+            "serve",
+            file_name,
+            "--port",
+            str(port),
+            "--workers",
+            "2",
+        ],
+        cwd=os.path.dirname(BASE_PATH),
+    )
+    try:
+        for _ in range(100):
+            try:
+                response = requests.get(f"http://127.0.0.1:{port}/openapi.json")
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        assert response.status_code == 200
+        assert "/test_table/" in response.json()["paths"]
+        response = requests.post(
+            f"http://127.0.0.1:{port}/login",
+            data={"username": "admin", "password": "admin"},
+        )
+        assert response.status_code == 200
+    finally:
+        master.send_signal(signal.SIGTERM)
+        assert master.wait(timeout=10) == 0
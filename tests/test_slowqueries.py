@@ -0,0 +1,94 @@
+"""tests for the slow query log of the generated endpoints
+"""
+import os
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from apifactory import slowqueries
+from apifactory.app_factory import ApiFactory
+
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_slowqueries.yaml")
+factory = ApiFactory.from_yaml(file_name)
+app = factory.app_factory()
+
+
+client = TestClient(app)
+
+HEADER = {
+    "accept": "application/json",
+    "Content-Type": "application/x-www-form-urlencoded",
+}
+
+bearer_token = client.post(
+    "/login",
+    headers=HEADER,
+    data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+)
+token = bearer_token.json()["access_token"]
+
+header = {"accept": "application/json", "Authorization": f"bearer {token}"}
+
+
+def test_slow_query_plan():
+    # the login query is not part of a generated endpoint
+    assert not factory.slow_queries.records
+    response = client.get("test_table/?someothercoll=test", headers=header)
+    assert response.status_code == 200
+    response = client.get("/admin/slow-queries", headers=header)
+    assert response.status_code == 200
+    records = response.json()
+    assert records
+    filtered = [record for record in records if "someothercoll" in record["statement"]]
+    assert filtered[0]["route"] == "/test_table/"
+    assert filtered[0]["table"] == "test_table"
+    assert "str" in filtered[0]["parameters"]
+    assert "test" not in filtered[0]["parameters"]
+    assert any("SCAN" in row for row in filtered[0]["plan"])
+
+
+def test_plan_on_separate_connection(monkeypatch):
+    statement_connections = []
+    plan_connections = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if "someothercoll" in statement:
+            statement_connections.append(conn.connection.dbapi_connection)
+
+    def spy(dialect, dbapi_connection, statement, parameters):
+        plan_connections.append(dbapi_connection.dbapi_connection)
+        return query_plan(dialect, dbapi_connection, statement, parameters)
+
+    query_plan = slowqueries.query_plan
+    monkeypatch.setattr(slowqueries, "query_plan", spy)
+    event.listen(factory.db.engine, "before_cursor_execute", record)
+    try:
+        client.get("test_table/?someothercoll=plan", headers=header)
+    finally:
+        event.remove(factory.db.engine, "before_cursor_execute", record)
+    assert plan_connections
+    assert not set(map(id, plan_connections)) & set(map(id, statement_connections))
+
+
+def test_no_plan_for_unknown_dialect():
+    assert slowqueries.query_plan("oracle", None, "SELECT 1", ()) is None
+
+
+def test_bounded_records():
+    for key in range(10):
+        client.get(f"test_table/{key}", headers=header)
+    assert len(factory.slow_queries.records) == 5
+
+
+def test_admin_only():
+    response = client.get("/admin/slow-queries")
+    assert response.status_code == 401
+    factory.slow_queries.admin_users = {"someone"}
+    try:
+        response = client.get("/admin/slow-queries", headers=header)
+        assert response.status_code == 403
+    finally:
+        factory.slow_queries.admin_users = {"admin"}
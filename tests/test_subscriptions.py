@@ -0,0 +1,152 @@
+"""tests for the change subscriptions
+"""
+import asyncio
+import json
+import os
+import shutil
+
+import pytest
+from fastapi.testclient import TestClient
+
+from apifactory.app_factory import ApiFactory
+from apifactory.subscriptions import LocalBus, Subscriptions
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_subscriptions.yaml")
+
+
+@pytest.fixture
+def factory(tmp_path):
+    database = tmp_path / "subscriptions.db"
+    shutil.copy(os.path.join(BASE_PATH, "testdb/test.db"), database)
+    factory = ApiFactory.from_yaml(
+        file_name,
+        database_url=f"sqlite:///{database}",
+        jobs={"store": str(tmp_path / "store.db"), "workers": 1, "chunk_size": 2},
+    )
+    client = TestClient(factory.app_factory())
+    token = client.post(
+        "/login",
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+    ).json()["access_token"]
+    return factory, client, {"Authorization": f"bearer {token}"}
+
+
+async def connected():
+    return False
+
+
+async def next_event(stream):
+    async def read():
+        while True:
+            message = await stream.__anext__()
+            if not message.startswith(":"):
+                name, data = message.strip().split("\n")
+                return name[len("event: ") :], json.loads(data[len("data: ") :])
+
+    # heartbeats are skipped, so the wait covers them too
+    return await asyncio.wait_for(read(), 1)
+
+
+def test_committed_writes_are_pushed(factory):
+    factory, client, header = factory
+    subscriptions = factory.subscriptions
+
+    async def subscribe():
+        subscriber = subscriptions.subscribe("test_table", {"someothercoll": "pushed"})
+        stream = subscriptions.stream(subscriber, connected)
+        loop = asyncio.get_running_loop()
+
+        def write():
+            client.post(
+                "/test_table/",
+                json=[
+                    {"primarykey": 5000, "someothercoll": "other"},
+                    {"primarykey": 5001, "someothercoll": "pushed"},
+                ],
+                headers=header,
+            )
+            client.put(
+                "/test_table/5001", json={"someothercoll": "pushed"}, headers=header
+            )
+            client.delete("/test_table/5000", headers=header)
+
+        await loop.run_in_executor(None, write)
+        events = [await next_event(stream) for _ in range(3)]
+        await stream.aclose()
+        return events
+
+    events = asyncio.run(subscribe())
+    assert [name for name, _ in events] == ["insert", "update", "delete"]
+    assert events[0][1]["entry"] == {"primarykey": 5001, "someothercoll": "pushed"}
+    assert events[1][1]["key"] == 5001
+    assert events[2][1] == {
+        "table": "test_table",
+        "operation": "delete",
+        "key": 5000,
+        "entry": None,
+    }
+    assert not subscriptions.subscribers["test_table"]
+
+
+def test_bulk_writes_are_pushed(factory):
+    factory, client, header = factory
+    subscriptions = factory.subscriptions
+
+    async def subscribe():
+        subscriber = subscriptions.subscribe("test_table", {})
+        stream = subscriptions.stream(subscriber, connected)
+        loop = asyncio.get_running_loop()
+
+        def write():
+            rows = [
+                {"primarykey": key, "someothercoll": "bulk"} for key in (5100, 5101)
+            ]
+            client.post(
+                "/test_table/bulk",
+                data="\n".join(json.dumps(row) for row in rows),
+                headers={**header, "Content-Type": "application/x-ndjson"},
+            )
+            client.put(
+                "/test_table/jobs",
+                json=[{"primarykey": 5100, "someothercoll": "job"}],
+                headers=header,
+            )
+
+        await loop.run_in_executor(None, write)
+        events = [await next_event(stream) for _ in range(3)]
+        await stream.aclose()
+        return events
+
+    events = asyncio.run(subscribe())
+    assert [(name, event["key"]) for name, event in events] == [
+        ("insert", 5100),
+        ("insert", 5101),
+        ("update", 5100),
+    ]
+    assert events[2][1]["entry"] == {"primarykey": 5100, "someothercoll": "job"}
+
+
+def test_slow_subscriber_overflows():
+    subscriptions = Subscriptions(bus=LocalBus(), heartbeat=0.05, max_queue=2)
+
+    async def subscribe():
+        subscriber = subscriptions.subscribe("test_table", {})
+        stream = subscriptions.stream(subscriber, connected)
+        assert await stream.__anext__() == ": subscribed\n\n"
+        for key in range(3):
+            subscriptions.publish("test_table", "delete", key)
+        await asyncio.sleep(0)
+        messages = [message async for message in stream]
+        return messages
+
+    assert asyncio.run(subscribe()) == ["event: overflow\ndata: {}\n\n"]
+
+
+def test_subscribe_invalid_filter(factory):
+    _, client, header = factory
+    response = client.get("/test_table/subscribe?unknown=1", headers=header)
+    assert response.status_code == 400
+    assert client.get("/test_table/subscribe").status_code == 401
@@ -0,0 +1,127 @@
+"""tests for statement timeouts and cancellation
+"""
+import asyncio
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+
+from apifactory.app_factory import ApiFactory
+from apifactory.timeouts import (
+    GUARD_KEY,
+    DisconnectWatcher,
+    StatementCancelledError,
+    StatementGuard,
+    StatementTimeoutError,
+    StatementTimeouts,
+    enforces_timeouts,
+)
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+
+file_name = os.path.join(BASE_PATH, "testfiles/test_timeouts.yaml")
+app = ApiFactory.from_yaml(file_name).app_factory()
+
+
+client = TestClient(app)
+
+HEADER = {
+    "accept": "application/json",
+    "Content-Type": "application/x-www-form-urlencoded",
+}
+
+bearer_token = client.post(
+    "/login",
+    headers=HEADER,
+    data="grant_type=&username=admin&password=admin&scope=&client_id=&client_secret=",
+)
+token = bearer_token.json()["access_token"]
+
+header = {"accept": "application/json", "Authorization": f"bearer {token}"}
+
+ENDLESS_QUERY = text(
+    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) "
+    "SELECT count(*) FROM c"
+)
+
+
+def guarded_session(timeout):
+    engine = create_engine("sqlite://")
+    StatementTimeouts.install(engine)
+    session = Session(engine)
+    guard = StatementGuard(timeout)
+    event.listen(session, "after_begin", guard.attach)
+    return session, guard
+
+
+def test_sqlite_timeout():
+    session, _ = guarded_session(0.05)
+    with pytest.raises(StatementTimeoutError):
+        session.execute(ENDLESS_QUERY)
+    session.close()
+
+
+def test_sqlite_cancel():
+    session, guard = guarded_session(None)
+    timer = threading.Timer(0.05, guard.cancel)
+    timer.start()
+    with pytest.raises(StatementCancelledError):
+        session.execute(ENDLESS_QUERY)
+    session.close()
+
+
+def test_guard_removed_at_checkin():
+    session, _ = guarded_session(5)
+    info = session.connection().info
+    assert info[GUARD_KEY]
+    session.close()
+    assert GUARD_KEY not in info
+
+
+def test_guarded_routes():
+    response = client.get("test_table/", headers=header)
+    assert response.status_code == 200
+    response = client.get("test_table/0", headers=header)
+    assert response.status_code == 200
+
+
+def test_disconnect_watcher_keeps_body():
+    messages = [
+        {"type": "http.request", "body": b"a", "more_body": True},
+        {"type": "http.request", "body": b"b", "more_body": True},
+        {"type": "http.request", "body": b"c", "more_body": False},
+        {"type": "http.disconnect"},
+    ]
+
+    async def receive():
+        await asyncio.sleep(0.01)
+        return messages.pop(0)
+
+    async def run():
+        request = SimpleNamespace(_receive=receive)
+        guard = StatementGuard(None)
+        watcher = asyncio.ensure_future(DisconnectWatcher(request).watch(guard))
+        body = b""
+        while True:
+            message = await request._receive()
+            body += message["body"]
+            if not message["more_body"]:
+                break
+        await asyncio.wait_for(watcher, 1)
+        return body, guard.cancelled
+
+    assert asyncio.run(run()) == (b"abc", True)
+
+
+def test_timeouts_unsupported_driver():
+    engine = SimpleNamespace(dialect=SimpleNamespace(name="mssql", driver="pymssql"))
+    assert not enforces_timeouts(engine)
+    with pytest.raises(ValueError):
+        StatementTimeouts([engine], default_timeout=5)
+    timeouts = StatementTimeouts([engine], cancel_on_disconnect=True)
+    with pytest.raises(ValueError):
+        timeouts.session_getter(lambda: None, {"statement_timeout": 5}, "get")
@@ -5,7 +5,11 @@ from sqlalchemy.orm import declarative_base
 from sqlalchemy import Column, Integer
 
 
-from apifactory.utils import PrimaryKeyAmountError, primary_key_checker
+from apifactory.utils import (
+    PrimaryKeyAmountError,
+    primary_key_checker,
+    quality_values,
+)
 
 
 def test_primarykeyerror():
@@ -24,3 +28,12 @@ def test_primary_key_checker():
 
     with pytest.raises(PrimaryKeyAmountError):
         primary_key_checker(Failure)
+
+
+def test_quality_values():
+    header = "application/JSON;q=0.5, gzip ; q=bad, , */*"
+    assert quality_values(header) == [
+        ("application/json", 0.5),
+        ("gzip", 0.0),
+        ("*/*", 1.0),
+    ]